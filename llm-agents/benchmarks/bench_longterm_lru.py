@@ -0,0 +1,69 @@
+"""
+Benchmark the LRU metadata cache of MultiUserLongTermMemory.
+
+Simulates N agents cycling through the long-term memory with a cache smaller
+than the population, and reports the cost per access and the cache metrics.
+
+Usage:
+    python benchmarks/bench_longterm_lru.py --agents 1000 --capacity 200 --rounds 5
+"""
+import sys
+import os
+import argparse
+import random
+import tempfile
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(this_dir, ".."))
+
+from settings import settings
+
+args = argparse.ArgumentParser()
+args.add_argument("--agents", type=int, default=1000, help="Number of simulated agents")
+args.add_argument("--capacity", type=int, default=200, help="max_loaded_metadata of the cache")
+args.add_argument("--rounds", type=int, default=5, help="Number of passes over all agents")
+args.add_argument("--hot-ratio", type=float, default=0.8, help="Share of accesses going to the hot set")
+args.add_argument("--seed", type=int, default=1)
+
+
+def run_pattern(name: str, memory, person_ids: list[str]):
+    memory.metrics.update({"cache_hits": 0, "cache_misses": 0, "cache_evictions": 0, "memory_cleanups": 0})
+    start = time.perf_counter()
+    for person_id in person_ids:
+        memory.ensure_user_initialized(person_id)
+    duration = time.perf_counter() - start
+
+    stats = memory.get_system_stats()
+    print(f"[{name}] {len(person_ids)} accesses in {duration:.3f}s "
+          f"({duration / max(len(person_ids), 1) * 1e6:.1f} us/access), "
+          f"hits={stats['cache_hits']}, misses={stats['cache_misses']}, "
+          f"evictions={stats['cache_evictions']}, hit_ratio={stats['cache_hit_ratio']:.2f}, "
+          f"loaded={stats['loaded_users_in_cache']}")
+
+
+if __name__ == "__main__":
+    args = args.parse_args()
+    rnd = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        settings.force_reload_paths(workdir=workdir)
+
+        from llm.longterm import MultiUserLongTermMemory
+
+        memory = MultiUserLongTermMemory(
+            storage_dir=os.path.join(workdir, "long_term_memory"),
+            max_loaded_metadata=args.capacity,
+        )
+        agents = [f"agent_{i}" for i in range(args.agents)]
+
+        # Round-robin over all agents: the worst case for an LRU smaller than the population
+        run_pattern("round-robin", memory, agents * args.rounds)
+
+        # Skewed access: most accesses hit a working set that fits in the cache
+        hot = agents[:max(args.capacity * 3 // 4, 1)]
+        skewed = [
+            rnd.choice(hot) if rnd.random() < args.hot_ratio else rnd.choice(agents)
+            for _ in range(args.agents * args.rounds)
+        ]
+        run_pattern("skewed", memory, skewed)
@@ -0,0 +1,81 @@
+"""
+Benchmark PersonScheduler.next_activity: bisection over the ActivityTimetable against the linear scan.
+
+Builds N people with a home activity and a few daily activities, then sweeps a day in sync ticks,
+calling next_activity for every person on every tick, and checks both lookups agree.
+
+Usage:
+    python benchmarks/bench_person_scheduler.py --agents 100000 --ticks 96
+"""
+import sys
+import os
+import argparse
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(this_dir, ".."))
+
+from loguru import logger
+
+args = argparse.ArgumentParser()
+args.add_argument("--agents", type=int, default=100000, help="Number of simulated agents")
+args.add_argument("--ticks", type=int, default=96, help="Number of sync ticks over the day")
+args.add_argument("--max-activities", type=int, default=5, help="Maximum number of activities per agent")
+args.add_argument("--seed", type=int, default=1)
+
+
+def make_person(rnd: random.Random, i: int, max_activities: int):
+    activities = [Activity(id=f"{i}-home", start_time=-1, end_time=-1, purpose="home")]
+    start_time = rnd.randint(5 * 3600, 10 * 3600)
+    for k in range(rnd.randint(1, max_activities)):
+        end_time = start_time + rnd.randint(1800, 4 * 3600)
+        activities.append(Activity(id=f"{i}-{k}", start_time=start_time, end_time=end_time, purpose=rnd.choice(["work", "education", "shop", "leisure"])))
+        start_time = end_time + rnd.randint(600, 3600)
+        if start_time > 22 * 3600:
+            break
+    return Person.model_construct(
+        person_id=f"person_{i}",
+        identity=PersonalIdentity.model_construct(name=f"person {i}", traits_json={}, activities=activities),
+        state=PersonState(),
+        is_llm_based=False,
+    )
+
+
+def run(name: str, lookups: list, timestamps: list[int]) -> list:
+    results = []
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        results.extend([lookup(timestamp) for lookup in lookups])
+    duration = time.perf_counter() - start
+    calls = len(lookups) * len(timestamps)
+    print(f"[{name}] {calls} calls in {duration:.3f}s ({duration / max(calls, 1) * 1e6:.2f} us/call, "
+          f"{duration / max(len(timestamps), 1) * 1000:.1f} ms/tick)")
+    return results
+
+
+if __name__ == "__main__":
+    args = args.parse_args()
+    rnd = random.Random(args.seed)
+    logger.remove()
+
+    from models import Activity, Person, PersonalIdentity, PersonState
+    from world.population import WorldPopulation
+
+    people = [make_person(rnd, i, args.max_activities) for i in range(args.agents)]
+    population = WorldPopulation(population_loader=None)
+    population.people = {person.person_id: person for person in people}
+
+    day_start = 1742428800  # a midnight
+    timestamps = [day_start + i * (24 * 3600 // args.ticks) for i in range(args.ticks)]
+
+    start = time.perf_counter()
+    schedulers = {person.person_id: population.get_person_default_scheduler(person) for person in people}
+    print(f"[timetables] built for {len(people)} agents in {time.perf_counter() - start:.3f}s")
+
+    linear = run("linear", [s.next_activity_linear for s in schedulers.values()], timestamps)
+    bisected = run("bisect", [s.next_activity for s in schedulers.values()], timestamps)
+    assert [a.id if a else None for a in linear] == [a.id if a else None for a in bisected], "lookups disagree"
+
+    bisectable = sum(1 for s in schedulers.values() if s.timetable.bisectable)
+    print(f"Both lookups agree, {bisectable}/{len(people)} timetables bisectable")
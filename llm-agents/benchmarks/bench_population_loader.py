@@ -0,0 +1,106 @@
+"""
+Benchmark SyntheticPopulationLoader against the row by row reference loader, and check they build the same people.
+
+The reference reads the whole activities gpkg in file order and walks it row by row, as the loader did
+before it was vectorized. The loader is run from the gpkg (bbox read through the R-tree), from the
+activity index, and with a stage 2 reading the whole bbox instead of filtering on person_id.
+
+Usage:
+    python benchmarks/bench_population_loader.py --bbox 1.40 43.58 1.46 43.62
+"""
+import sys
+import os
+import argparse
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(this_dir, ".."))
+
+from loguru import logger
+
+args = argparse.ArgumentParser()
+args.add_argument("--bbox", type=float, nargs=4, default=[1.40, 43.58, 1.46, 43.62], metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"))
+
+
+def load_reference(bbox) -> dict:
+    """person_id -> (home, activities) with the semantics of the row by row loader"""
+    persons_df = pd.read_csv(os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}persons.csv"), delimiter=';')
+    households_df = pd.read_csv(os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}households.csv"), delimiter=';')
+    activities_df = gpd.read_file(
+        os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}activities.gpkg"),
+    ).to_crs(settings.world.geo_crs)
+    activities_df = activities_df.cx[bbox.min_lon:bbox.max_lon, bbox.min_lat:bbox.max_lat]
+    persons_df = persons_df[persons_df["person_id"].isin(activities_df[activities_df["purpose"] == "home"]["person_id"].unique())]
+    persons_df = persons_df.merge(households_df, on="household_id")
+
+    people = {str(person_id): [None, []] for person_id in persons_df["person_id"]}
+    rows = zip(
+        activities_df["person_id"].astype(str),
+        activities_df["start_time"].fillna(NAN_TIME_VALUE).astype(float),
+        activities_df["end_time"].fillna(NAN_TIME_VALUE).astype(float),
+        activities_df["purpose"],
+        activities_df.geometry.x,
+        activities_df.geometry.y,
+    )
+    for person_id, start_time, end_time, purpose, lon, lat in rows:
+        if person_id not in people:
+            continue
+        if purpose == "home":
+            people[person_id][0] = (lon, lat)
+        if purpose == "other":
+            continue
+        activities = people[person_id][1]
+        if activities and activities[-1][2] == purpose:
+            activities[-1][1] = max(activities[-1][1], end_time)
+        else:
+            activities.append([start_time, end_time, purpose, lon, lat])
+
+    reference = {}
+    for person_id, (home, activities) in people.items():
+        activities.sort(key=lambda activity: activity[0])
+        if len(activities) > 3 and any(activity[2] in ["work", "education"] for activity in activities):
+            reference[person_id] = (home, [tuple(activity) for activity in activities])
+    return reference
+
+
+def people_key(people) -> dict:
+    return {
+        person.person_id: (
+            (person.identity.home.lon, person.identity.home.lat) if person.identity.home else None,
+            [(a.start_time, a.end_time, a.purpose, a.location.lon, a.location.lat) for a in person.identity.activities],
+        )
+        for person in people
+    }
+
+
+def run(name: str, load) -> dict:
+    start = time.perf_counter()
+    result = load()
+    print(f"[{name}] {len(result)} people in {time.perf_counter() - start:.2f}s")
+    return result
+
+
+if __name__ == "__main__":
+    args = args.parse_args()
+    logger.remove()
+
+    import pandas as pd
+    import geopandas as gpd
+    from settings import settings
+    from models import BBox
+    from inputs.population.synthetic import NAN_TIME_VALUE, SyntheticPopulationLoader
+
+    bbox = BBox(min_lon=args.bbox[0], min_lat=args.bbox[1], max_lon=args.bbox[2], max_lat=args.bbox[3])
+    reference = run("reference", lambda: load_reference(bbox))
+
+    settings.data.synthetic_spatial_index = False
+    from_gpkg = run("gpkg", lambda: people_key(SyntheticPopulationLoader().load_population(None, bbox)))
+    settings.data.synthetic_spatial_index = True
+    from_index = run("index", lambda: people_key(SyntheticPopulationLoader().load_population(None, bbox)))
+    SyntheticPopulationLoader.MAX_ATTRIBUTE_FILTER_IDS = 0
+    wide = run("index, whole bbox stage 2", lambda: people_key(SyntheticPopulationLoader().load_population(None, bbox)))
+
+    for name, result in [("gpkg", from_gpkg), ("index", from_index), ("index, whole bbox stage 2", wide)]:
+        different = [person_id for person_id in reference.keys() | result.keys() if reference.get(person_id) != result.get(person_id)]
+        assert not different, f"[{name}] {len(different)} people differ from the reference, e.g. {different[:5]}"
+    print("All loaders agree with the reference")
@@ -0,0 +1,77 @@
+"""
+Benchmark the re-ranking of retrieved long-term memory nodes.
+
+Builds N candidate nodes with concept tags and timestamps, then times
+MultiUserLongTermMemory.rank_nodes over them.
+
+Usage:
+    python benchmarks/bench_rank_nodes.py --candidates 500 --repeat 1000
+"""
+import sys
+import os
+import argparse
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(this_dir, ".."))
+
+from loguru import logger
+from settings import settings
+
+args = argparse.ArgumentParser()
+args.add_argument("--candidates", type=int, default=500, help="Number of retrieved nodes to rank")
+args.add_argument("--repeat", type=int, default=1000, help="Number of rank_nodes calls")
+args.add_argument("--seed", type=int, default=1)
+
+WORDS = [
+    "Bus", "Metro", "Tram", "line", "69", "20", "L1", "A", "B", "late", "delay", "crowded", "reliable",
+    "Jean", "Jaures", "Capitole", "Arenes", "Ramonville", "Blum", "stop", "transfer", "walking",
+    "Weekday", "Weekend", "morning", "afternoon", "evening", "night", "work", "education", "shop", "leisure",
+]
+
+
+def random_phrase(rnd: random.Random, n_words: int) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(n_words))
+
+
+if __name__ == "__main__":
+    args = args.parse_args()
+    rnd = random.Random(args.seed)
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        settings.force_reload_paths(workdir=workdir)
+
+        from llm.longterm import MemorySearchResult, MultiUserLongTermMemory
+
+        memory = MultiUserLongTermMemory(storage_dir=os.path.join(workdir, "long_term_memory"))
+
+        query_at = int(datetime(2025, 3, 20, 8, 0).timestamp())
+        query = random_phrase(rnd, 200)
+        nodes = []
+        for i in range(args.candidates):
+            # Reflections have no tags, concepts have "<keywords>,<spatial_scope>,<time_scope>,<purpose>"
+            tags = ",".join(random_phrase(rnd, rnd.randint(1, 3)) for _ in range(4)) if i % 4 else ""
+            timestamp = datetime.fromtimestamp(query_at) - timedelta(hours=rnd.randint(1, 30 * 24))
+            nodes.append(MemorySearchResult(
+                content=random_phrase(rnd, 30),
+                metadata={
+                    "tags": tags,
+                    "timestamp": timestamp.isoformat(),
+                    "timestamp_s": int(timestamp.timestamp()),
+                },
+                score=rnd.random(),
+            ))
+
+        # First call tokenises the tags, as aadd_memory would at insert time
+        memory.rank_nodes(query, query_at, nodes)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            memory.rank_nodes(query, query_at, nodes)
+        duration = time.perf_counter() - start
+
+        print(f"rank_nodes over {args.candidates} candidates: {duration / args.repeat * 1e6:.1f} us/call")
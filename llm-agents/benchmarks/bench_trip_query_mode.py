@@ -0,0 +1,106 @@
+"""
+Benchmark the trip query modes over the OTP or in-process RAPTOR trip helper: shifted (one query per
+trip_query_range offset) against range (RangeTripHelper, one search over the same span).
+
+Routes N random stop to stop trips as the scenario loop does (get_itineraries_many, one decision per
+query) and reports the upstream calls per decision of the routing stats.
+
+Usage:
+    python benchmarks/bench_trip_query_mode.py --mode RAPTOR --queries 200
+    python benchmarks/bench_trip_query_mode.py --mode OTP --queries 50
+"""
+import sys
+import os
+import argparse
+import asyncio
+import random
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(this_dir, ".."))
+
+from loguru import logger
+
+args = argparse.ArgumentParser()
+args.add_argument("--mode", choices=["OTP", "RAPTOR"], default="RAPTOR", help="Trip helper wrapped by the cache")
+args.add_argument("--queries", type=int, default=200, help="Number of routing decisions")
+args.add_argument("--departure-time", type=int, default=1742454000, help="Earliest departure (a weekday morning)")
+args.add_argument("--seed", type=int, default=1)
+
+
+def make_queries(rnd: random.Random, stops, n: int, departure_time: int) -> list:
+    queries = []
+    for _ in range(n):
+        origin, destination = rnd.sample(range(len(stops)), 2)
+        queries.append(TripQuery(
+            origin=Location(lon=float(stops["stop_lon"].iloc[origin]), lat=float(stops["stop_lat"].iloc[origin])),
+            destination=Location(lon=float(stops["stop_lon"].iloc[destination]), lat=float(stops["stop_lat"].iloc[destination])),
+            departure_time=departure_time + rnd.randint(0, 3 * 3600),
+        ))
+    return queries
+
+
+async def get_shifted_itineraries(trip_helper, queries: list) -> list:
+    """One query per trip_query_range offset, the distinct plans of a decision kept as CachedTripHelper does"""
+    offsets = settings.gtfs.trip_query_range
+    shifted_queries = [
+        query.model_copy(update={"departure_time": query.departure_time + offset * 60})
+        for query in queries
+        for offset in offsets
+    ]
+    shifted_results = await trip_helper.get_itineraries_many(shifted_queries)
+    results = []
+    for i in range(len(queries)):
+        plans = {}
+        for plan in (plan for found in shifted_results[i * len(offsets):(i + 1) * len(offsets)] for plan in found):
+            plans.setdefault(plan.get_code(), plan)
+        results.append(list(plans.values())[:settings.gtfs.max_trip_candidates])
+    return results
+
+
+def run(query_mode: str, trip_helper, queries: list):
+    routing_stats.counters.clear()
+    routing_stats.latencies.clear()
+    routing_stats.decisions = 0
+
+    start = time.perf_counter()
+    routing_stats.record_decisions(len(queries))
+    if query_mode == "range":
+        results = asyncio.run(RangeTripHelper(trip_helper).get_itineraries_many(queries))
+    else:
+        results = asyncio.run(get_shifted_itineraries(trip_helper, queries))
+    duration = time.perf_counter() - start
+    summary = routing_stats.get_summary()
+    print(f"[{query_mode}] {len(queries)} decisions in {duration:.2f}s, "
+          f"upstream calls per decision: {summary['upstream_calls_per_decision']:.2f}, "
+          f"with itineraries: {sum(1 for r in results if r)}, "
+          f"itineraries: {sum(len(r) for r in results)}, "
+          f"counters: {summary['counters']}")
+
+
+if __name__ == "__main__":
+    args = args.parse_args()
+    logger.remove()
+
+    from settings import settings
+    from models import Location
+    from inputs.gtfs import GTFSData
+    from trip_helper import TripQuery
+    from trip_helper.range_triphelper import RangeTripHelper
+    from trip_helper.stats import RoutingStats
+
+    routing_stats = RoutingStats.get_instance()
+    routing_stats.log_interval = 0
+
+    gtfs_data = GTFSData.DEFAULT()
+    if args.mode == "OTP":
+        from trip_helper.otp import OTPTripHelper
+        trip_helper = OTPTripHelper(endpoint=settings.gtfs.otp_endpoint, gtfs_data=gtfs_data)
+    else:
+        from trip_helper.raptor import RaptorTripHelper
+        trip_helper = RaptorTripHelper(gtfs_data=gtfs_data)
+
+    queries = make_queries(random.Random(args.seed), gtfs_data.stops, args.queries, args.departure_time)
+    print(f"trip_query_range: {settings.gtfs.trip_query_range} minutes, otp_max_pages: {settings.gtfs.otp_max_pages}")
+    for query_mode in ("shifted", "range"):
+        run(query_mode, trip_helper, queries)
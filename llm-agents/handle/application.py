@@ -9,6 +9,8 @@ from gama_models import GamaPersonData, MessageResponse, MessageType, WorldInitR
 from scenarios.base import BaseScenario, Observation
 from handle.websocket import WebSocketClient
 from settings import settings
+from trip_helper.stats import RoutingStats
+from llm.prompt_stats import PromptStats
 import traceback
 from fastapi import FastAPI
 
@@ -181,6 +183,13 @@ async def sync(request: WorldSyncRequest):
             error="Scenario not set"
         )
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "routing": RoutingStats.get_instance().get_summary(),
+        "prompts": PromptStats.get_instance().get_summary(),
+    }
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,4 +1,5 @@
 from typing import Optional
+import pandas as pd
 from models import Person, BBox
 
 
@@ -6,6 +7,24 @@ class PopulationLoader:
     def load_population(self, max_size: int, bbox: Optional[BBox]=None) -> list[Person]:
         raise NotImplementedError("This method should be overridden by subclasses")
 
+    def source_fingerprint(self) -> str:
+        """Identifies the source data and parameters of the population, to invalidate the population cache"""
+        return self.__class__.__name__
+
 class Filter:
     def is_valid(self, person: Person) -> bool:
         raise NotImplementedError("This method should be overridden by subclasses")
+
+    def filter_many(self, people: list[Person]) -> list[Person]:
+        """The valid people, in order; filters override it with a batch implementation"""
+        return [person for person in people if self.is_valid(person)]
+
+    def fingerprint(self) -> str:
+        return self.__class__.__name__
+
+    def filter_frame(self, activities: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """
+        Vectorized is_valid over an activity table (person_id, start_time, end_time, purpose, lon, lat):
+        the activities of the valid people, or None when the filter only works on Person objects.
+        """
+        return None
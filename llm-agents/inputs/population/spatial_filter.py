@@ -1,8 +1,9 @@
 import numpy as np
+import pandas as pd
 from scipy.spatial import cKDTree
 from inputs.population.base import Filter
 from models import Location
-from utils import world_projection
+from utils import world_projection, world_projection_many
 
 
 class PersonCloseToTheStopFilter(Filter):
@@ -13,6 +14,42 @@ class PersonCloseToTheStopFilter(Filter):
         points = [np.array(world_projection(stop)) for stop in stop_locations]
         self.tree = cKDTree(points)
 
+    def fingerprint(self) -> str:
+        return f"{self.__class__.__name__}(max_distance={self.max_distance}, stops={len(self.stop_locations)})"
+
+    def far_from_stops(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """Mask of the points without a stop within max_distance, with one batch nearest-stop query"""
+        x, y = world_projection_many(lons, lats)
+        # inclusive bound, as query_ball_point
+        distances, _ = self.tree.query(
+            np.column_stack([x, y]),
+            k=1,
+            distance_upper_bound=np.nextafter(self.max_distance, np.inf),
+            workers=-1,
+        )
+        return np.isinf(distances)
+
+    def filter_frame(self, activities: pd.DataFrame) -> pd.DataFrame:
+        located = activities.dropna(subset=["lon", "lat"])
+        far = self.far_from_stops(located["lon"].to_numpy(), located["lat"].to_numpy())
+        invalid_ids = located["person_id"].to_numpy()[far]
+        return activities[~activities["person_id"].isin(invalid_ids)]
+
+    def filter_many(self, people: list) -> list:
+        # flatten the activity locations of everybody, with the index of their person
+        owners, lons, lats = [], [], []
+        for i, person in enumerate(people):
+            for activity in person.identity.activities:
+                if activity.location:
+                    owners.append(i)
+                    lons.append(activity.location.lon)
+                    lats.append(activity.location.lat)
+        if not owners:
+            return list(people)
+        far = self.far_from_stops(np.array(lons), np.array(lats))
+        n_far = np.bincount(np.array(owners)[far], minlength=len(people))
+        return [person for person, n in zip(people, n_far) if n == 0]
+
     def is_valid(self, person) -> bool:
         activitie_locations = [world_projection(activity.location) for activity in person.identity.activities if activity.location]
         for loc in activitie_locations:
@@ -0,0 +1,215 @@
+import math
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from scipy.spatial import cKDTree
+from models import BBox, Location
+from utils import world_projection_many
+
+
+def within_distance(lons: np.ndarray, lats: np.ndarray, locations: list[Location], max_distance: float) -> np.ndarray:
+    """Mask of the points with one of the locations within max_distance (projected meters, inclusive)"""
+    if not locations or len(lons) == 0:
+        return np.zeros(len(lons), dtype=bool)
+    tree = cKDTree(np.column_stack(world_projection_many(
+        np.array([location.lon for location in locations]),
+        np.array([location.lat for location in locations]),
+    )))
+    distances, _ = tree.query(
+        np.column_stack(world_projection_many(lons, lats)),
+        k=1,
+        distance_upper_bound=np.nextafter(max_distance, np.inf),
+        workers=-1,
+    )
+    return np.isfinite(distances)
+
+
+class ActivityGridIndex:
+    """
+    Grid buckets over the activity locations of the synthetic population (geo CRS), saved as an npz file
+    next to the activities gpkg.
+
+    The index holds the columns needed to select people (feature id, person_id, purpose, lon, lat), sorted
+    by grid cell with `cell_offsets` delimiting the cells, so a bbox, a corridor or a stop buffer only reads
+    the rows of the cells it touches instead of scanning the gpkg. The file is rebuilt when the gpkg changes.
+    """
+    VERSION = 1
+
+    def __init__(self,
+                 cell_size: float,
+                 min_lon: float,
+                 min_lat: float,
+                 nx: int,
+                 ny: int,
+                 cell_offsets: np.ndarray,
+                 fids: np.ndarray,
+                 person_ids: np.ndarray,
+                 purposes: np.ndarray,
+                 purpose_codes: np.ndarray,
+                 lons: np.ndarray,
+                 lats: np.ndarray):
+        self.cell_size = cell_size
+        self.min_lon = min_lon
+        self.min_lat = min_lat
+        self.nx = nx
+        self.ny = ny
+        self.cell_offsets = cell_offsets
+        self.fids = fids
+        self.person_ids = person_ids
+        self.purposes = purposes
+        self.purpose_codes = purpose_codes
+        self.lons = lons
+        self.lats = lats
+
+    def __len__(self) -> int:
+        return len(self.fids)
+
+    @classmethod
+    def build(cls, activities: pd.DataFrame, cell_size: float) -> "ActivityGridIndex":
+        """From an activity table with fid, person_id, purpose, lon, lat columns, the unlocated rows are left out"""
+        activities = activities.dropna(subset=["lon", "lat"])
+        lons = activities["lon"].to_numpy(dtype=np.float64)
+        lats = activities["lat"].to_numpy(dtype=np.float64)
+        min_lon, min_lat = float(lons.min()), float(lats.min())
+        nx = int((lons.max() - min_lon) // cell_size) + 1
+        ny = int((lats.max() - min_lat) // cell_size) + 1
+        ix = ((lons - min_lon) // cell_size).astype(np.int64)
+        iy = ((lats - min_lat) // cell_size).astype(np.int64)
+        cells = iy * nx + ix
+        # stable: file order inside a cell
+        order = np.argsort(cells, kind="stable")
+        cell_offsets = np.zeros(nx * ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=nx * ny), out=cell_offsets[1:])
+
+        purposes, purpose_codes = np.unique(activities["purpose"].to_numpy(dtype=str), return_inverse=True)
+        return cls(
+            cell_size=cell_size,
+            min_lon=min_lon,
+            min_lat=min_lat,
+            nx=nx,
+            ny=ny,
+            cell_offsets=cell_offsets,
+            fids=activities["fid"].to_numpy(dtype=np.int64)[order],
+            person_ids=activities["person_id"].to_numpy(dtype=str)[order],
+            purposes=purposes,
+            purpose_codes=purpose_codes.astype(np.int16)[order],
+            lons=lons[order],
+            lats=lats[order],
+        )
+
+    def save(self, file_path: str, source_stamp: str):
+        tmp_file = f"{file_path}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(
+                f,
+                version=np.array(self.VERSION),
+                source_stamp=np.array(source_stamp),
+                grid=np.array([self.cell_size, self.min_lon, self.min_lat, self.nx, self.ny], dtype=np.float64),
+                cell_offsets=self.cell_offsets,
+                fids=self.fids,
+                person_ids=self.person_ids,
+                purposes=self.purposes,
+                purpose_codes=self.purpose_codes,
+                lons=self.lons,
+                lats=self.lats,
+            )
+        os.replace(tmp_file, file_path)
+
+    @classmethod
+    def load(cls, file_path: str, source_stamp: str) -> Optional["ActivityGridIndex"]:
+        """None when the file is missing, from another version or built from another gpkg"""
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path, allow_pickle=False) as data:
+            if int(data["version"]) != cls.VERSION or str(data["source_stamp"]) != source_stamp:
+                logger.info(f"Activity index {file_path} is outdated")
+                return None
+            cell_size, min_lon, min_lat, nx, ny = data["grid"].tolist()
+            return cls(
+                cell_size=cell_size,
+                min_lon=min_lon,
+                min_lat=min_lat,
+                nx=int(nx),
+                ny=int(ny),
+                cell_offsets=data["cell_offsets"],
+                fids=data["fids"],
+                person_ids=data["person_ids"],
+                purposes=data["purposes"],
+                purpose_codes=data["purpose_codes"],
+                lons=data["lons"],
+                lats=data["lats"],
+            )
+
+    def _rows_in_bbox(self, bbox: BBox) -> np.ndarray:
+        """Rows of the cells touching the bbox, then clipped exactly"""
+        ix0 = max(int((bbox.min_lon - self.min_lon) // self.cell_size), 0)
+        ix1 = min(int((bbox.max_lon - self.min_lon) // self.cell_size), self.nx - 1)
+        iy0 = max(int((bbox.min_lat - self.min_lat) // self.cell_size), 0)
+        iy1 = min(int((bbox.max_lat - self.min_lat) // self.cell_size), self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return np.zeros(0, dtype=np.int64)
+        # the cells of a grid row are contiguous: one slice per row of cells
+        rows = np.concatenate([
+            np.arange(self.cell_offsets[iy * self.nx + ix0], self.cell_offsets[iy * self.nx + ix1 + 1])
+            for iy in range(iy0, iy1 + 1)
+        ])
+        lons, lats = self.lons[rows], self.lats[rows]
+        inside = (lons >= bbox.min_lon) & (lons <= bbox.max_lon) & (lats >= bbox.min_lat) & (lats <= bbox.max_lat)
+        return rows[inside]
+
+    def _table(self, rows: np.ndarray) -> pd.DataFrame:
+        """Activity table of the rows, in file order"""
+        rows = rows[np.argsort(self.fids[rows], kind="stable")]
+        return pd.DataFrame({
+            "person_id": self.person_ids[rows],
+            "purpose": self.purposes[self.purpose_codes[rows]],
+            "lon": self.lons[rows],
+            "lat": self.lats[rows],
+        })
+
+    def query_bbox(self, bbox: Optional[BBox] = None) -> pd.DataFrame:
+        """Activity table (person_id, purpose, lon, lat) inside the bbox, everything without one"""
+        if bbox is None:
+            return self._table(np.arange(len(self)))
+        return self._table(self._rows_in_bbox(bbox))
+
+    def query_near(self,
+                   locations: list[Location],
+                   max_distance: float,
+                   purpose: Optional[str] = None,
+                   bbox: Optional[BBox] = None) -> pd.DataFrame:
+        """
+        Activities within max_distance (meters) of one of the locations: a stop buffer,
+        or a corridor given as points along a line (spaced less than max_distance apart).
+        `purpose` and `bbox` restrict the activities further.
+        """
+        if not locations:
+            return self._table(np.zeros(0, dtype=np.int64))
+        # cells of the bbox around the locations, with the margin converted to degrees
+        lons = np.array([location.lon for location in locations])
+        lats = np.array([location.lat for location in locations])
+        # the projected meters overestimate the ground distance, so a ground margin is wide enough
+        margin_lat = max_distance / 111_320
+        margin_lon = margin_lat / max(math.cos(math.radians(np.abs(lats).max())), 1e-6)
+        search_bbox = BBox(
+            min_lon=lons.min() - margin_lon,
+            min_lat=lats.min() - margin_lat,
+            max_lon=lons.max() + margin_lon,
+            max_lat=lats.max() + margin_lat,
+        )
+        if bbox is not None:
+            search_bbox = BBox(
+                min_lon=max(search_bbox.min_lon, bbox.min_lon),
+                min_lat=max(search_bbox.min_lat, bbox.min_lat),
+                max_lon=min(search_bbox.max_lon, bbox.max_lon),
+                max_lat=min(search_bbox.max_lat, bbox.max_lat),
+            )
+        rows = self._rows_in_bbox(search_bbox)
+        if purpose is not None:
+            codes = np.flatnonzero(self.purposes == purpose)
+            rows = rows[np.isin(self.purpose_codes[rows], codes)]
+        rows = rows[within_distance(self.lons[rows], self.lats[rows], locations, max_distance)]
+        return self._table(rows)
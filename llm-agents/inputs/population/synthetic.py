@@ -1,5 +1,5 @@
+import copy
 import json
-import random
 from typing import Optional
 from faker import Faker
 import os
@@ -9,6 +9,8 @@ import geopandas as gpd
 from settings import settings
 from models import Activity, Location, Person, PersonalIdentity, BBox
 from inputs.population.base import Filter, PopulationLoader
+from inputs.population.spatial_index import ActivityGridIndex, within_distance
+from pyproj import Transformer
 from utils import random_uuid
 
 NAN_TIME_VALUE = -1
@@ -25,114 +27,303 @@ def generate_name_by_gender(gender):
     return fake.name()
 
 class SyntheticPopulationLoader(PopulationLoader):
-    def __init__(self, filters: Optional[list[Filter]] = None):
+    """
+    Loads the synthetic population in two stages over person ids:
+
+    1. the columns the filters need (person_id, purpose, location) are read for the whole bbox, from the
+       ActivityGridIndex saved next to the gpkg when enabled, then cleaned, merged and filtered in pandas
+       (bbox, homes `around` the given locations, activity requirements, filters with `filter_frame`);
+    2. the candidate ids are sampled with the seed, and only the activities of the sampled people are read
+       again in full (attribute filter on person_id) and built as Person objects.
+    """
+    MIN_ACTIVITIES = 4
+    REQUIRED_PURPOSES = ["work", "education"]
+    # above this number of people, stage 2 reads the whole bbox instead of filtering on person_id
+    MAX_ATTRIBUTE_FILTER_IDS = 20000
+    ATTRIBUTE_FILTER_CHUNK = 1000
+
+    def __init__(self,
+                 filters: Optional[list[Filter]] = None,
+                 seed: Optional[int] = None,
+                 around: Optional[list[Location]] = None,
+                 around_distance: float = 500):
+        """`around`: only the people living within `around_distance` meters of these locations (stops, corridor points)"""
         self.filters = filters
-        
-    def make_sure_time_valid(self, time) -> float:
-        if np.isnan(time):
-            return NAN_TIME_VALUE
-        return float(time)
-    
-    @classmethod
-    def merge_duplicated_activities(cls, activities: list[Activity]) -> list[Activity]:
-        l = []
-        cur = None
-        for activity in activities:
-            if cur is None or cur.purpose != activity.purpose:
-                cur = activity
-                l.append(cur)
-                continue
-            cur.end_time = max(cur.end_time, activity.end_time)
-        return l
-    
-    def load_population(self, max_size: int, bbox: Optional[BBox]=None) -> list[Person]:
+        self.seed = seed if seed is not None else settings.data.population_seed
+        self.around = around
+        self.around_distance = around_distance
+
+    @property
+    def activities_file(self) -> str:
+        return os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}activities.gpkg")
+
+    @property
+    def activity_index_file(self) -> str:
+        return os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}activities.grid.npz")
+
+    def source_fingerprint(self) -> str:
+        files = []
+        for suffix in ("persons.csv", "households.csv", "activities.gpkg"):
+            file_path = os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}{suffix}")
+            stat = os.stat(file_path) if os.path.exists(file_path) else None
+            files.append(f"{suffix}:{stat.st_size}:{int(stat.st_mtime)}" if stat else f"{suffix}:missing")
+        filters = [f.fingerprint() for f in self.filters or []]
+        around = f";around={len(self.around)}@{self.around_distance}" if self.around is not None else ""
+        return f"{self.__class__.__name__}({','.join(files)};{','.join(filters)};seed={self.seed}{around})"
+
+    def read_person_ids(self) -> pd.Series:
+        """Ids of the people with a household, in the order of the persons file"""
         persons_df = pd.read_csv(
             os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}persons.csv"),
             delimiter=';',
+            usecols=["person_id", "household_id"],
         )
-        if max_size is None:
-            size = len(persons_df)
-        else:
-            size = min(max_size, len(persons_df))
-
         households_df = pd.read_csv(
             os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}households.csv"),
             delimiter=';',
+            usecols=["household_id"],
         )
-        activities_df = gpd.read_file(
-            os.path.join(settings.data.synthetic_dir, f"{settings.data.synthetic_file_prefix}activities.gpkg"),
-        ).to_crs(settings.world.geo_crs)
+        persons_df = persons_df[persons_df["household_id"].isin(households_df["household_id"])]
+        return persons_df["person_id"].astype(str).reset_index(drop=True)
+
+    def source_bbox(self, bbox: BBox) -> tuple[float, float, float, float]:
+        """The bbox in the CRS of the activities file, for the spatial index of the gpkg"""
+        file_crs = gpd.read_file(self.activities_file, rows=1).crs
+        transformer = Transformer.from_crs(settings.world.geo_crs, file_crs, always_xy=True)
+        return transformer.transform_bounds(bbox.min_lon, bbox.min_lat, bbox.max_lon, bbox.max_lat)
+
+    @staticmethod
+    def person_id_filter(person_ids: list[str]) -> str:
+        """SQL attribute filter on person_id, numeric ids are not quoted"""
+        if all(person_id.isdigit() for person_id in person_ids):
+            values = ",".join(person_ids)
+        else:
+            values = ",".join("'" + person_id.replace("'", "''") + "'" for person_id in person_ids)
+        return f"person_id IN ({values})"
+
+    def read_activities(self,
+                        bbox: Optional[BBox] = None,
+                        columns: Optional[list[str]] = None,
+                        person_ids: Optional[list[str]] = None) -> pd.DataFrame:
+        """
+        Activity table (person_id, start_time, end_time, purpose, lon, lat) in file order, clipped to the bbox.
+        `columns` restricts the attributes read (person_id and purpose are always read), `person_ids` the people.
+        """
+        # feature ids as index to restore the file order: bbox reads go through the R-tree of the gpkg
+        kwargs = {"fid_as_index": True}
+        if columns is not None:
+            kwargs["columns"] = list(dict.fromkeys(["person_id", "purpose", *columns]))
+        if bbox is not None:
+            kwargs["bbox"] = self.source_bbox(bbox)
 
+        if person_ids is not None and len(person_ids) <= self.MAX_ATTRIBUTE_FILTER_IDS:
+            chunks = [
+                gpd.read_file(
+                    self.activities_file,
+                    where=self.person_id_filter(person_ids[i:i + self.ATTRIBUTE_FILTER_CHUNK]),
+                    **kwargs,
+                )
+                for i in range(0, len(person_ids), self.ATTRIBUTE_FILTER_CHUNK)
+            ]
+            activities_df = pd.concat(chunks) if chunks else gpd.read_file(self.activities_file, rows=0, **kwargs)
+        else:
+            activities_df = gpd.read_file(self.activities_file, **kwargs)
+        # merge_activities and home_locations rely on the file order, across the chunks and the R-tree
+        activities_df = activities_df.sort_index(kind="stable").to_crs(settings.world.geo_crs)
         if bbox is not None:
             activities_df = activities_df.cx[bbox.min_lon:bbox.max_lon, bbox.min_lat:bbox.max_lat]
-            person_ids = activities_df[activities_df["purpose"] == "home"]["person_id"].unique()
-            persons_df = persons_df[persons_df["person_id"].isin(person_ids)]
 
-        # if size < len(persons_df):
-        #     persons_df = persons_df.sample(size, random_state=1)
+        table = {
+            "person_id": activities_df["person_id"].astype(str).to_numpy(),
+            "purpose": activities_df["purpose"].to_numpy(),
+            "lon": activities_df.geometry.x.to_numpy(),
+            "lat": activities_df.geometry.y.to_numpy(),
+        }
+        for time_column in ("start_time", "end_time"):
+            if time_column in activities_df:
+                table[time_column] = activities_df[time_column].fillna(NAN_TIME_VALUE).astype(float).to_numpy()
+        activities = pd.DataFrame(table)
+        if person_ids is not None:
+            activities = activities[activities["person_id"].isin(person_ids)]
+        return activities
 
-        persons_df = persons_df.merge(households_df, on="household_id")
+    def activity_index(self) -> ActivityGridIndex:
+        """The grid index of the activity locations, built from the gpkg and saved when missing or outdated"""
+        stat = os.stat(self.activities_file)
+        cell_size = settings.data.synthetic_index_cell_size
+        source_stamp = f"{stat.st_size}:{int(stat.st_mtime)}:{settings.world.geo_crs}:{cell_size}"
+        index = ActivityGridIndex.load(self.activity_index_file, source_stamp)
+        if index is not None:
+            return index
 
-        traits = json.load(open(TRAIT_FILE_PATH))  
+        print(f"Building the activity index {self.activity_index_file}")
+        activities_df = gpd.read_file(self.activities_file, columns=["person_id", "purpose"], fid_as_index=True)
+        activities_df = activities_df.to_crs(settings.world.geo_crs)
+        index = ActivityGridIndex.build(pd.DataFrame({
+            "fid": activities_df.index.to_numpy(),
+            "person_id": activities_df["person_id"].astype(str).to_numpy(),
+            "purpose": activities_df["purpose"].to_numpy(),
+            "lon": activities_df.geometry.x.to_numpy(),
+            "lat": activities_df.geometry.y.to_numpy(),
+        }), cell_size)
+        index.save(self.activity_index_file, source_stamp)
+        return index
 
-        people_dict = {}
-        for _, row in persons_df.iterrows():
-            trait = random.choice(traits)
-            trait = json.loads(json.dumps(trait, ensure_ascii=False))
+    def home_ids_around(self,
+                        activities: pd.DataFrame,
+                        bbox: Optional[BBox],
+                        index: Optional[ActivityGridIndex]) -> np.ndarray:
+        """Ids of the people with a home in the bbox within around_distance of the `around` locations"""
+        if index is not None:
+            homes = index.query_near(self.around, self.around_distance, purpose="home", bbox=bbox)
+        else:
+            homes = activities[activities["purpose"] == "home"].dropna(subset=["lon", "lat"])
+            homes = homes[within_distance(homes["lon"].to_numpy(), homes["lat"].to_numpy(), self.around, self.around_distance)]
+        return homes["person_id"].unique()
+
+    @classmethod
+    def home_locations(cls, activities: pd.DataFrame) -> pd.DataFrame:
+        """lon, lat of the last home activity of each person"""
+        homes = activities[activities["purpose"] == "home"]
+        return homes.groupby("person_id", sort=False)[["lon", "lat"]].last()
+
+    @classmethod
+    def merge_activities(cls, activities: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drop the `other` activities, merge the consecutive activities of a person with the same purpose
+        (first row, latest end time), then sort the activities of each person by start time.
+        Without the time columns, the activities stay in file order.
+        """
+        activities = activities[activities["purpose"] != "other"]
+        # group the rows of each person, keeping their file order
+        activities = activities.sort_values("person_id", kind="stable")
+        person_ids = activities["person_id"]
+        purposes = activities["purpose"]
+        continued = person_ids.eq(person_ids.shift()) & purposes.eq(purposes.shift())
+        block = (~continued).cumsum()
+        aggregations = {
+            "person_id": ("person_id", "first"),
+            "start_time": ("start_time", "first"),
+            "end_time": ("end_time", "max"),
+            "purpose": ("purpose", "first"),
+            "lon": ("lon", "first"),
+            "lat": ("lat", "first"),
+        }
+        merged = activities.groupby(block.to_numpy(), sort=False).agg(
+            **{name: aggregation for name, aggregation in aggregations.items() if aggregation[0] in activities}
+        )
+        if "start_time" not in merged:
+            return merged.reset_index(drop=True)
+        return merged.sort_values(["person_id", "start_time"], kind="stable").reset_index(drop=True)
+
+    @classmethod
+    def filter_requirements(cls, activities: pd.DataFrame) -> pd.DataFrame:
+        """Keep the people with at least MIN_ACTIVITIES activities, one of them work or education"""
+        by_person = activities.groupby("person_id", sort=False)
+        n_activities = by_person["purpose"].transform("size")
+        has_required = activities["purpose"].isin(cls.REQUIRED_PURPOSES).groupby(activities["person_id"], sort=False).transform("any")
+        return activities[(n_activities >= cls.MIN_ACTIVITIES) & has_required]
+
+    def build_people(self,
+                     person_ids: list[str],
+                     activities: pd.DataFrame,
+                     homes: pd.DataFrame,
+                     rng: np.random.Generator) -> list[Person]:
+        traits = json.load(open(TRAIT_FILE_PATH))
+        rows_by_person = activities.groupby("person_id", sort=False).indices
+        start_times = activities["start_time"].to_numpy()
+        end_times = activities["end_time"].to_numpy()
+        purposes = activities["purpose"].to_numpy()
+        lons = activities["lon"].to_numpy()
+        lats = activities["lat"].to_numpy()
+
+        people = []
+        for person_id in person_ids:
+            trait = copy.deepcopy(traits[rng.integers(len(traits))])
             trait["name"] = generate_name_by_gender(trait["gender"])
-            person = Person(
-                person_id=str(row["person_id"]),
+            home = None
+            if person_id in homes.index:
+                home_lon, home_lat = homes.loc[person_id]
+                home = Location(lon=home_lon, lat=home_lat)
+            people.append(Person(
+                person_id=person_id,
                 identity=PersonalIdentity(
                     name=trait["name"],
                     traits_json=trait,
-                    activities=[],
+                    home=home,
+                    activities=[
+                        Activity(
+                            id=random_uuid(),
+                            start_time=start_times[i],
+                            end_time=end_times[i],
+                            purpose=purposes[i],
+                            location=Location(lon=lons[i], lat=lats[i]),
+                        )
+                        for i in rows_by_person[person_id]
+                    ],
                 ),
-                purpose="home",
-            )
-            people_dict[person.person_id] = person
-
-        # Append activities to people
-        for _, row in activities_df.iterrows():
-            person_id = str(row["person_id"])
-            if person_id not in people_dict:
-                continue
-            person = people_dict[person_id]
-            activity = Activity(
-                id=random_uuid(),
-                start_time=self.make_sure_time_valid(row["start_time"]),
-                end_time=self.make_sure_time_valid(row["end_time"]),
-                purpose=row["purpose"],
-                location=Location(
-                    lon=row["geometry"].x, lat=row["geometry"].y),
-            )
-            if activity.purpose == "home":
-                people_dict[person_id].identity.home = activity.location
-            if activity.purpose == "other":
+            ))
+        return people
+
+    def materialize(self, person_ids: list[str], bbox: Optional[BBox], rng: np.random.Generator) -> list[Person]:
+        """Stage 2: read all the columns of the activities of these people only, and build them"""
+        activities = self.read_activities(bbox, person_ids=person_ids)
+        homes = self.home_locations(activities)
+        return self.build_people(person_ids, self.merge_activities(activities), homes, rng)
+
+    def load_population(self, max_size: int, bbox: Optional[BBox]=None) -> list[Person]:
+        rng = np.random.default_rng(self.seed)
+        if self.seed is not None:
+            fake.seed_instance(self.seed)
+        person_ids = self.read_person_ids()
+        # Stage 1: the columns needed to select the people
+        index = None
+        if settings.data.synthetic_spatial_index:
+            index = self.activity_index()
+            activities = index.query_bbox(bbox)
+        else:
+            activities = self.read_activities(bbox, columns=["person_id", "purpose"])
+
+        if bbox is not None:
+            # people living in the bbox
+            home_ids = activities.loc[activities["purpose"] == "home", "person_id"].unique()
+            person_ids = person_ids[person_ids.isin(home_ids)]
+        if self.around is not None:
+            person_ids = person_ids[person_ids.isin(self.home_ids_around(activities, bbox, index))]
+        activities = activities[activities["person_id"].isin(person_ids)]
+        activities = self.filter_requirements(self.merge_activities(activities))
+
+        # Apply filter if provided, vectorized when the filter supports it, on the people otherwise
+        person_filters = []
+        for filter in self.filters or []:
+            before_len = activities["person_id"].nunique()
+            filtered = filter.filter_frame(activities)
+            if filtered is None:
+                person_filters.append(filter)
                 continue
-            person.identity.activities.append(activity)
-        # Merge duplicated activities
-        for person in people_dict.values():
-            person.identity.activities = self.merge_duplicated_activities(person.identity.activities)
-            person.identity.activities.sort(key=lambda x: x.start_time)
-
-        people = list(people_dict.values())
-
-        # Require people with at least 3 activities
-        people = [
-            person for person in people 
-            if len(person.identity.activities) > 3 and \
-                next((activity for activity in person.identity.activities if activity.purpose in ["work", "education"]), None)
-        ]
-
-        # Apply filter if provided
-        if self.filters is not None:
-            for filter in self.filters:
-                before_len = len(people)
-                people = [person for person in people if filter.is_valid(person)]
-                print(f"Filtered {before_len - len(people)} people by filter {filter.__class__.__name__}, total remaining: {len(people)}")
-
-        if size < len(people):
-            people = np.random.choice(people, size, replace=False)
+            activities = filtered
+            print(f"Filtered {before_len - activities['person_id'].nunique()} people by filter {filter.__class__.__name__}, total remaining: {activities['person_id'].nunique()}")
+
+        candidate_ids = person_ids[person_ids.isin(activities["person_id"])].tolist()
+        size = len(candidate_ids) if max_size is None else min(max_size, len(candidate_ids))
+        if size < len(candidate_ids) or person_filters:
+            # sample the ids, in a random order
+            candidate_ids = [candidate_ids[i] for i in rng.permutation(len(candidate_ids))]
+
+        if not person_filters:
+            people = self.materialize(candidate_ids[:size], bbox, rng)
+        else:
+            # build the candidates in batches until enough pass the filters on the people
+            people = []
+            for start in range(0, len(candidate_ids), max(size, 1)):
+                batch = self.materialize(candidate_ids[start:start + max(size, 1)], bbox, rng)
+                for filter in person_filters:
+                    batch = filter.filter_many(batch)
+                people.extend(batch)
+                if len(people) >= size:
+                    break
+            print(f"Filtered the people by {', '.join(f.__class__.__name__ for f in person_filters)}, built {len(people)}")
+            people = people[:size]
 
         print(f"Loaded {len(people)} people from synthetic population data")
 
@@ -15,7 +15,8 @@ from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.embeddings.ollama import OllamaEmbedding
 
-from llm.vllm_server import OpenAIvLLM
+from llm.vllm_server import OpenAIvLLM, RecordReplayLLM
+from llm.synthetic import SyntheticEmbedding, SyntheticLLM
 
 
 class LLMConfig:
@@ -35,6 +36,21 @@ class LLMConfig:
             **kwargs
         )
     
+    @staticmethod
+    def create_record_replay_llm(model: str, mode: str = "replay", store_path: str = "llm_records.jsonl", **kwargs) -> RecordReplayLLM:
+        """Create record/replay LLM"""
+        return RecordReplayLLM(
+            model=model,
+            mode=mode,
+            store_path=store_path,
+            **kwargs
+        )
+    
+    @staticmethod
+    def create_synthetic_llm(model: str = "synthetic", **kwargs) -> SyntheticLLM:
+        """Create synthetic LLM"""
+        return SyntheticLLM(model=model, **kwargs)
+    
     @staticmethod
     def create_ollama_llm(model: str = "llama2", base_url: str = "http://localhost:11434", **kwargs) -> Ollama:
         """Create Ollama LLM"""
@@ -71,6 +87,11 @@ class EmbeddingConfig:
         """Create HuggingFace embedding"""
         return HuggingFaceEmbedding(model_name=model_name, **kwargs)
     
+    @staticmethod
+    def create_synthetic_embedding(model_name: str = "synthetic", **kwargs) -> SyntheticEmbedding:
+        """Create synthetic embedding"""
+        return SyntheticEmbedding(model_name=model_name, **kwargs)
+    
     @staticmethod
     def create_ollama_embedding(model_name: str = "llama2", base_url: str = "http://localhost:11434", **kwargs) -> OllamaEmbedding:
         """Create Ollama embedding"""
@@ -89,11 +110,11 @@ class EmbeddingConfig:
 @dataclass
 class ModelConfig:
     """Configuration for LLM and embedding models"""
-    llm_provider: str  # 'openai', 'vllm', 'ollama', 'huggingface', 'custom'
+    llm_provider: str  # 'openai', 'vllm', 'record_replay', 'synthetic', 'ollama', 'huggingface', 'custom'
     llm_model: str
     llm_kwargs: Dict[str, Any]
     
-    embedding_provider: str  # 'openai', 'huggingface', 'ollama', 'custom'
+    embedding_provider: str  # 'openai', 'huggingface', 'synthetic', 'ollama', 'custom'
     embedding_model: str
     embedding_kwargs: Dict[str, Any]
     
@@ -121,6 +142,30 @@ class ModelConfig:
             embedding_kwargs={}
         )
     
+    @classmethod
+    def create_record_replay_config(cls, llm_model: str, mode: str, store_path: str, embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2", **kwargs) -> 'ModelConfig':
+        """Create record/replay configuration, recording from or replaying an OpenAI-compatible server"""
+        return cls(
+            llm_provider="record_replay",
+            llm_model=llm_model,
+            llm_kwargs={"mode": mode, "store_path": store_path, **kwargs},
+            embedding_provider="huggingface",
+            embedding_model=embedding_model,
+            embedding_kwargs={}
+        )
+    
+    @classmethod
+    def create_synthetic_config(cls, llm_model: str = "synthetic", **kwargs) -> 'ModelConfig':
+        """Create synthetic configuration, a fake LLM and embedding for load tests"""
+        return cls(
+            llm_provider="synthetic",
+            llm_model=llm_model,
+            llm_kwargs=kwargs or {},
+            embedding_provider="synthetic",
+            embedding_model="synthetic",
+            embedding_kwargs={}
+        )
+    
     @classmethod
     def create_ollama_config(cls, llm_model: str = "llama2", embedding_model: str = "llama2", base_url: str = "http://localhost:11434") -> 'ModelConfig':
         """Create Ollama configuration"""
@@ -151,6 +196,10 @@ class ModelConfig:
             return LLMConfig.create_openai_llm(self.llm_model, use_async=use_async, **self.llm_kwargs)
         elif self.llm_provider == "vllm":
             return LLMConfig.create_vllm_llm(self.llm_model, use_async=use_async, **self.llm_kwargs)
+        elif self.llm_provider == "record_replay":
+            return LLMConfig.create_record_replay_llm(self.llm_model, use_async=use_async, **self.llm_kwargs)
+        elif self.llm_provider == "synthetic":
+            return LLMConfig.create_synthetic_llm(self.llm_model, use_async=use_async, **self.llm_kwargs)
         elif self.llm_provider == "ollama":
             return LLMConfig.create_ollama_llm(self.llm_model, use_async=use_async, **self.llm_kwargs)
         elif self.llm_provider == "huggingface":
@@ -164,6 +213,8 @@ class ModelConfig:
             return EmbeddingConfig.create_openai_embedding(self.embedding_model, **self.embedding_kwargs)
         elif self.embedding_provider == "huggingface":
             return EmbeddingConfig.create_huggingface_embedding(self.embedding_model, **self.embedding_kwargs)
+        elif self.embedding_provider == "synthetic":
+            return EmbeddingConfig.create_synthetic_embedding(self.embedding_model, **self.embedding_kwargs)
         elif self.embedding_provider == "ollama":
             return EmbeddingConfig.create_ollama_embedding(self.embedding_model, **self.embedding_kwargs)
         else:
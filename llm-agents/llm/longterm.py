@@ -1,11 +1,13 @@
 # scalable_memory.py - Scalable long-term memory system optimized for 1000+ users
 import os
 import json
-import gc
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import string
 import traceback
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from pathlib import Path
 import hashlib
 from dataclasses import dataclass
@@ -33,6 +35,142 @@ from llama_index.core.vector_stores.types import BasePydanticVectorStore
 
 from llm.memory import MemoryEntry
 
+
+def memory_timestamp(metadata: dict) -> Optional[int]:
+    """Epoch seconds of a vector node, falling back to the ISO timestamp of older nodes"""
+    timestamp = metadata.get("timestamp_s")
+    if timestamp is not None:
+        return int(timestamp)
+    try:
+        return int(datetime.fromisoformat(metadata["timestamp"]).timestamp())
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class MemoryTimeIndex:
+    """Time-sorted memory entries of one person, indexed by epoch seconds for bisect lookups"""
+
+    def __init__(self, entries: Optional[List[MemoryEntry]] = None):
+        self.timestamps = array('q')
+        self.entries: List[MemoryEntry] = []
+        for entry in sorted(entries or [], key=lambda e: e.timestamp):
+            self.timestamps.append(int(entry.timestamp.timestamp()))
+            self.entries.append(entry)
+
+    def add(self, entry: MemoryEntry):
+        """Insert an entry, O(1) when entries arrive in time order"""
+        timestamp = int(entry.timestamp.timestamp())
+        if not self.timestamps or self.timestamps[-1] <= timestamp:
+            self.timestamps.append(timestamp)
+            self.entries.append(entry)
+            return
+        index = bisect_right(self.timestamps, timestamp)
+        self.timestamps.insert(index, timestamp)
+        self.entries.insert(index, entry)
+
+    def since(self, from_timestamp: int) -> List[MemoryEntry]:
+        """Entries with timestamp >= from_timestamp, oldest first"""
+        return self.entries[bisect_left(self.timestamps, from_timestamp):]
+
+    def count_since(self, from_timestamp: int) -> int:
+        return len(self.entries) - bisect_left(self.timestamps, from_timestamp)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, split on whitespace and strip punctuation around each token"""
+    tokens = [token.strip(string.punctuation) for token in text.lower().split()]
+    return [token for token in tokens if token]
+
+
+class TagTokenIndex:
+    """
+    Pre-tokenised memory tags for vectorized keyword scoring.
+    Tokens and bigrams get dense integer ids; the unique unigram and bigram ids of
+    each tags string are stored contiguously in an array-backed arena.
+    """
+
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.bigram_vocabulary: Dict[Tuple[int, int], int] = {}
+        self.tag_keys: Dict[str, int] = {}
+        self.token_arena = array('q')
+        # per tags string: offset in the arena, number of unigrams, number of bigrams
+        self.span_offsets = array('q')
+        self.span_unigrams = array('q')
+        self.span_bigrams = array('q')
+
+    def add(self, tags: str) -> int:
+        """Tokenise a tags string once, return its key in the index"""
+        key = self.tag_keys.get(tags)
+        if key is not None:
+            return key
+
+        token_ids = [self.vocabulary.setdefault(token, len(self.vocabulary)) for token in tokenize(tags)]
+        unigrams = set(token_ids)
+        bigrams = {
+            self.bigram_vocabulary.setdefault(pair, len(self.bigram_vocabulary))
+            for pair in zip(token_ids[:-1], token_ids[1:])
+        }
+
+        key = len(self.span_offsets)
+        self.span_offsets.append(len(self.token_arena))
+        self.span_unigrams.append(len(unigrams))
+        self.span_bigrams.append(len(bigrams))
+        self.token_arena.extend(unigrams)
+        self.token_arena.extend(bigrams)
+        self.tag_keys[tags] = key
+        return key
+
+    def overlap_scores(self, query: str, tags_list: List[str]) -> np.ndarray:
+        """
+        Keyword score of each tags string against the query, tokenising the query once:
+        0.7 * share of the tag unigrams found in the query + 0.3 * share of the tag bigrams.
+        """
+        n = len(tags_list)
+        keys = np.fromiter((self.add(tags) for tags in tags_list), dtype=np.int64, count=n)
+
+        # Tokens unknown to the vocabulary can't match any tag
+        query_ids = [self.vocabulary.get(token, -1) for token in tokenize(query)]
+        query_bigram_ids = [
+            self.bigram_vocabulary.get(pair, -1) for pair in zip(query_ids[:-1], query_ids[1:])
+        ]
+        unigram_mask = np.zeros(len(self.vocabulary), dtype=bool)
+        bigram_mask = np.zeros(len(self.bigram_vocabulary), dtype=bool)
+        query_ids = np.array(query_ids, dtype=np.int64)
+        query_bigram_ids = np.array(query_bigram_ids, dtype=np.int64)
+        unigram_mask[query_ids[query_ids >= 0]] = True
+        bigram_mask[query_bigram_ids[query_bigram_ids >= 0]] = True
+
+        offsets = np.frombuffer(self.span_offsets, dtype=np.int64)[keys]
+        n_unigrams = np.frombuffer(self.span_unigrams, dtype=np.int64)[keys]
+        n_bigrams = np.frombuffer(self.span_bigrams, dtype=np.int64)[keys]
+        arena = np.frombuffer(self.token_arena, dtype=np.int64)
+
+        def _recall(starts: np.ndarray, lengths: np.ndarray, mask: np.ndarray) -> np.ndarray:
+            total = int(lengths.sum())
+            if total == 0:
+                return np.zeros(n)
+            # Gather all segments of the arena at once, then count matches per candidate
+            positions = np.arange(total) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            owners = np.repeat(np.arange(n), lengths)
+            overlap = np.bincount(owners, weights=mask[arena[positions]], minlength=n)
+            return np.divide(overlap, lengths, out=np.zeros(n), where=lengths > 0)
+
+        return 0.7 * _recall(offsets, n_unigrams, unigram_mask) + \
+            0.3 * _recall(offsets + n_unigrams, n_bigrams, bigram_mask)
+
+
+def time_decay_scores(timestamps: np.ndarray, query_at: Optional[int], decay: float) -> np.ndarray:
+    """decay ** days since each memory, 0 for unknown timestamps (NaN) or without query time"""
+    if query_at is None:
+        return np.zeros(len(timestamps))
+    days = np.maximum(0.0, (query_at - timestamps) / (24 * 3600))
+    return np.nan_to_num(np.power(decay, days), nan=0.0)
+
+
 class VectorStoreFactory:
     """Factory for creating optimized vector stores"""
     
@@ -124,18 +262,21 @@ class MultiUserLongTermMemory:
         self.vector_store = self._create_vector_store()
         self.shared_index = None
         
-        # LRU cache for user metadata
-        self.user_metadata: Dict[str, Dict[str, Any]] = {}
-        self.metadata_access_times: Dict[str, datetime] = {}
+        # LRU cache for user metadata, ordered from least to most recently used
+        self.user_metadata: OrderedDict[str, Dict[str, Any]] = OrderedDict()
         
         # Performance metrics
         self.metrics = {
             "queries": 0,
             "cache_hits": 0,
             "cache_misses": 0,
+            "cache_evictions": 0,
             "memory_cleanups": 0
         }
 
+        # Token ids of memory tags, filled at insert time and on first retrieval
+        self.tag_token_index = TagTokenIndex()
+
         self._init_shared_index(use_async=self.use_async)
         print(f"Initialized scalable memory with {vector_store_type} vector store")
     
@@ -203,16 +344,19 @@ class MultiUserLongTermMemory:
             try:
                 with open(metadata_path, 'r', encoding='utf-8') as f:
                     metadata = json.load(f)
-                    metadata['entries'] = [MemoryEntry.from_dict(entry) for entry in metadata.get('entries', [])]
-                    self.metadata_access_times[person_id] = datetime.now()
+                    time_index = MemoryTimeIndex([MemoryEntry.from_dict(entry) for entry in metadata.get('entries', [])])
+                    metadata['time_index'] = time_index
+                    metadata['entries'] = time_index.entries
                     self.metrics["cache_misses"] += 1
                     return metadata
             except Exception as e:
                 print(f"Error loading metadata for user {person_id}: {e}")
         
         # Default metadata for new user
+        time_index = MemoryTimeIndex()
         metadata = {
-            "entries": [], 
+            "entries": time_index.entries, 
+            "time_index": time_index,
             "last_cleanup": None, 
             "last_reflection": None,
             "person_id": person_id,
@@ -220,7 +364,6 @@ class MultiUserLongTermMemory:
             "memory_usage_mb": 0,
             "total_entries": 0
         }
-        self.metadata_access_times[person_id] = datetime.now()
         self.metrics["cache_misses"] += 1
         return metadata
     
@@ -232,48 +375,41 @@ class MultiUserLongTermMemory:
         metadata_path = self._get_user_metadata_path(person_id)
         
         try:
+            # The time index is rebuilt from the entries when loading
+            metadata = {k: v for k, v in self.user_metadata[person_id].items() if k != "time_index"}
+            metadata["entries"] = [entry.to_dict() for entry in metadata["entries"]]
+
             # Calculate memory usage
-            metadata_json = json.dumps(self.user_metadata[person_id], default=str, ensure_ascii=False)
+            metadata_json = json.dumps(metadata, default=str, ensure_ascii=False)
             metadata_size = len(metadata_json.encode('utf-8'))
             self.user_metadata[person_id]["memory_usage_mb"] = metadata_size / (1024 * 1024)
-            self.user_metadata[person_id]["total_entries"] = len(self.user_metadata[person_id]["entries"])
+            self.user_metadata[person_id]["total_entries"] = len(metadata["entries"])
+            metadata["memory_usage_mb"] = self.user_metadata[person_id]["memory_usage_mb"]
+            metadata["total_entries"] = self.user_metadata[person_id]["total_entries"]
             
             with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(self.user_metadata[person_id], f, indent=2, default=str, ensure_ascii=False)
-            self.metadata_access_times[person_id] = datetime.now()
+                json.dump(metadata, f, indent=2, default=str, ensure_ascii=False)
             
         except Exception as e:
             print(f"Error saving metadata for user {person_id}: {e}")
     
     def _cleanup_metadata_cache(self):
-        """LRU eviction for metadata cache"""
+        """LRU eviction for metadata cache, O(1) per evicted user"""
         if len(self.user_metadata) <= self.max_loaded_metadata:
             return
         
-        # Sort by access time and remove oldest
-        sorted_users = sorted(
-            self.metadata_access_times.items(),
-            key=lambda x: x[1]
-        )
-        
-        users_to_remove = len(self.user_metadata) - self.max_loaded_metadata
         removed_count = 0
-        
-        for person_id, _ in sorted_users[:users_to_remove]:
-            if person_id in self.user_metadata:
-                # Save before removing from cache
-                self._save_user_metadata(person_id)
-                del self.user_metadata[person_id]
-                if person_id in self.metadata_access_times:
-                    del self.metadata_access_times[person_id]
-                removed_count += 1
-        
-        # Force garbage collection
-        gc.collect()
+        while len(self.user_metadata) > self.max_loaded_metadata:
+            # The least recently used user is always at the front
+            person_id = next(iter(self.user_metadata))
+            # Save before removing from cache
+            self._save_user_metadata(person_id)
+            del self.user_metadata[person_id]
+            removed_count += 1
+        
+        self.metrics["cache_evictions"] += removed_count
         self.metrics["memory_cleanups"] += 1
-        
-        if removed_count > 0:
-            print(f"Cleaned up metadata cache: removed {removed_count} users from memory")
+        logger.debug(f"Cleaned up metadata cache: removed {removed_count} users from memory")
     
     def ensure_user_initialized(self, person_id: str):
         """Ensure user metadata is loaded with cache management"""
@@ -281,15 +417,15 @@ class MultiUserLongTermMemory:
             self.user_metadata[person_id] = self._load_user_metadata(person_id)
             self._cleanup_metadata_cache()
         else:
-            # Update access time for LRU
-            self.metadata_access_times[person_id] = datetime.now()
+            # Mark as most recently used for LRU
+            self.user_metadata.move_to_end(person_id)
             self.metrics["cache_hits"] += 1
 
     def get_last_user_memories(self, person_id: str, from_date: datetime) -> List[MemoryEntry]:
         """Get last user memories from a specific date"""
         self.ensure_user_initialized(person_id)
         # logger.debug(f"Retrieving memories for user {person_id} since {from_date}, data: {self.user_metadata[person_id]['entries'][::-1]}")
-        return [entry for entry in self.user_metadata[person_id]['entries'] if entry.timestamp >= from_date]
+        return self.user_metadata[person_id]['time_index'].since(int(from_date.timestamp()))
 
     async def aadd_memory(self, entry: MemoryEntry):
         """Add memory to shared vector store with user namespace"""
@@ -303,18 +439,23 @@ class MultiUserLongTermMemory:
             metadata={
                 "person_id": person_id,
                 "timestamp": entry.timestamp.isoformat(),
+                "timestamp_s": int(entry.timestamp.timestamp()),
                 "memory_type": entry.memory_type,
                 "namespace": f"user_{person_id}",  # Key for isolation
                 "doc_id": doc_id,
                 "tags": entry.tags,
-            }
+            },
+            excluded_embed_metadata_keys=["timestamp_s"],
+            excluded_llm_metadata_keys=["timestamp_s"],
         )
         
         # Add to shared index
         await self.shared_index.ainsert(doc)
+        if entry.tags:
+            self.tag_token_index.add(entry.tags)
         
         # Update user metadata
-        self.user_metadata[person_id]["entries"].append(entry)
+        self.user_metadata[person_id]["time_index"].add(entry)
         # logger.debug(f"Add memory entry for user {person_id}: {entry.to_dict()}")
 
         # Memory limits per user
@@ -351,12 +492,12 @@ class MultiUserLongTermMemory:
         # We just need a lot of memories to make the model faster converge
         return True
     
-    def _filter_memory_by_past_days(self, message_datetime: datetime, search_datetime: datetime, max_past_days: int) -> bool:
-        # Filter by past days
-        if max_past_days < 0:
+    def _filter_memory_by_past_days(self, message_timestamp: int, search_timestamp: Optional[int], max_past_days: int) -> bool:
+        # Filter by past days, on epoch seconds
+        if max_past_days < 0 or search_timestamp is None:
             return True
         
-        delta_days = (search_datetime - message_datetime).days
+        delta_days = (search_timestamp - message_timestamp) // (24 * 3600)
         return delta_days <= max_past_days
 
     async def aquery_user_memories(self, person_id: str, query: str, top_k: int = 8, max_past_days: int = 30, query_at: Optional[int] = None) -> List[MemorySearchResult]:
@@ -368,12 +509,15 @@ class MultiUserLongTermMemory:
         logger.debug(f"Querying user long term memories for person {person_id}, at {query_at}")
 
         def filter_message(metadata: dict) -> bool:
-            msg_datetime = datetime.fromisoformat(metadata["timestamp"])
+            msg_timestamp = memory_timestamp(metadata)
+            if msg_timestamp is None:
+                return False
             if self.long_term_memory_filter_by_datetime and query_at_datetime:
+                msg_datetime = datetime.fromtimestamp(msg_timestamp)
                 return self._filter_memory_by_working_day(msg_datetime, query_at_datetime) \
                     and self._filter_memory_by_peak_time(msg_datetime, query_at_datetime)
             if max_past_days >= 0:
-                return self._filter_memory_by_past_days(msg_datetime, query_at_datetime, max_past_days)
+                return self._filter_memory_by_past_days(msg_timestamp, query_at, max_past_days)
             return True
         
         try:
@@ -419,18 +563,20 @@ class MultiUserLongTermMemory:
         default_reflection_importance_score = settings.agent.long_term_retrieval__default_reflection_importance_score
 
         # similarity score
-        _sim_score = np.array([n.score for n in nodes])
+        _sim_score = np.array([n.score or 0.0 for n in nodes], dtype=float)
         logger.debug(f"Sim score debug: {_sim_score.min()}, {_sim_score.max()}, {_sim_score.mean()}")
-        # importance score based on keywords, use bleu score with the query
+        # importance score based on keywords, unigram/bigram overlap of the tags with the query
         keyword_only = [(n.metadata.get("tags", "") or "") for n in nodes]
-        _imp_score = np.array([
-            self._bleu_score(query, kw) if kw else default_reflection_importance_score for kw in keyword_only
-        ])
+        has_keywords = np.array([bool(kw) for kw in keyword_only])
+        if query:
+            _imp_score = self.tag_token_index.overlap_scores(query, keyword_only)
+        else:
+            _imp_score = np.zeros(len(nodes))
+        _imp_score = np.where(has_keywords, _imp_score, default_reflection_importance_score)
         logger.debug(f"Importance score debug: {_imp_score.min()}, {_imp_score.max()}, {_imp_score.mean()}")
         # time decay score
-        _time_decay_score = np.array([
-            self._time_decay_score(n.metadata.get("timestamp"), query_at) for n in nodes
-        ])
+        timestamps = np.array([memory_timestamp(n.metadata) for n in nodes], dtype=float)
+        _time_decay_score = time_decay_scores(timestamps, query_at, settings.agent.long_term_retrieval__time_decay)
         logger.debug(f"Time decay score debug: {_time_decay_score.min()}, {_time_decay_score.max()}, {_time_decay_score.mean()}")
 
         # Normalize all the score first
@@ -450,46 +596,6 @@ class MultiUserLongTermMemory:
 
         return (a - a.min()) / (a.max() - a.min())
 
-    def _time_decay_score(self, timestamp_str: str, query_at: Optional[int]) -> float:
-        if not timestamp_str or query_at is None:
-            return 0.0
-
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str)
-        except ValueError:
-            return 0.0
-
-        # Calculate time decay based on the difference between query time and message time
-        decay = settings.agent.long_term_retrieval__time_decay
-        time_diff = max(0, (query_at - int(timestamp.timestamp())) / (24*3600))  # Convert to days
-        return decay ** time_diff
-
-    def _bleu_score(self, query: str, keyword: str) -> float:
-        if not keyword or not query:
-            return 0.0
-
-        # Tokenize keywords and query
-        kw_tokens = [token.strip(string.punctuation) for token in keyword.lower().split() if token.strip(string.punctuation)]
-        query_tokens = [token.strip(string.punctuation) for token in query.lower().split() if token.strip(string.punctuation)]
-
-        # Calculate unigram (1-gram) overlap
-        kw_unigrams = set(kw_tokens)
-        query_unigrams = set(query_tokens)
-        unigram_overlap = len(kw_unigrams.intersection(query_unigrams))
-        unigram_score = unigram_overlap / len(kw_unigrams) if kw_unigrams else 0.0
-
-        # Calculate bigram (2-gram) overlap
-        kw_bigrams = set(zip(kw_tokens[:-1], kw_tokens[1:])) if len(kw_tokens) > 1 else set()
-        query_bigrams = set(zip(query_tokens[:-1], query_tokens[1:])) if len(query_tokens) > 1 else set()
-        bigram_overlap = len(kw_bigrams.intersection(query_bigrams))
-        bigram_score = bigram_overlap / len(kw_bigrams) if kw_bigrams else 0.0
-
-        # Combine unigram and bigram scores with weights
-        # Weight unigrams more heavily as they're more likely to match
-        combined_score = (0.7 * unigram_score + 0.3 * bigram_score)
-        
-        return combined_score
-
     def cleanup_user_memories(self, person_id: str, days_threshold: int = 30):
         """Cleanup old memories for specific user"""
         self.ensure_user_initialized(person_id)
@@ -498,26 +604,21 @@ class MultiUserLongTermMemory:
             return
         
         cutoff_date = datetime.now() - timedelta(days=days_threshold)
-        original_count = len(self.user_metadata[person_id]["entries"])
+        time_index: MemoryTimeIndex = self.user_metadata[person_id]["time_index"]
+        original_count = len(time_index)
         
-        # Filter entries by date and importance
-        filtered_entries = []
-        for entry_dict in self.user_metadata[person_id]["entries"]:
-            try:
-                entry_date = datetime.fromisoformat(entry_dict["timestamp"])
-                
-                # Keep if recent, important, or special type
-                if (entry_date > cutoff_date or 
-                    entry_dict.get("importance_score", 0) > 0.7 or
-                    entry_dict.get("memory_type") in ["reflection", "summary"]):
-                    filtered_entries.append(entry_dict)
-                    
-            except (ValueError, KeyError) as e:
-                # Keep entries with malformed dates to be safe
-                filtered_entries.append(entry_dict)
+        # Keep every recent entry; older ones only if important or of a special type
+        cutoff_index = bisect_left(time_index.timestamps, int(cutoff_date.timestamp()))
+        filtered_entries = [
+            entry for entry in time_index.entries[:cutoff_index]
+            if getattr(entry, "importance_score", 0) > 0.7 or
+                str(entry.memory_type) in ["reflection", "summary"]
+        ] + time_index.entries[cutoff_index:]
         
         # Update metadata
-        self.user_metadata[person_id]["entries"] = filtered_entries
+        time_index = MemoryTimeIndex(filtered_entries)
+        self.user_metadata[person_id]["time_index"] = time_index
+        self.user_metadata[person_id]["entries"] = time_index.entries
         self.user_metadata[person_id]["last_cleanup"] = datetime.now().isoformat()
         self._save_user_metadata(person_id)
         
@@ -566,19 +667,10 @@ class MultiUserLongTermMemory:
         metadata = self.user_metadata[person_id]
         
         # Calculate recent entries
-        recent_24h = 0
-        recent_7d = 0
+        time_index: MemoryTimeIndex = metadata["time_index"]
         now = datetime.now()
-        
-        for entry_dict in metadata["entries"]:
-            try:
-                entry_time = datetime.fromisoformat(entry_dict["timestamp"])
-                if now - entry_time < timedelta(hours=24):
-                    recent_24h += 1
-                if now - entry_time < timedelta(days=7):
-                    recent_7d += 1
-            except (ValueError, KeyError):
-                continue
+        recent_24h = time_index.count_since(int((now - timedelta(hours=24)).timestamp()))
+        recent_7d = time_index.count_since(int((now - timedelta(days=7)).timestamp()))
         
         return {
             "person_id": person_id,
@@ -601,6 +693,9 @@ class MultiUserLongTermMemory:
             "vector_store_type": self.vector_store_type,
             "storage_dir": str(self.storage_dir),
             "cache_hit_ratio": self.metrics["cache_hits"] / max(self.metrics["cache_hits"] + self.metrics["cache_misses"], 1),
+            "cache_hits": self.metrics["cache_hits"],
+            "cache_misses": self.metrics["cache_misses"],
+            "cache_evictions": self.metrics["cache_evictions"],
             "total_queries": self.metrics["queries"],
             "memory_cleanups": self.metrics["memory_cleanups"],
             "memory_optimized": True,
@@ -654,9 +749,8 @@ class MultiUserLongTermMemory:
         if person_id not in self.user_metadata:
             return []
         
-        # Convert stored entries to MemoryEntry objects
-        entries = self.user_metadata[person_id]["entries"]
-        return [MemoryEntry.from_dict(entry) for entry in entries]
+        # Entries are kept as MemoryEntry objects, oldest first
+        return list(self.user_metadata[person_id]["entries"])
 
     async def aexport_user_data(self, person_id: str) -> Dict[str, Any]:
         """Export all data for a specific user"""
@@ -668,7 +762,7 @@ class MultiUserLongTermMemory:
         # Get user metadata
         user_data = {
             "person_id": person_id,
-            "metadata": self.user_metadata[person_id].copy(),
+            "metadata": {k: v for k, v in self.user_metadata[person_id].items() if k != "time_index"},
             "stats": self.get_user_stats(person_id)
         }
         
@@ -0,0 +1,115 @@
+from typing import Optional
+from loguru import logger
+from pydantic import BaseModel
+from llama_index.core.utils import get_tokenizer
+from settings import settings
+
+
+class PromptParts(BaseModel):
+    """
+    A chat prompt split at its cache boundaries, from the most shared part to the least shared one:
+    the static prefix is the same for every call, the person prefix is the same for all calls of a person,
+    and the payload is specific to the call.
+    """
+    static_prefix: str = ""
+    person_prefix: str = ""
+    payload: str = ""
+
+    @property
+    def system_prompt(self) -> str:
+        return self.static_prefix
+
+    @property
+    def user_prompt(self) -> str:
+        return self.person_prefix + self.payload
+
+    def parts(self) -> list[str]:
+        return [self.static_prefix, self.person_prefix, self.payload]
+
+
+class PromptStats:
+    """
+    Token counts and prefix reuse of the prompts sent to the LLM.
+
+    A prefix is reusable when the same prefix parts were already sent before,
+    which is what a server with prefix caching (e.g. vLLM --enable-prefix-caching) can skip.
+    When the server reports cached prompt tokens in the usage, they are aggregated as well.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(log_interval=settings.agent.prompt_stats_log_interval)
+        return cls._instance
+
+    def __init__(self, log_interval: int = 100):
+        self.log_interval = log_interval
+        self._tokenizer = None
+        # Token counts of the prefixes, the same few strings are counted over and over
+        self._prefix_tokens: dict[str, int] = {}
+        self._seen_prefixes: set[int] = set()
+        self.metrics = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "reusable_prefix_tokens": 0,
+            "server_prompt_tokens": 0,
+            "server_cached_tokens": 0,
+        }
+
+    def count_tokens(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer()
+        return len(self._tokenizer(text))
+
+    def _count_prefix_tokens(self, text: str) -> int:
+        tokens = self._prefix_tokens.get(text)
+        if tokens is None:
+            tokens = self._prefix_tokens[text] = self.count_tokens(text)
+        return tokens
+
+    def record(self, prompt_parts: PromptParts, usage: Optional[dict] = None) -> dict:
+        """Record one LLM call and return its own stats"""
+        *prefixes, payload = prompt_parts.parts()
+
+        prompt_tokens = self.count_tokens(payload)
+        reusable_tokens = 0
+        reusing = True
+        prefix_key = 0
+        for prefix in prefixes:
+            tokens = self._count_prefix_tokens(prefix)
+            prompt_tokens += tokens
+            prefix_key = hash((prefix_key, prefix))
+            if reusing and prefix_key in self._seen_prefixes:
+                reusable_tokens += tokens
+            else:
+                reusing = False
+                self._seen_prefixes.add(prefix_key)
+
+        self.metrics["calls"] += 1
+        self.metrics["prompt_tokens"] += prompt_tokens
+        self.metrics["reusable_prefix_tokens"] += reusable_tokens
+        if usage:
+            self.metrics["server_prompt_tokens"] += usage.get("prompt_tokens") or 0
+            self.metrics["server_cached_tokens"] += usage.get("cached_tokens") or 0
+
+        if self.log_interval and self.metrics["calls"] % self.log_interval == 0:
+            logger.info(f"Prompt stats: {self.get_summary()}")
+
+        return {
+            "prompt_tokens": prompt_tokens,
+            "reusable_prefix_tokens": reusable_tokens,
+        }
+
+    def get_summary(self) -> dict:
+        calls = self.metrics["calls"]
+        prompt_tokens = self.metrics["prompt_tokens"]
+        server_prompt_tokens = self.metrics["server_prompt_tokens"]
+        return {
+            **self.metrics,
+            "avg_prompt_tokens": prompt_tokens / calls if calls else 0.0,
+            "prefix_reuse_ratio": self.metrics["reusable_prefix_tokens"] / prompt_tokens if prompt_tokens else 0.0,
+            "server_cache_hit_ratio": self.metrics["server_cached_tokens"] / server_prompt_tokens if server_prompt_tokens else 0.0,
+        }
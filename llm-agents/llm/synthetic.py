@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Any, List, Sequence
+
+import numpy as np
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import CustomLLM
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class SyntheticLLM(CustomLLM):
+    """
+    Fake LLM for load tests, no model nor server involved.
+
+    It recognises the plan-trip, reflection and self-reflection prompts of the agent and answers
+    with valid JSON in the expected format; the content is derived from a hash of the prompt and the seed,
+    so the same prompt always gets the same answer.
+    The latency follows the configured distribution (fixed, uniform or lognormal, in seconds)
+    and requests fail with probability `failure_rate`.
+    """
+    model: str = "synthetic"
+    seed: int = 0
+    latency_distribution: str = "fixed"
+    latency_mean: float = 0.0
+    latency_stddev: float = 0.0
+    failure_rate: float = 0.0
+    context_window: int = 32768
+
+    def __init__(self, *args, use_async: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert self.latency_distribution in ("fixed", "uniform", "lognormal"), \
+            f"Unsupported latency distribution: {self.latency_distribution}"
+        self._rnd = random.Random(self.seed)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, is_chat_model=True, model_name=self.model)
+
+    def _sample_latency(self) -> float:
+        if self.latency_mean <= 0:
+            return 0.0
+        if self.latency_distribution == "uniform":
+            spread = self.latency_stddev * 3 ** 0.5  # uniform with the given standard deviation
+            return max(0.0, self._rnd.uniform(self.latency_mean - spread, self.latency_mean + spread))
+        if self.latency_distribution == "lognormal":
+            # parameters of the underlying normal giving the requested mean and standard deviation
+            variance = np.log1p((self.latency_stddev / self.latency_mean) ** 2)
+            return self._rnd.lognormvariate(np.log(self.latency_mean) - variance / 2, variance ** 0.5)
+        return self.latency_mean
+
+    def _maybe_fail(self):
+        if self.failure_rate > 0 and self._rnd.random() < self.failure_rate:
+            raise RuntimeError("Synthetic LLM failure")
+
+    def generate(self, prompt: str) -> str:
+        h = _stable_hash(f"{self.seed}:{prompt}")
+
+        if "chosen_plan" in prompt:
+            n_options = len(re.findall(r"\*Option \d+\*", prompt)) or 1
+            chosen = h % n_options + 1
+            analysis = "\n".join(f"- Option {i}: Score {(h >> i) % 5 + 1}." for i in range(1, n_options + 1))
+            answer = {
+                "chosen_plan": chosen,
+                "reason": f"This plan fits my schedule best (synthetic choice {chosen} of {n_options}).",
+            }
+            return f"*******\nStep 1: Brief Analysis of each option\n{analysis}\n*******\nStep 2: Final Decision\n```json\n{json.dumps(answer, indent=4)}\n```"
+
+        if '"concepts"' in prompt:
+            purposes = re.findall(r'"purpose": "([^"]*)"', prompt.split("# INPUT", 1)[-1]) or [""]
+            routes = sorted(set(re.findall(r"\b(?:Bus|Metro|Tram) \w+", prompt))) or ["Bus 1"]
+            route = routes[h % len(routes)]
+            purpose = purposes[h % len(purposes)]
+            answer = {
+                "reflection": f"Today I travelled for {purpose or 'my activities'}; {route} was {'on time' if h % 2 else 'late'}.",
+                "concepts": [
+                    [f"{route} is {'reliable' if h % 2 else 'often late'}", f"{route}, {'reliable' if h % 2 else 'late'}", route, f"Weekday {['morning', 'afternoon', 'evening', 'night'][h % 4]}", purpose],
+                ],
+            }
+            return f"```json\n{json.dumps(answer, indent=4)}\n```"
+
+        answer = {"reflection": f"My usual trips went as expected (synthetic reflection {h % 1000})."}
+        return f"```json\n{json.dumps(answer, indent=4)}\n```"
+
+    def _respond(self, messages: Sequence[ChatMessage]) -> ChatResponse:
+        prompt = "\n".join(m.content or "" for m in messages)
+        content = self.generate(prompt)
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+        return ChatResponse(
+            message=ChatMessage(role=MessageRole.ASSISTANT, content=content, additional_kwargs={}),
+            raw="",
+            additional_kwargs={"usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "cached_tokens": None,
+            }},
+        )
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        time.sleep(self._sample_latency())
+        self._maybe_fail()
+        return self._respond(messages)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        await asyncio.sleep(self._sample_latency())
+        self._maybe_fail()
+        return self._respond(messages)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=self.generate(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        yield CompletionResponse(text=self.generate(prompt))
+
+
+class SyntheticEmbedding(BaseEmbedding):
+    """
+    Fake embedding for load tests: a normalised bag of hashed words, so texts sharing words stay similar.
+    """
+    model_name: str = "synthetic"
+    dimension: int = 384
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._word_slots: dict[str, tuple[int, float]] = {}
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            slot = self._word_slots.get(word)
+            if slot is None:
+                h = _stable_hash(word)
+                slot = self._word_slots[word] = (h % self.dimension, 1.0 if (h >> 32) & 1 else -1.0)
+            vector[slot[0]] += slot[1]
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
@@ -1,4 +1,10 @@
-from typing import Any, Sequence
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Optional, Sequence
+from loguru import logger
 from llama_index.llms.vllm import VllmServer
 from llama_index.core.llms.callbacks import (
     llm_chat_callback,
@@ -12,6 +18,19 @@ from openai import OpenAI
 from openai import AsyncOpenAI
 
 
+def usage_to_dict(usage) -> dict:
+    """Token usage of an OpenAI-compatible response, with the prompt tokens served from the prefix cache if reported"""
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", None) if details else None,
+    }
+
+
 class OpenAIvLLM(VllmServer):
     use_async: bool = False
     
@@ -34,7 +53,9 @@ class OpenAIvLLM(VllmServer):
     @llm_chat_callback()
     def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
         assert self.use_async is False, "Synchronous chat method called on an async client. Use achat instead."
+        return self._chat(messages, **kwargs)
 
+    def _chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
         kwargs = kwargs if kwargs else {}
         # prompt = self.messages_to_prompt(messages)
         # completion_response = self.complete(prompt, **kwargs)
@@ -53,12 +74,15 @@ class OpenAIvLLM(VllmServer):
                 additional_kwargs={},
             ),
             raw="",
+            additional_kwargs={"usage": usage_to_dict(response.usage)},
         )
     
     @llm_chat_callback()
     async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
         assert self.use_async is True, "Asynchronous chat method called on a synchronous client. Use chat instead."
-        
+        return await self._achat(messages, **kwargs)
+
+    async def _achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
         kwargs = kwargs if kwargs else {}
         # prompt = self.messages_to_prompt(messages)
         # completion_response = self.complete(prompt, **kwargs)
@@ -77,8 +101,131 @@ class OpenAIvLLM(VllmServer):
                 additional_kwargs={},
             ),
             raw="",
+            additional_kwargs={"usage": usage_to_dict(response.usage)},
         )
-    
 
-    
-    
+    async def abatch_chat(self, batch: Sequence[Sequence[ChatMessage]], max_concurrency: Optional[int] = None, **kwargs: Any) -> list:
+        """
+        Submit many chats at once. The vLLM server schedules them together (continuous batching),
+        and requests sharing a prefix reuse its KV cache (automatic prefix caching).
+
+        The first request is sent alone so its prefix is in the cache before the others arrive.
+        Returns the responses in order, with the exception in place of a failed request.
+        """
+        assert self.use_async is True, "Batched chat needs an asynchronous client."
+        if not batch:
+            return []
+
+        semaphore = asyncio.Semaphore(max_concurrency or len(batch))
+
+        async def _achat(messages: Sequence[ChatMessage]):
+            async with semaphore:
+                try:
+                    return await self.achat(messages, **kwargs)
+                except Exception as e:
+                    return e
+
+        first = await _achat(batch[0])
+        rest = await asyncio.gather(*(_achat(messages) for messages in batch[1:]))
+        return [first, *rest]
+
+
+class RecordReplayLLM(OpenAIvLLM):
+    """
+    OpenAI-compatible LLM that records its responses, or replays them without any server.
+
+    - record: the chats go to the server as usual, and each response is appended to `store_path` (jsonl)
+      with the prompt hash, the latency and the token usage.
+    - replay: the responses are served from `store_path`, after sleeping the recorded latency times `latency_scale`.
+      A prompt recorded several times is replayed in the recorded order.
+
+    The prompt hash covers the chat messages only, so a recording can be replayed under any model code.
+    """
+    mode: str = "replay"
+    store_path: str = ""
+    latency_scale: float = 0.0
+
+    def __init__(self, *args, mode: str = "replay", store_path: str = "llm_records.jsonl", latency_scale: float = 0.0, api_key: str = None, **kwargs):
+        assert mode in ("record", "replay"), f"Unsupported record/replay mode: {mode}"
+        # The client is not used in replay mode, but it refuses to be created without a key
+        super().__init__(*args, api_key=api_key or "EMPTY", **kwargs)
+        self.mode = mode
+        self.store_path = store_path
+        self.latency_scale = latency_scale
+
+        self._records: dict[str, list[dict]] = {}
+        self._replay_cursor: dict[str, int] = {}
+        if self.mode == "replay":
+            self._load_records()
+        elif os.path.dirname(self.store_path):
+            os.makedirs(os.path.dirname(self.store_path), exist_ok=True)
+
+    @staticmethod
+    def prompt_key(messages: Sequence[ChatMessage]) -> str:
+        payload = json.dumps([[str(m.role.value if hasattr(m.role, "value") else m.role), m.content] for m in messages], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load_records(self):
+        if not os.path.exists(self.store_path):
+            raise FileNotFoundError(f"No LLM records to replay at {self.store_path}")
+        with open(self.store_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._records.setdefault(record["key"], []).append(record)
+        logger.info(f"Loaded {sum(len(r) for r in self._records.values())} LLM records for {len(self._records)} prompts from {self.store_path}")
+
+    def _next_record(self, key: str) -> dict:
+        records = self._records.get(key)
+        if not records:
+            raise LookupError(f"No recorded LLM response for prompt {key}")
+        cursor = self._replay_cursor.get(key, 0)
+        self._replay_cursor[key] = cursor + 1
+        return records[cursor % len(records)]
+
+    def _write_record(self, key: str, response: ChatResponse, latency: float):
+        record = {
+            "key": key,
+            "response": response.message.content,
+            "latency": round(latency, 4),
+            "usage": response.additional_kwargs.get("usage", {}),
+        }
+        with open(self.store_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _to_response(self, record: dict) -> ChatResponse:
+        return ChatResponse(
+            message=ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content=record["response"],
+                additional_kwargs={},
+            ),
+            raw="",
+            additional_kwargs={"usage": record.get("usage") or {}},
+        )
+
+    def _chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self.prompt_key(messages)
+        if self.mode == "replay":
+            record = self._next_record(key)
+            if self.latency_scale > 0:
+                time.sleep(record.get("latency", 0) * self.latency_scale)
+            return self._to_response(record)
+
+        start_time = time.perf_counter()
+        response = super()._chat(messages, **kwargs)
+        self._write_record(key, response, time.perf_counter() - start_time)
+        return response
+
+    async def _achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self.prompt_key(messages)
+        if self.mode == "replay":
+            record = self._next_record(key)
+            if self.latency_scale > 0:
+                await asyncio.sleep(record.get("latency", 0) * self.latency_scale)
+            return self._to_response(record)
+
+        start_time = time.perf_counter()
+        response = await super()._achat(messages, **kwargs)
+        self._write_record(key, response, time.perf_counter() - start_time)
+        return response
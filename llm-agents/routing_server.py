@@ -0,0 +1,57 @@
+"""
+Local stand-in for the Solari and OTP routing services.
+
+Point settings.gtfs.solari_endpoint to http://localhost:8000/v1/plan
+or settings.gtfs.otp_endpoint to http://localhost:8000/otp/transmodel/v3.
+
+Usage:
+    python routing_server.py --mode router --latency-ms 50 --latency-jitter-ms 20
+    python routing_server.py --mode record --records routing_records.jsonl --otp-upstream http://localhost:8080/otp/transmodel/v3
+    python routing_server.py --mode replay --records routing_records.jsonl
+
+In record mode, a service without an upstream answers 404.
+"""
+import argparse
+import os
+from aiohttp import web
+from loguru import logger
+from settings import settings
+
+args = argparse.ArgumentParser()
+args.add_argument("--config", type=str, default="", help="Path to the configuration file")
+args.add_argument("--host", type=str, default="localhost")
+args.add_argument("--port", type=int, default=8000)
+args.add_argument("--mode", type=str, default="router", choices=["router", "replay", "record"])
+args.add_argument("--records", type=str, default="routing_records.jsonl", help="Recorded responses (jsonl)")
+args.add_argument("--no-router", action="store_true", help="In replay mode, answer 404 instead of routing the unrecorded requests")
+args.add_argument("--solari-upstream", type=str, default=None, help="Solari service to record from")
+args.add_argument("--otp-upstream", type=str, default=None, help="OTP service to record from")
+args.add_argument("--latency-ms", type=float, default=0, help="Mean latency added to each answer")
+args.add_argument("--latency-jitter-ms", type=float, default=0, help="Standard deviation of the latency")
+args.add_argument("--seed", type=int, default=0)
+
+if __name__ == "__main__":
+    args = args.parse_args()
+    if args.config:
+        os.environ["APP_CONFIG_PATH"] = args.config
+        settings = settings.force_reload()
+
+    from trip_helper.router import GTFSRouter
+    from trip_helper.standin import RoutingStandIn
+
+    router = None
+    if args.mode == "router" or (args.mode == "replay" and not args.no_router):
+        router = GTFSRouter()
+
+    standin = RoutingStandIn(
+        mode=args.mode,
+        router=router,
+        records_file=args.records,
+        solari_upstream=args.solari_upstream,
+        otp_upstream=args.otp_upstream,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        seed=args.seed,
+    )
+    logger.info(f"---- Starting routing stand-in ({args.mode}) on {args.host}:{args.port} ----")
+    web.run_app(standin.make_app(), host=args.host, port=args.port)
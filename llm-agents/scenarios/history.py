@@ -34,6 +34,8 @@ class HistoryStreamLog:
         self.log_longterm_memory = partial(self.log, context="longterm_memory")
         self.log_travel_plan = partial(self.log, context="travel_plan")
         self.log_query_travel_plan = partial(self.log, context="query_travel_plan")
+        self.log_decision_cache = partial(self.log, context="decision_cache")
+        self.log_option_permutation = partial(self.log, context="option_permutation")
 
     def log(self, context: str, timestamp: int, person_id: str, message: str, activity_id: Optional[str] = None, data: Optional[dict] = None):
         """
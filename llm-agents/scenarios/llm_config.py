@@ -11,6 +11,20 @@ def create_llm_config_from_settings() -> ModelConfig:
     llm_provider = cfg.get("llm_provider", None)
     assert llm_provider, f"Model {model} does not have a valid llm_provider"
 
+    if settings.agent.llm_record_replay_mode in ("record", "replay"):
+        assert llm_provider == "vllm" or settings.agent.llm_record_replay_mode == "replay", \
+            f"Recording needs an OpenAI-compatible server, {model} uses {llm_provider}"
+        return ModelConfig.create_record_replay_config(
+            llm_model=cfg["model"],
+            mode=settings.agent.llm_record_replay_mode,
+            store_path=settings.agent.llm_record_replay_file,
+            latency_scale=settings.agent.llm_replay_latency_scale,
+            embedding_model=cfg.get("embedding_model") or "sentence-transformers/all-MiniLM-L6-v2",
+            temperature=settings.agent.llm_params.get("temperature", 0),
+            max_new_tokens=settings.agent.llm_params.get("max_tokens", 200),
+            api_url=cfg.get("api_url") or "http://127.0.0.1:1234/v1",
+            api_key=cfg.get("api_key", None),
+        )
     if llm_provider == "openai":
         return ModelConfig.create_openai_config(
             llm_model=cfg["model"],
@@ -30,4 +44,13 @@ def create_llm_config_from_settings() -> ModelConfig:
             api_url=cfg["api_url"],
             api_key=cfg.get("api_key", None),
         )
+    if llm_provider == "synthetic":
+        return ModelConfig.create_synthetic_config(
+            llm_model=cfg["model"],
+            seed=settings.agent.synthetic_llm_seed,
+            latency_distribution=settings.agent.synthetic_llm_latency_distribution,
+            latency_mean=settings.agent.synthetic_llm_latency_mean,
+            latency_stddev=settings.agent.synthetic_llm_latency_stddev,
+            failure_rate=settings.agent.synthetic_llm_failure_rate,
+        )
     raise ValueError(f"Unsupported LLM provider: {llm_provider}")
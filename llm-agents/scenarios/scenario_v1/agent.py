@@ -1,5 +1,7 @@
 
 from datetime import datetime
+import asyncio
+import hashlib
 import json
 import demjson3
 import os
@@ -15,11 +17,13 @@ from openai import BaseModel
 from vllm import LLM
 from helper import categorize_date_time_short, get_weekday_category, humanize_date, humanize_date_short, humanize_time, time_to_bucket_text
 from llm.llm_model import ModelConfig
-from llm.longterm import MultiUserLongTermMemory
+from llm.longterm import MultiUserLongTermMemory, memory_timestamp
 from llm.memory import MemoryEntry, MemoryType
+from llm.prompt_stats import PromptParts, PromptStats
 from llm.shortterm import UserShortTermMemory
 from models import Person, TravelPlan
 from scenarios.history import HistoryStreamLog
+from scenarios.scenario_v1.decision_cache import DecisionCache
 from text_helper import env_ob_to_text
 from settings import settings
 
@@ -30,6 +34,7 @@ from world.population import PersonScheduler
 
 
 history_log = HistoryStreamLog.get_instance()
+prompt_stats = PromptStats.get_instance()
 
 
 class Context(BaseModel):
@@ -72,12 +77,34 @@ class LLMAgent:
             storage_dir=settings.agent.long_term_memory_storage_dir,
             long_term_memory_filter_by_datetime=settings.agent.long_term_memory_filter_by_datetime,
         )
+        self.decision_cache = DecisionCache(
+            ttl=settings.agent.decision_cache_ttl,
+            reuse_probability=settings.agent.decision_cache_reuse_probability,
+            seed=settings.agent.option_shuffle_seed,
+        ) if settings.agent.decision_cache_enabled else None
 
     def get_short_term_memory(self, user_id: str) -> UserShortTermMemory:
         if user_id not in self.short_term_memory:
             self.short_term_memory[user_id] = UserShortTermMemory(user_id)
         return self.short_term_memory[user_id]
     
+    def get_checkpoint_state(self) -> dict:
+        """Short-term memories and decision cache, the long-term memory is persisted by itself"""
+        return {
+            "short_term_memory": {
+                person_id: [entry.to_dict() for entry in memory.get_all_messages()]
+                for person_id, memory in self.short_term_memory.items()
+            },
+            "decision_cache": self.decision_cache.get_checkpoint_state() if self.decision_cache else None,
+        }
+
+    def set_checkpoint_state(self, state: dict):
+        self.short_term_memory = {}
+        for person_id, entries in state["short_term_memory"].items():
+            self.get_short_term_memory(person_id).recent_entries = [MemoryEntry.from_dict(entry) for entry in entries]
+        if self.decision_cache and state.get("decision_cache"):
+            self.decision_cache.set_checkpoint_state(state["decision_cache"])
+
     def add_short_term_memory(self, context: Context, msg: str, timestamp: Optional[int] = None):
         memory = self.get_short_term_memory(context.person.person_id)
         memory.add_message(
@@ -102,13 +129,17 @@ class LLMAgent:
             data=context.data,
         )
 
-    async def achat(self, context: Context, prompt: str, system_prompt: Optional[str] = None, params: Optional[dict] = None, type: Optional[str] = None) -> str:
+    def build_messages(self, prompt: str, system_prompt: Optional[str] = None) -> list[ChatMessage]:
+        messages = [] if not system_prompt else [ChatMessage(role="system", content=system_prompt)]
+        messages.append(ChatMessage(role="user", content=prompt))
+        return messages
+
+    async def achat(self, context: Context, prompt: str, system_prompt: Optional[str] = None, params: Optional[dict] = None, type: Optional[str] = None, prompt_parts: Optional[PromptParts] = None) -> str:
         start_time = time.time()
         for _ in range(settings.agent.llm_retry_count):
             try:
                 # Use the LLM's chat method to get a response
-                messages = [] if not system_prompt else [ChatMessage(role="system", content=system_prompt)]
-                messages.append(ChatMessage(role="user", content=prompt))
+                messages = self.build_messages(prompt, system_prompt)
                 response: ChatResponse = await self.llm.achat(messages, **(params or {}))
                 break  # Exit loop if successful
             except Exception as e:
@@ -120,11 +151,13 @@ class LLMAgent:
         duration = time.time() - start_time
 
         # Try to get token usage stats if available
-        total_tokens = getattr(response, "usage", {}).get("total_tokens", None)
+        usage = (response.additional_kwargs or {}).get("usage", {})
+        total_tokens = usage.get("total_tokens", None)
 
         stats = {
             "duration": duration,
             "total_tokens": total_tokens,
+            **prompt_stats.record(prompt_parts or PromptParts(static_prefix=system_prompt or "", payload=prompt), usage),
         }
         context.data = context.data or {}
         context.data["llm_stats"] = stats
@@ -133,6 +166,53 @@ class LLMAgent:
         log_chat(combine_prompt, response, context)
         return response.message.content.strip()
 
+    async def abatch_chat(self, contexts: list[Context], prompts: list[str], system_prompts: list[Optional[str]], params: Optional[dict] = None) -> list[str]:
+        """
+        Send many chats as one submission and return the responses in the input order.
+
+        Requests are sorted by (system prompt, user prompt) so the ones sharing the longest prefix
+        reach the server back to back. The LLM's own `abatch_chat` is used when it has one,
+        otherwise the chats are fanned out with bounded concurrency. Failed requests go through `achat` retries.
+        """
+        max_concurrency = settings.agent.remote_llm_max_concurrent_requests or max(len(prompts), 1)
+        order = sorted(range(len(prompts)), key=lambda i: (system_prompts[i] or "", prompts[i]))
+        batch = [self.build_messages(prompts[i], system_prompts[i]) for i in order]
+
+        start_time = time.time()
+        if hasattr(self.llm, "abatch_chat"):
+            responses = await self.llm.abatch_chat(batch, max_concurrency=max_concurrency, **(params or {}))
+        else:
+            semaphore = asyncio.Semaphore(max_concurrency)
+
+            async def _achat(messages: list[ChatMessage]) -> ChatResponse:
+                async with semaphore:
+                    return await self.llm.achat(messages, **(params or {}))
+
+            responses = await asyncio.gather(*(_achat(messages) for messages in batch), return_exceptions=True)
+        duration = time.time() - start_time
+        logger.info(f"Batched {len(batch)} LLM chats in {duration:.2f}s")
+
+        results: list[Optional[str]] = [None] * len(prompts)
+        for i, response in zip(order, responses):
+            context, prompt, system_prompt = contexts[i], prompts[i], system_prompts[i]
+            if isinstance(response, BaseException):
+                logger.error(f"Batched LLM chat failed for {context.person.person_id}: {response}")
+                results[i] = await self.achat(context, prompt, system_prompt=system_prompt, params=params)
+                continue
+
+            usage = (response.additional_kwargs or {}).get("usage", {})
+            context.data = context.data or {}
+            context.data["llm_stats"] = {
+                "duration": duration,
+                "total_tokens": usage.get("total_tokens", None),
+                "batch_size": len(batch),
+                **prompt_stats.record(PromptParts(static_prefix=system_prompt or "", payload=prompt), usage),
+            }
+            combine_prompt = f"***** ------------------ System Prompt ------------------ :\n{system_prompt}\n***** ------------------ User Prompt ------------------ :\n{prompt}"
+            log_chat(combine_prompt, response, context)
+            results[i] = response.message.content.strip()
+        return results
+
     def parse_response_json(self, response: str) -> Tuple[Optional[dict], str]:
         try:
             match = re.search(r'\{.*\}', response, re.DOTALL)
@@ -206,7 +286,7 @@ Find the travel histories that in the same **CURRENT TIME**, **TEMPORAL KEYWORD*
         for entry in hist:
             if entry.content not in unique_hist:
                 unique_hist[entry.content] = entry
-        hist = sorted(list(unique_hist.values()), key=lambda x: x.metadata['timestamp'], reverse=True)
+        hist = sorted(list(unique_hist.values()), key=lambda x: memory_timestamp(x.metadata) or 0, reverse=True)
 
         logger.debug(f"Found {len(hist)} relevant experiences for travel plans for user {context.person.person_id}, activity {context.activity_id}")
 
@@ -220,12 +300,13 @@ Find the travel histories that in the same **CURRENT TIME**, **TEMPORAL KEYWORD*
         resp = []
         ts = []
         for entry in hist:
+            entry_ts = memory_timestamp(entry.metadata) or 0
             if str(entry.metadata["memory_type"]) == str(MemoryType.REFLECTION.value):
-                resp.append([entry.content, datetime.strftime(datetime.fromisoformat(entry.metadata['timestamp']), '%A, %B %d')])
-                ts.append(datetime.fromisoformat(entry.metadata['timestamp']).timestamp())
+                resp.append([entry.content, datetime.strftime(datetime.fromtimestamp(entry_ts), '%A, %B %d')])
+                ts.append(entry_ts)
             elif str(entry.metadata["memory_type"]) == str(MemoryType.CONCEPT.value):
                 resp.append(json.loads(entry.content))
-                ts.append(datetime.fromisoformat(entry.metadata['timestamp']).timestamp())
+                ts.append(entry_ts)
             else:
                 logger.debug(f"Unknown memory type for entry: {entry.metadata['memory_type']}")
 
@@ -235,46 +316,59 @@ Find the travel histories that in the same **CURRENT TIME**, **TEMPORAL KEYWORD*
         resp = [resp[i] for i in sorted_indices]
         return resp
 
-    def get_personal_system_prompt(self, person: Person) -> str:
-        identity_description = self.get_person_identity_description(person)
-
-        system_prompt = f"""# Agent specification
+    def get_agent_specification_prompt(self, persona_in_user_message: bool = False) -> str:
+        persona_location = "at the start of the user message" if persona_in_user_message else "below"
+        return f"""# Agent specification
 
 You are a simulation of a person such that:
   - You don't know you are a simulation, you think you are an actual person.
   - You follow the directives given below.
-  - You interpret the persona described below (Section "Persona"). You indeed think you ARE that person.
+  - You interpret the persona described {persona_location} (Section "Persona"). You indeed think you ARE that person.
   - Your knowledge is limited to what can be reasonably expected from the specified persona and the current cognitive state. 
     If the persona is not likely to know something, you must pretend you don't know it either.
   - You behave as realistically as possible, in accordance with the specified persona, including making mistakes, forgetting things,
     being nasty, and being influenced by your emotions. Remember, you are meant to be a simulation of a real person, not a perfect machine.
     You do not need to please anyone, but you must be coherent with the persona and the context.
+"""
 
-## Persona 
+    def get_persona_prompt(self, person: Person) -> str:
+        identity_description = self.get_person_identity_description(person)
+        return f"""## Persona 
 
 As a person, you have the characteristics specified in the JSON below. These include, among other things, your personal information, routine, job description, personality, interests. You **MUST** act in accordance with these characteristics.
 
 ```json
 {identity_description}
 ```
+"""
 
-### Rules for interpreting your persona
+    def get_persona_rules_prompt(self) -> str:
+        return """### Rules for interpreting your persona
 
 To interpret your persona, you **must** follow these rules:
   - You act in accordance with the persona characteristics, as if you were the person described in the persona.
   - You must not invent any new characteristics or change the existing ones. Everything you say or do must be consistent with the persona.
 """
-        
-        return system_prompt
 
-    async def aget_plan_trip_prompt(self, context: Context, options: list[TravelPlan], destination: str) -> str:
-        if settings.agent.long_term_memory_enabled:
-            experience_entries = await self.aquery_experiences_with_travel_plans(context, options)
-        else:
-            experience_entries = []
+    def get_personal_system_prompt(self, person: Person) -> str:
+        return f"{self.get_agent_specification_prompt()}\n{self.get_persona_prompt(person)}\n{self.get_persona_rules_prompt()}"
 
-        experiences_text = json.dumps(experience_entries, indent=2, ensure_ascii=False)
+    def get_shared_system_prompt(self, instructions: str) -> str:
+        """
+        System prompt identical for every person: the agent specification, the persona rules and the task instructions.
+        The persona goes to the user message, so that servers with prefix caching reuse the whole system prompt.
+        """
+        return f"{self.get_agent_specification_prompt(persona_in_user_message=True)}\n{self.get_persona_rules_prompt()}\n{instructions}"
+
+    def get_plan_trip_intro(self) -> str:
+        return "You are a person who has to commute every day for your daily activities or for leisure. Based on your persona and past experiences, you typically choose a set of transport modes and travel plans to get to your destination. Below, you will be given the Travel Purpose, the Travel Options requested from Google Maps, and your experiences and opinions about traveling in the past. Your job is to choose the travel plan you will follow."
 
+    def get_plan_trip_requirements(self, context: Context, destination: str) -> str:
+        return f"""# Travel Requirements
+Trip Purpose: {destination}.
+Departure Time: {humanize_time(context.timestamp)} - {time_to_bucket_text(context.timestamp)}."""
+
+    def get_plan_trip_options(self, context: Context, options: list[TravelPlan]) -> str:
         def get_plan_text(plan: TravelPlan) -> str:
             return env_ob_to_text("travel_plan", plan.model_dump())
 
@@ -284,26 +378,18 @@ To interpret your persona, you **must** follow these rules:
             travel_options += f"\n-----\n*Option {index}*: \n{get_plan_text(option)}\n"
             index += 1
 
-        system_prompt = self.get_personal_system_prompt(context.person)
-
-        custom_guidelines = settings.agent.travel_plan_custom_guidelines or None
-        
-        travel_plan_prompt = f"""You are a person who has to commute every day for your daily activities or for leisure. Based on your persona and past experiences, you typically choose a set of transport modes and travel plans to get to your destination. Below, you will be given the Travel Purpose, the Travel Options requested from Google Maps, and your experiences and opinions about traveling in the past. Your job is to choose the travel plan you will follow.
-
-# Travel Requirements
-Trip Purpose: {destination}.
-Departure Time: {humanize_time(context.timestamp)} - {time_to_bucket_text(context.timestamp)}.
-
-# Travel Options from routing assistant
+        return f"""# Travel Options from routing assistant
 CURRENT TIME: {humanize_time(context.timestamp)}. **TEMPORAL KEYWORD**: {categorize_date_time_short(context.timestamp)}, on {get_weekday_category(context.timestamp).upper()}.
 
-{travel_options}
+{travel_options}"""
 
-### Important Notes:
+    def get_plan_trip_options_notes(self) -> str:
+        return """### Important Notes:
 - The travel options only provide the estimated times for travel between stops, not the total trip time; the total trip time includes waiting times, walking times, and transfers that should be extracted from past experiences if available.
-- Transit format: Transport Mode (line: X) from Stop A to Stop B
+- Transit format: Transport Mode (line: X) from Stop A to Stop B"""
 
-# Past Travel Experiences and Opinions
+    def get_plan_trip_experiences_guidelines(self) -> str:
+        return """# Past Travel Experiences and Opinions
 ### Travel experiences guidelines
 The experiences is in JSON format, including the list of past travel experiences and their metadata as following:
 ```json
@@ -312,14 +398,16 @@ The experiences is in JSON format, including the list of past travel experiences
 ]
 ```
 
-**IMPORTANT **: The **experiences** provided below are ordered from old to new. If you have multiple experiences that conflict, prioritize the most recent one (that last one).
+**IMPORTANT **: The **experiences** provided below are ordered from old to new. If you have multiple experiences that conflict, prioritize the most recent one (that last one)."""
 
-The INPUT for **experiences** as followings:
+    def get_plan_trip_experiences_input(self, experiences_text: str) -> str:
+        return f"""The INPUT for **experiences** as followings:
 ```json
 {experiences_text if experiences_text else "[]"}
-```
+```"""
 
-# Analysis Framework
+    def get_plan_trip_framework(self) -> str:
+        return """# Analysis Framework
 Here is the Analysis Framework to help you choose the best travel plan for you:
 ## Decision Criteria Factors
 Focus on the following factors when selecting the best travel plan:
@@ -350,17 +438,73 @@ Step 1: Brief Analysis of each option
 *******
 Step 2: Final Decision, this is in JSON format
 ```json
-    {{
+    {
         "chosen_plan": INDEX start from 1,
         "reason": "REASON"
-    }}
-```
+    }
+```"""
 
-{f'**IMPORTANT CUSTOM GUIDELINES**' if custom_guidelines else ''}
-{f'{custom_guidelines}' if custom_guidelines else ''}
+    def get_plan_trip_custom_guidelines(self) -> str:
+        custom_guidelines = settings.agent.travel_plan_custom_guidelines or None
+        return f"""{'**IMPORTANT CUSTOM GUIDELINES**' if custom_guidelines else ''}
+{custom_guidelines if custom_guidelines else ''}
 """
-        
-        return system_prompt, travel_plan_prompt
+
+    async def aget_plan_trip_experiences(self, context: Context, options: list[TravelPlan]) -> list:
+        if settings.agent.long_term_memory_enabled:
+            return await self.aquery_experiences_with_travel_plans(context, options)
+        return []
+
+    async def aget_plan_trip_prompt(self, context: Context, options: list[TravelPlan], destination: str, experience_entries: Optional[list] = None) -> PromptParts:
+        if experience_entries is None:
+            experience_entries = await self.aget_plan_trip_experiences(context, options)
+
+        experiences_text = json.dumps(experience_entries, indent=2, ensure_ascii=False)
+
+        requirements = self.get_plan_trip_requirements(context, destination)
+        travel_options = self.get_plan_trip_options(context, options)
+        experiences_input = self.get_plan_trip_experiences_input(experiences_text)
+
+        if settings.agent.prompt_layout == "prefix_cached":
+            # static instructions -> persona -> per-call payload
+            instructions = "\n\n".join(filter(None, [
+                self.get_plan_trip_intro(),
+                self.get_plan_trip_options_notes(),
+                self.get_plan_trip_experiences_guidelines(),
+                self.get_plan_trip_framework(),
+                self.get_plan_trip_custom_guidelines().strip(),
+            ])) + "\n"
+            return PromptParts(
+                static_prefix=self.get_shared_system_prompt(instructions),
+                person_prefix=self.get_persona_prompt(context.person) + "\n",
+                payload="\n\n".join([requirements, travel_options, "# Past Travel Experiences\n" + experiences_input]) + "\n",
+            )
+
+        travel_plan_prompt = "\n\n".join([
+            self.get_plan_trip_intro(),
+            requirements,
+            travel_options,
+            self.get_plan_trip_options_notes(),
+            self.get_plan_trip_experiences_guidelines(),
+            experiences_input,
+            self.get_plan_trip_framework(),
+        ]) + "\n\n" + self.get_plan_trip_custom_guidelines()
+
+        return PromptParts(
+            static_prefix=self.get_personal_system_prompt(context.person),
+            payload=travel_plan_prompt,
+        )
+
+    def get_option_permutation(self, context: Context, n_options: int) -> list[int]:
+        """
+        Order in which the options are shown to the LLM, seeded by the person, the activity and the simulated time,
+        so the same decision always yields the same prompt across runs and backends.
+        """
+        key = f"{settings.agent.option_shuffle_seed}:{context.person.person_id}:{context.activity_id}:{context.timestamp}"
+        seed = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+        permutation = list(range(n_options))
+        random.Random(seed).shuffle(permutation)
+        return permutation
 
     async def aplan_trip(self, context: Context, options: list[TravelPlan], destination: str) -> tuple[int, str]:
         assert options, "No travel options provided for planning trip."
@@ -368,10 +512,47 @@ Step 2: Final Decision, this is in JSON format
             # If only one option, return it directly
             return 0, "Only one travel option available, no need to choose."
         
-        # shuffle options to avoid bias
-        random.shuffle(options)
-        system_prompt, prompt = await self.aget_plan_trip_prompt(context, options, destination)
-        response = await self.achat(context, prompt, system_prompt=system_prompt)
+        # shuffle options to avoid bias, in place as the caller picks from its own list with the returned index
+        permutation = self.get_option_permutation(context, len(options))
+        options[:] = [options[i] for i in permutation]
+        context.data = context.data or {}
+        context.data["option_permutation"] = permutation
+        history_log.log_option_permutation(
+            timestamp=context.timestamp,
+            person_id=context.person.person_id,
+            activity_id=context.activity_id,
+            message=f"Shuffled {len(options)} travel options for {destination}",
+            data={
+                "purpose": destination,
+                "permutation": permutation,
+                "itineraries": [option.get_code() for option in options],
+            },
+        )
+        experience_entries = await self.aget_plan_trip_experiences(context, options)
+
+        if self.decision_cache is not None:
+            option_codes = [option.get_code() for option in options]
+            slot = self.decision_cache.make_slot(context.person.person_id, destination, context.timestamp)
+            fingerprint = self.decision_cache.make_fingerprint(option_codes, experience_entries)
+            decision = self.decision_cache.get(slot, fingerprint, context.timestamp)
+            if decision is not None and decision.plan_code in option_codes:
+                history_log.log_decision_cache(
+                    timestamp=context.timestamp,
+                    person_id=context.person.person_id,
+                    activity_id=context.activity_id,
+                    message=f"Reused the travel decision for {destination}",
+                    data={
+                        "purpose": destination,
+                        "slot": list(slot),
+                        "plan_code": decision.plan_code,
+                        "decided_at": decision.decided_at,
+                        "hits": decision.hits,
+                    },
+                )
+                return option_codes.index(decision.plan_code), decision.reason
+
+        prompt_parts = await self.aget_plan_trip_prompt(context, options, destination, experience_entries=experience_entries)
+        response = await self.achat(context, prompt_parts.user_prompt, system_prompt=prompt_parts.system_prompt, prompt_parts=prompt_parts)
         resp, fallback = self.parse_response_json(response)
         if resp:
             index = resp.get("chosen_plan", -1)
@@ -380,10 +561,12 @@ Step 2: Final Decision, this is in JSON format
                 reason = resp.get("reason", "")
                 if "is chosen because it" in reason:
                     reason = f"This plan {reason.split('is chosen because it', 1)[1].strip()}"
+                if self.decision_cache is not None:
+                    self.decision_cache.put(slot, fingerprint, option_codes[index - 1], reason, context.timestamp)
                 return index - 1, reason
         return -1, fallback.strip() or "No valid response received."
 
-    def get_reflection_prompt(self, context: Context) -> tuple[str, list[MemoryEntry]]:
+    def get_reflection_experiences(self, context: Context) -> tuple[str, list[MemoryEntry]]:
         mem = self.get_short_term_memory(context.person.person_id)
         group_messages, all_messages = mem.get_all_message_and_group()
 
@@ -399,10 +582,10 @@ Step 2: Final Decision, this is in JSON format
                     "observations": [msg.content for msg in group],
                 })
         experiences_text = json.dumps(exp, indent=2, ensure_ascii=False)
+        return experiences_text, all_messages
 
-        custom_guidelines = settings.agent.reflection_custom_guidelines or None
-
-        text = f"""# TASK INSTRUCTION
+    def get_reflection_instructions(self) -> str:
+        return f"""# TASK INSTRUCTION
 Reflect on past experiences to identify patterns, lessons, and insights that will improve future travel planning.
 You can also generate concepts about important things or ideas to be remembered in the long term memory (optional but recommended).
 
@@ -488,38 +671,50 @@ OBSERVATION is a description of what was experienced or observed during the trav
 - [ ARRIVAL ]: End of the journey, reporting arrival time and delay.
 
 Now is the past experiences input, after that give the reflection.
+"""
+
+    def get_reflection_custom_guidelines(self) -> str:
+        custom_guidelines = settings.agent.reflection_custom_guidelines or None
+        return f"**IMPORTANT CUSTOM GUIDELINES** {custom_guidelines}" if custom_guidelines else ""
 
-# INPUT
+    def get_reflection_input(self, experiences_text: str) -> str:
+        return f"""# INPUT
 ```json
 {experiences_text if experiences_text else "[]"}
 ```
-
-{{f'**IMPORTANT CUSTOM GUIDELINES** {custom_guidelines}' if custom_guidelines else ''}}
 """
+
+    def get_reflection_prompt(self, context: Context) -> tuple[str, list[MemoryEntry]]:
+        experiences_text, all_messages = self.get_reflection_experiences(context)
+        if not all_messages:
+            return "", []
+
+        text = f"{self.get_reflection_instructions()}\n{self.get_reflection_input(experiences_text)}\n{self.get_reflection_custom_guidelines()}\n"
         return text, all_messages
 
-    def get_longterm_memory_reflection_prompt(self, context: Context, from_date: datetime):
+    def get_longterm_memory_reflection_entries(self, context: Context, from_date: datetime) -> tuple[str, list[MemoryEntry]]:
         all_entries = self.long_term_memory.get_last_user_memories(
             person_id=context.person.person_id,
             from_date=from_date,
         )
         if not all_entries:
-            return None, []
+            return "", []
 
         entries_text = "\n".join(f"- Time {humanize_date(entry.timestamp.timestamp())}: {entry.content}" for entry in all_entries)
+        return entries_text, all_entries
 
-        prompt = f"""# TASK INSTRUCTION
+    def get_longterm_memory_reflection_task(self) -> str:
+        return """# TASK INSTRUCTION
 Reflect on past experiences to identify patterns, lessons, and insights that will improve future travel planning.
+"""
 
-# Past experiences
-{entries_text}
-
-# OUTPUT FORMAT
+    def get_longterm_memory_reflection_guidelines(self) -> str:
+        return """# OUTPUT FORMAT
 Must be in the json format.
 ```json
-{{
+{
     "reflection": "string - narrative reflection on the previous days",
-}}
+}
 ```
 
 # REFLECTION GUIDELINES
@@ -534,7 +729,18 @@ Must be in the json format.
 - Output in a single paragraph, under 200 words.
     - List habits/routines found.
     - Best travel option for each purpose.
-        """
+"""
+
+    def get_longterm_memory_reflection_prompt(self, context: Context, from_date: datetime):
+        entries_text, all_entries = self.get_longterm_memory_reflection_entries(context, from_date)
+        if not all_entries:
+            return None, []
+
+        prompt = f"""{self.get_longterm_memory_reflection_task()}
+# Past experiences
+{entries_text}
+
+{self.get_longterm_memory_reflection_guidelines()}"""
         return prompt, all_entries
     
     async def areflect_all(self, timestamp: int, people: list[Person]):
@@ -545,6 +751,10 @@ Must be in the json format.
         if settings.agent.long_term_memory_enabled is False:
             logger.info("Long-term memory is disabled, skipping reflection.")
             return
+
+        if settings.agent.reflection_batch_enabled:
+            await self.abatch_reflect_all(timestamp, people)
+            return
         
         for person in people:
             context = Context(
@@ -554,11 +764,47 @@ Must be in the json format.
             )
             await self.areflect_memory(context)
 
+    async def abatch_reflect_all(self, timestamp: int, people: list[Person]):
+        """
+        Reflect on the short-term memories of many people with one batched LLM submission.
+        All prompts are built first; the instructions sit in a system prompt shared by every person,
+        and the persona and experiences follow in the user message.
+        """
+        contexts, system_prompts, prompts, all_messages_list = [], [], [], []
+        system_prompt = self.get_shared_system_prompt(
+            f"{self.get_reflection_instructions()}\n{self.get_reflection_custom_guidelines()}"
+        )
+        for person in people:
+            context = Context(
+                person=person,
+                timestamp=timestamp,
+                data={"type": "reflection"}
+            )
+            experiences_text, all_messages = self.get_reflection_experiences(context)
+            if not all_messages:
+                continue
+            contexts.append(context)
+            system_prompts.append(system_prompt)
+            prompts.append(f"{self.get_persona_prompt(person)}\n{self.get_reflection_input(experiences_text)}")
+            all_messages_list.append(all_messages)
+
+        if not contexts:
+            logger.info("No short-term memory available for reflection.")
+            return
+
+        responses = await self.abatch_chat(contexts, prompts, system_prompts)
+        for context, response_text, all_messages in zip(contexts, responses, all_messages_list):
+            await self.aapply_reflection(context, response_text, all_messages)
+
     async def aself_reflect_all(self, timestamp: int, from_date: datetime, people: list[Person]):
         if settings.agent.long_term_memory_enabled is False or settings.agent.long_term_self_reflect_enabled is False:
             logger.info("Long-term memory is disabled or Self reflection is disable, skipping self reflection.")
             return
 
+        if settings.agent.reflection_batch_enabled:
+            await self.abatch_self_reflect_all(timestamp, from_date, people)
+            return
+
         for person in people:
             context = Context(
                 person=person,
@@ -567,6 +813,33 @@ Must be in the json format.
             )
             await self.areflect_longterm_memory(context, from_date)
 
+    async def abatch_self_reflect_all(self, timestamp: int, from_date: datetime, people: list[Person]):
+        """Batched counterpart of aself_reflect_all, see abatch_reflect_all."""
+        contexts, system_prompts, prompts = [], [], []
+        system_prompt = self.get_shared_system_prompt(
+            f"{self.get_longterm_memory_reflection_task()}\n{self.get_longterm_memory_reflection_guidelines()}"
+        )
+        for person in people:
+            context = Context(
+                person=person,
+                timestamp=timestamp,
+                data={"type": "self_reflection"}
+            )
+            entries_text, all_entries = self.get_longterm_memory_reflection_entries(context, from_date)
+            if not all_entries:
+                continue
+            contexts.append(context)
+            system_prompts.append(system_prompt)
+            prompts.append(f"{self.get_persona_prompt(person)}\n# Past experiences\n{entries_text}\n")
+
+        if not contexts:
+            logger.info("No long-term memory available for self reflection.")
+            return
+
+        responses = await self.abatch_chat(contexts, prompts, system_prompts)
+        for context, response_text in zip(contexts, responses):
+            await self.aapply_longterm_reflection(context, response_text)
+
     async def areflect_longterm_memory(self, context: Context, from_date: datetime):
         if settings.agent.long_term_memory_enabled is False:
             logger.info("Long-term memory is disabled, skipping reflection.")
@@ -578,6 +851,9 @@ Must be in the json format.
             return
         system_prompt = self.get_personal_system_prompt(context.person)
         response_text = await self.achat(context, prompt, system_prompt=system_prompt)
+        await self.aapply_longterm_reflection(context, response_text)
+
+    async def aapply_longterm_reflection(self, context: Context, response_text: str):
         resp, fallback = self.parse_response_json(response_text)
         try:
             reflection = resp["reflection"]
@@ -600,6 +876,9 @@ Must be in the json format.
         
         system_prompt = self.get_personal_system_prompt(context.person)
         response_text = await self.achat(context, prompt, system_prompt=system_prompt)
+        await self.aapply_reflection(context, response_text, all_messages)
+
+    async def aapply_reflection(self, context: Context, response_text: str, all_messages: list[MemoryEntry]):
         #TODO: hotfix - avoid null in the list
         response_text = response_text.replace("\nnull", "").replace("null\n", "").replace("\nnull\n", "")
         resp, fallback = self.parse_response_json(response_text)
@@ -0,0 +1,81 @@
+import gzip
+import os
+import pickle
+import time
+from typing import TYPE_CHECKING, Optional
+
+from loguru import logger
+from settings import settings
+
+if TYPE_CHECKING:
+    from scenarios.scenario_v1.loop import ScenarioV1
+
+
+CHECKPOINT_VERSION = 1
+
+
+class ScenarioCheckpoint:
+    """
+    Checkpoint of a running ScenarioV1: population state (PersonState columns, scheduled start times,
+    departure queue), pending messages, reflection timers, the short-term memories and decision cache
+    of the agent, and the trip helper cache. The long-term memory is persisted by itself.
+
+    Written as a gzipped pickle every `interval` seconds of simulation time, through a temporary file
+    so that a crash while writing keeps the previous checkpoint.
+    """
+
+    def __init__(self, file_path: str, interval: int):
+        self.file_path = file_path
+        self.interval = interval
+        self.next_checkpoint_at: Optional[int] = None
+
+    @classmethod
+    def from_settings(cls) -> Optional["ScenarioCheckpoint"]:
+        if not settings.data.checkpoint_file:
+            return None
+        return cls(file_path=settings.data.checkpoint_file, interval=settings.data.checkpoint_interval)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.file_path)
+
+    def maybe_save(self, scenario: "ScenarioV1", timestamp: int):
+        if self.next_checkpoint_at is None:
+            self.next_checkpoint_at = timestamp + self.interval
+        elif timestamp >= self.next_checkpoint_at:
+            self.save(scenario, timestamp)
+            self.next_checkpoint_at = timestamp + self.interval
+
+    def save(self, scenario: "ScenarioV1", timestamp: int):
+        start = time.perf_counter()
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "timestamp": timestamp,
+            "scenario": scenario.get_checkpoint_state(),
+            "population": scenario.population.get_checkpoint_state(),
+            "agent": scenario.agent.get_checkpoint_state() if scenario.agent else None,
+            "trip_helper": scenario.trip_helper.get_checkpoint_state() if scenario.trip_helper else None,
+        }
+        tmp_file = f"{self.file_path}.tmp"
+        with gzip.open(tmp_file, "wb", compresslevel=3) as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.file_path)
+        logger.info(f"Checkpoint at {timestamp} saved to {self.file_path} "
+                    f"({os.path.getsize(self.file_path) / 2**20:.1f} MiB in {time.perf_counter() - start:.2f}s)")
+
+    def restore(self, scenario: "ScenarioV1") -> int:
+        """Restore the scenario from the checkpoint file, returns the timestamp of the checkpoint"""
+        start = time.perf_counter()
+        with gzip.open(self.file_path, "rb") as f:
+            state = pickle.load(f)
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {state.get('version')} in {self.file_path}")
+
+        scenario.set_checkpoint_state(state["scenario"])
+        scenario.population.set_checkpoint_state(state["population"])
+        if scenario.agent and state["agent"]:
+            scenario.agent.set_checkpoint_state(state["agent"])
+        if scenario.trip_helper:
+            scenario.trip_helper.set_checkpoint_state(state["trip_helper"])
+        self.next_checkpoint_at = state["timestamp"] + self.interval
+        logger.info(f"Restored checkpoint at {state['timestamp']} from {self.file_path} in {time.perf_counter() - start:.2f}s")
+        return state["timestamp"]
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import random
+from typing import Optional
+from pydantic import BaseModel
+
+from helper import get_weekday_category, time_to_bucket_text
+
+
+class CachedDecision(BaseModel):
+    fingerprint: str
+    plan_code: str
+    reason: str
+    decided_at: int
+    hits: int = 0
+
+
+class DecisionCache:
+    """
+    Memo of the trip choices made by the LLM.
+
+    A decision is stored per (person, purpose, weekday/weekend, time bucket) slot, together with a fingerprint
+    of what the LLM saw: the sorted option codes and a hash of the retrieved experiences.
+    It is reused only while the fingerprint is unchanged and the decision is younger than `ttl` seconds
+    of simulation time, and then only with probability `reuse_probability`, so the LLM is still consulted from time to time.
+    The reuse draw is seeded by `seed`, the slot and the simulated time, so a run replays the same decisions.
+    """
+
+    def __init__(self, ttl: int, reuse_probability: float = 1.0, seed: int = 0):
+        self.ttl = ttl
+        self.reuse_probability = reuse_probability
+        self.seed = seed
+        self.decisions: dict[tuple, CachedDecision] = {}
+        self.metrics = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "skipped": 0,
+        }
+
+    @staticmethod
+    def make_slot(person_id: str, purpose: str, timestamp: int) -> tuple:
+        return (person_id, purpose, get_weekday_category(timestamp), time_to_bucket_text(timestamp))
+
+    @staticmethod
+    def make_fingerprint(option_codes: list[str], experiences: list) -> str:
+        memory_hash = hashlib.sha1(json.dumps(experiences, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{','.join(sorted(option_codes))}#{memory_hash}"
+
+    def reuse_draw(self, slot: tuple, timestamp: int) -> float:
+        key = f"{self.seed}:{':'.join(str(part) for part in slot)}:{timestamp}"
+        seed = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+        return random.Random(seed).random()
+
+    def get(self, slot: tuple, fingerprint: str, timestamp: int) -> Optional[CachedDecision]:
+        decision = self.decisions.get(slot)
+        if decision is None or decision.fingerprint != fingerprint:
+            self.metrics["misses"] += 1
+            return None
+        if timestamp - decision.decided_at > self.ttl:
+            self.metrics["expired"] += 1
+            del self.decisions[slot]
+            return None
+        if self.reuse_draw(slot, timestamp) >= self.reuse_probability:
+            self.metrics["skipped"] += 1
+            return None
+
+        self.metrics["hits"] += 1
+        decision.hits += 1
+        return decision
+
+    def get_checkpoint_state(self) -> dict:
+        return {
+            "decisions": {slot: decision.model_dump() for slot, decision in self.decisions.items()},
+            "metrics": dict(self.metrics),
+        }
+
+    def set_checkpoint_state(self, state: dict):
+        self.decisions = {slot: CachedDecision(**decision) for slot, decision in state["decisions"].items()}
+        self.metrics.update(state["metrics"])
+
+    def put(self, slot: tuple, fingerprint: str, plan_code: str, reason: str, timestamp: int):
+        self.decisions[slot] = CachedDecision(
+            fingerprint=fingerprint,
+            plan_code=plan_code,
+            reason=reason,
+            decided_at=timestamp,
+        )
@@ -5,6 +5,8 @@ from inputs.gtfs.reader import GTFSData
 from world import *
 from trip_helper.cached_triphelper import CachedTripHelper
 from trip_helper.otp import OTPTripHelper
+from trip_helper.raptor import RaptorTripHelper
+from trip_helper.range_triphelper import RangeTripHelper
 from inputs.population import SyntheticPopulationLoader, PersonCloseToTheStopFilter
 from trip_helper import SolariTripHelper
 from scenarios.scenario_v1.loop import ScenarioV1
@@ -29,21 +31,23 @@ def bootstrap() -> BaseScenario:
     world_grid = WorldGrid(world_bbox)
     time_grid = TimeGrid()
 
+    stop_locations = gtfs_data.all_stop_locations()
     population = WorldPopulation(
         SyntheticPopulationLoader(
             filters=[
                 PersonCloseToTheStopFilter(
                     max_distance=500,  # 500 meters
-                    stop_locations=gtfs_data.all_stop_locations()
+                    stop_locations=stop_locations
                 )
-            ]
+            ],
+            # the filter wants every activity near a stop, so the home too: select the homes from the index first
+            around=stop_locations,
+            around_distance=500,
         )
     ).init(world_bbox=world_bbox)
 
     # Set all people start from home
-    for person in population.get_people_list():
-        home_location = PersonScheduler(person).get_home_location()
-        person.state.last_location = home_location
+    population.start_from_home()
 
     world_model = WorldModel(
         world_grid=world_grid,
@@ -68,6 +72,9 @@ def bootstrap() -> BaseScenario:
             endpoint=settings.gtfs.otp_endpoint,
             gtfs_data=gtfs_data
         )
+    elif settings.gtfs.mode == "RAPTOR":
+        logger.info("Using in-process RAPTOR trip helper")
+        trip_helper = RaptorTripHelper(gtfs_data=gtfs_data)
     else:
         logger.info("Using Solari trip helper")
         trip_helper = CachedTripHelper(
@@ -78,10 +85,18 @@ def bootstrap() -> BaseScenario:
             ),
         )
 
+    if settings.gtfs.trip_query_mode == "range" and trip_helper.SUPPORTS_RANGE_QUERY:
+        # one search over the trip_query_range window per decision
+        logger.info(f"Using range queries over {trip_helper.__class__.__name__}")
+        trip_helper = RangeTripHelper(trip_helper)
+
     loop = ScenarioV1(
         world_model=world_model,
         trip_helper=trip_helper,
         agent=LLMAgent(llm=Settings.llm),
     )
 
+    if loop.checkpoint and settings.data.checkpoint_restore and loop.checkpoint.exists():
+        loop.checkpoint.restore(loop)
+
     return loop
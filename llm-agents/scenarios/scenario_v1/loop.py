@@ -6,18 +6,21 @@ import datetime
 from loguru import logger
 from gama_models import WorldSyncIdlePeople
 from helper import humanize_duration, humanize_time, to_timestamp_based_on_day, humanize_date
-from models import BBox, Location, Person, PersonMove, TravelPlan
+from models import Activity, BBox, Location, Person, PersonMove, TravelPlan
 from scenarios.base import Action, BaseScenario, Observation
 from scenarios.history import HistoryStreamLog
 from scenarios.scenario_v1.agent import Context, LLMAgent
+from scenarios.scenario_v1.checkpoint import ScenarioCheckpoint
 from text_helper import env_ob_to_text, parse_ob
-from trip_helper.base import TripHelper
+from trip_helper.base import TripHelper, TripQuery
+from trip_helper.stats import RoutingStats
 from utils import random_uuid
 from world.population import WorldPopulation
 from world.world_data import WorldModel
 from settings import settings
 
 history_logger = HistoryStreamLog.get_instance()
+routing_stats = RoutingStats.get_instance()
 
 class ScenarioV1(BaseScenario):
     MAX_ADJUST_START_TIME = 15*60  # 15 minutes
@@ -35,6 +38,7 @@ class ScenarioV1(BaseScenario):
         self.reflect_period = settings.agent.long_term_reflect_interval
         self.next_reflection_at = None
         self.next_self_reflection_at = None
+        self.checkpoint = ScenarioCheckpoint.from_settings()
         # Control the agent's concurrency
         self._concurrent_semaphore = asyncio.Semaphore(settings.agent.remote_llm_max_concurrent_requests)
 
@@ -93,12 +97,32 @@ class ScenarioV1(BaseScenario):
                 await self.agent.aself_reflect_all(timestamp=timestamp, from_date=from_date, people=self.population.get_people_list())
                 self.next_self_reflection_at = timestamp + settings.agent.long_term_self_reflect_interval_days*24*3600
 
+        if self.checkpoint:
+            self.checkpoint.maybe_save(self, timestamp)
+
+    def get_checkpoint_state(self) -> dict:
+        return {
+            "messages": [message.model_dump() for message in self._messages],
+            "next_reflection_at": self.next_reflection_at,
+            "next_self_reflection_at": self.next_self_reflection_at,
+        }
+
+    def set_checkpoint_state(self, state: dict):
+        self._messages = [Action(**message) for message in state["messages"]]
+        self.next_reflection_at = state["next_reflection_at"]
+        self.next_self_reflection_at = state["next_self_reflection_at"]
+
     async def areflect_all(self, timestamp: int):
         idle_people = [
-            p for p in self.population.get_people_list() 
-            if p.is_llm_based and p.state.heading_to is None
+            p for p in self.population.get_llm_based_people_list()
+            if p.state.heading_to is None
         ]
 
+        if settings.agent.reflection_batch_enabled:
+            # One submission for the whole sweep, concurrency is bounded inside the batch
+            await self.agent.areflect_all(timestamp=timestamp, people=idle_people)
+            return
+
         async def reflect_person(person):
             async with self._concurrent_semaphore:
                 await self.agent.areflect_all(timestamp=timestamp, people=[person])
@@ -220,11 +244,50 @@ class ScenarioV1(BaseScenario):
         return messages
     
     async def schedule_person_move(self, timestamp: int):
-        idle_people = [p for p in self.population.get_people_list() if p.state.heading_to is None]
-        
+        if settings.agent.event_driven_departures:
+            # Only the idle people whose departure may be due, the others wait in the departure queue
+            idle_people = self.population.get_due_people(timestamp)
+        else:
+            idle_people = self.population.get_idle_people()
+
+        # Route all the idle people of the tick as one batch
+        next_activities = {
+            person.person_id: self.population.get_person_default_scheduler(person).next_activity(
+                timestamp,
+                pre_schedule_duration=None,
+            )
+            for person in idle_people
+        }
+        moving_people = [person for person in idle_people if next_activities[person.person_id]]
+        if settings.agent.event_driven_departures:
+            for person in idle_people:
+                if not next_activities[person.person_id]:
+                    self.population.get_person_default_scheduler(person).defer(timestamp)
+                else:
+                    # looked at again on the next tick unless the move starts (start_on_activity)
+                    self.population.departure_queue.wake_now(person.person_id)
+        queries = [
+            TripQuery(
+                origin=person.state.last_location,
+                destination=next_activities[person.person_id].location,
+                departure_time=timestamp,
+            )
+            for person in moving_people
+        ]
+        itineraries_by_person = {}
+        if queries:
+            routing_stats.record_decisions(len(queries))
+            results = await self.trip_helper.get_itineraries_many(queries)
+            itineraries_by_person = {person.person_id: itineraries for person, itineraries in zip(moving_people, results)}
+
         async def process_person(person):
             async with self._concurrent_semaphore:
-                move, reasoning = await self.next_person_move(person, timestamp)
+                move, reasoning = await self.next_person_move(
+                    person,
+                    timestamp,
+                    next_activity=next_activities[person.person_id],
+                    itineraries=itineraries_by_person.get(person.person_id),
+                )
                 if move:
                     logger.debug(f"[timestamp: {humanize_date(timestamp)}] Person {person.person_id} is moving to {move.target_location} for {move.purpose}")
                     self._messages.append(Action(
@@ -272,7 +335,7 @@ class ScenarioV1(BaseScenario):
                         activity=move.for_activity,
                     )
 
-        tasks = [process_person(person) for person in idle_people]
+        tasks = [process_person(person) for person in moving_people]
         await asyncio.gather(*tasks)
 
     # def log_travel_plan_to_shortterm(self, plan: TravelPlan, reasoning: str):
@@ -298,25 +361,30 @@ class ScenarioV1(BaseScenario):
     async def next_person_move(self, 
                 person: Person, 
                 timestamp: int = None,
-                depth: int = 0
+                depth: int = 0,
+                next_activity: Optional[Activity] = None,
+                itineraries: Optional[list[TravelPlan]] = None,
             ) -> Tuple[Optional[PersonMove], Optional[str]]:
         # Find the next move
-        next_activity = self.population.get_person_default_scheduler(person).next_activity(
-            timestamp,
-            pre_schedule_duration=None,
-        )
+        if next_activity is None:
+            next_activity = self.population.get_person_default_scheduler(person).next_activity(
+                timestamp,
+                pre_schedule_duration=None,
+            )
         if not next_activity:
             # logger.debug(f"[timestamp: {timestamp}] Person {person_id} has no next activity, waiting...")
             return None, None
         
-        # Query a new trip plan
+        # Query a new trip plan, unless already routed in the batch of the tick
         from_location = person.state.last_location
 
-        itineraries = await self.trip_helper.get_itineraries(
-            origin=from_location,
-            destination=next_activity.location,
-            departure_time=timestamp,
-        )
+        if itineraries is None:
+            routing_stats.record_decisions()
+            itineraries = await self.trip_helper.get_itineraries(
+                origin=from_location,
+                destination=next_activity.location,
+                departure_time=timestamp,
+            )
         # Populate purpose
         for itinerary in itineraries:
             itinerary.purpose = next_activity.purpose
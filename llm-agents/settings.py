@@ -85,6 +85,12 @@ class LLMServerSettings(BaseSettings):
             "api_key": os.getenv("GROQ_API_KEY"),
             "api_url": "https://api.groq.com/openai/v1",
         },
+        {
+            # Fake LLM and embedding for load tests, see agent.synthetic_llm_* settings
+            "code": "synthetic",
+            "model": "synthetic",
+            "llm_provider": "synthetic",
+        },
     ]
 
 def merge_configs(*config_paths: str) -> Dict[str, Any]:
@@ -150,7 +156,7 @@ class WorldConfig(BaseSettings, WorkdirPathResolutionMixin):
 class GTFSConfig(BaseSettings, WorkdirPathResolutionMixin):
     _in_workdir_path_fields: ClassVar[List[str]] = ["solari_cache_file"]
 
-    mode: str = "SOLARI" # SOLARI or OTP
+    mode: str = "SOLARI" # SOLARI, OTP or RAPTOR (in-process)
 
     # GTFS settings
     gtfs_file: str = os.path.join(base_dir, "../data/gtfs/")
@@ -165,36 +171,58 @@ class GTFSConfig(BaseSettings, WorkdirPathResolutionMixin):
     solari_endpoint: str = "http://localhost:8000/v1/plan"
     solari_cache_file: str = "raptor_cache.pickle"
 
+    # In-process GTFS router settings (RAPTOR mode and the local routing stand-in server)
+    router_access_radius: float = 800  # meters walked to the first / from the last stop
+    router_transfer_radius: float = 300  # meters walked between two stops when transferring
+    router_walk_speed: float = 1.2  # m/s
+    router_transfer_slack: int = 60  # seconds
+
     # OTP provider settings
     otp_endpoint: str = "http://localhost:8080/otp/transmodel/v3"
+    otp_query_profile: str = "lean"  # lean: only the fields we use, full: the whole trip pattern (debugging)
 
     # number of cached itineraries per grid cell
     n_trip_in_grid: int = 5
     cache_enabled: bool = True
     recursion_search_depth: int = 0  # 0 means no recursion, 1 means one level of recursion
     trip_query_range: list[int] = [0, 15, -15]  # in minutes, relative to the departure time
+    trip_query_mode: str = "shifted"  # shifted: one query per trip_query_range offset, range: one search over the same span (OTP, RAPTOR)
+    otp_max_pages: int = 3  # pages of the OTP search window followed by a range query
     max_trip_candidates: int = 5 # maximum number of trip candidates to be selected
+    routing_max_concurrent_requests: int = 16  # bound of the fan-out when a trip helper has no native batching
+    routing_stats_log_interval: int = 60  # seconds between two routing stats summaries in the log, 0 to disable
     fixed_day: Optional[str] = None
 
 
 class DataConfig(BaseSettings, WorkdirPathResolutionMixin):
-    _in_workdir_path_fields: ClassVar[List[str]] = ["population_cache_prefix", "state_file"]
+    _in_workdir_path_fields: ClassVar[List[str]] = ["population_cache_prefix", "state_file", "state_snapshot_file", "state_journal_file", "checkpoint_file"]
 
     # Agent settings
     population_max_size: Optional[int] = 100 + 20 # buffer 20 agents
     population_cache_prefix: str = "./population_"
-    state_file: str = "./state.json"
+    state_file: str = "./state.json"  # legacy full dump, still read on startup
+    # Scheduled start times: binary snapshot + append-only journal of the changes since
+    state_snapshot_file: str = "./state.snapshot.npz"
+    state_journal_file: str = "./state.journal.jsonl"
+    state_compact_every: int = 10000  # journal entries before compacting into the snapshot
+    # Full simulation checkpoint (population state, short-term memories, timers, trip cache), disabled when None
+    checkpoint_file: Optional[str] = None
+    checkpoint_interval: int = 6 * 3600  # simulation seconds between checkpoints
+    checkpoint_restore: bool = True  # restore the checkpoint on bootstrap when it exists
     number_of_llm_based_agents: Optional[int] = 0
+    population_seed: Optional[int] = 1  # sampling of the people, traits and LLM-based agents; None for a new draw each time
 
     # Synthesis settings
     synthetic_dir: str = os.path.join(base_dir, "../data/po_toulouse.big")
     synthetic_file_prefix: str = "toulouse_"
+    synthetic_spatial_index: bool = True  # grid index of the activity locations, saved next to the activities gpkg
+    synthetic_index_cell_size: float = 0.01  # degrees of geo_crs, ~1km
     # Debug
     debug_people_ids: Optional[list[str]] = None
 
 
 class AgentConfig(BaseSettings, WorkdirPathResolutionMixin):
-    _in_workdir_path_fields: ClassVar[List[str]] = ["long_term_memory_storage_dir", "chat_log_dir"]
+    _in_workdir_path_fields: ClassVar[List[str]] = ["long_term_memory_storage_dir", "chat_log_dir", "llm_record_replay_file"]
 
     llm_model: str = "mistral-7B-instruct-v0.3"
     embedding_model: Optional[str] = None
@@ -221,6 +249,16 @@ class AgentConfig(BaseSettings, WorkdirPathResolutionMixin):
         "top_p": 1.0,
         "max_tokens": 4096,
     }
+    # Record the LLM responses to a file, or replay them without any LLM server
+    llm_record_replay_mode: str = "off"  # off, record or replay
+    llm_record_replay_file: str = "llm_records.jsonl"
+    llm_replay_latency_scale: float = 0.0  # 1.0 replays the recorded latencies
+    # Synthetic LLM (llm_model: synthetic) for load tests
+    synthetic_llm_seed: int = 0
+    synthetic_llm_latency_distribution: str = "fixed"  # fixed, uniform or lognormal
+    synthetic_llm_latency_mean: float = 0.0  # seconds
+    synthetic_llm_latency_stddev: float = 0.0  # seconds
+    synthetic_llm_failure_rate: float = 0.0
     llm_retry_count: int = 3
     llm_retry_delay: int = 5  # seconds
 
@@ -231,13 +269,30 @@ class AgentConfig(BaseSettings, WorkdirPathResolutionMixin):
     reschedule_activity_v2__k: float = 0.02
     max_reschedule_amount: int = 3600  # 1 hour
     pre_schedule_duration: int = 0
+    # look only at the idle people whose next departure may be due, instead of every idle person on each tick
+    event_driven_departures: bool = True
 
     quantify_time_window: bool = True
     reflection_custom_guidelines: Optional[str] = None
     travel_plan_custom_guidelines: Optional[str] = None
 
+    # Reuse the previous trip choice when the person, purpose, day category, time bucket,
+    # travel options and retrieved experiences are all unchanged
+    decision_cache_enabled: bool = False
+    decision_cache_reuse_probability: float = 1.0
+    decision_cache_ttl: int = 7 * 24 * 3600  # seconds of simulation time
+    # Seed of the per-decision travel option shuffling and decision cache reuse draws, change it to get another (still reproducible) run
+    option_shuffle_seed: int = 0
+
     # Remote LLM settings
     remote_llm_max_concurrent_requests: Optional[int] = 20
+    # Build all reflection prompts of a sweep first and submit them as one batch,
+    # with a system prompt shared by everyone so the server can reuse its prefix cache
+    reflection_batch_enabled: bool = False
+    # Prompt layout: "legacy" keeps the persona in the system prompt; "prefix_cached" orders the prompt as
+    # static instructions, then persona, then the per-call payload, to maximise server-side prefix cache reuse
+    prompt_layout: str = "legacy"  # legacy or prefix_cached
+    prompt_stats_log_interval: int = 100  # log prompt token and prefix reuse stats every N LLM calls, 0 to disable
 
 
 class AppConfig(BaseSettings, WorkdirPathResolutionMixin):
@@ -1,2 +1,2 @@
-from trip_helper.base import TripHelper
+from trip_helper.base import TripHelper, TripQuery
 from trip_helper.solari import SolariTripHelper
@@ -1,16 +1,119 @@
-from typing import List
+import asyncio
+from typing import List, Optional
+
+from loguru import logger
+from pydantic import BaseModel
 from models import Location, TravelPlan
+from settings import settings
+
+
+class TripQuery(BaseModel):
+    origin: Location
+    destination: Location
+    departure_time: int
+    max_transfers: Optional[int] = None
 
 
 class TripHelper:
+    # TravelPlan times are in seconds, or in milliseconds when TIME_SCALE is 1000 (Solari)
+    TIME_SCALE = 1
+    # whether `get_itineraries_range` answers a whole departure window in one search
+    SUPPORTS_RANGE_QUERY = False
+
     def __init__(self):
         pass
 
-    async def get_itineraries(self, 
-                              origin: Location, 
-                              destination: Location, 
+    async def get_itineraries(self,
+                              origin: Location,
+                              destination: Location,
                               departure_time: int) -> List[TravelPlan]:
         """
         Get itineraries for a given origin, destination and departure time.
         """
         raise NotImplementedError()
+
+    async def get_itineraries_range(self,
+                                    origin: Location,
+                                    destination: Location,
+                                    departure_time: int,
+                                    search_window_m: int,
+                                    max_transfers: Optional[int] = None) -> List[TravelPlan]:
+        """
+        Get the itineraries leaving within [departure_time, departure_time + search_window_m minutes] in one search.
+        Only available when SUPPORTS_RANGE_QUERY is set.
+        """
+        raise NotImplementedError()
+
+    async def get_itineraries_range_many(self,
+                                         queries: List[TripQuery],
+                                         search_window_m: int,
+                                         max_concurrency: int = None) -> List[List[TravelPlan]]:
+        """
+        `get_itineraries_range` for many queries, in the order of the queries. Fans out with bounded
+        concurrency unless the trip helper batches natively; a failed query gets no itinerary.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or settings.gtfs.routing_max_concurrent_requests)
+
+        async def _query(query: TripQuery) -> List[TravelPlan]:
+            async with semaphore:
+                try:
+                    return await self.get_itineraries_range(
+                        origin=query.origin,
+                        destination=query.destination,
+                        departure_time=query.departure_time,
+                        search_window_m=search_window_m,
+                        max_transfers=query.max_transfers,
+                    )
+                except Exception as e:
+                    logger.error(f"[{self.__class__.__name__}]: Failed to get itineraries for {query}: {e}")
+                    return []
+
+        return list(await asyncio.gather(*[_query(query) for query in queries]))
+
+    def get_checkpoint_state(self) -> Optional[dict]:
+        """State worth keeping across restarts (caches), None when stateless"""
+        return None
+
+    def set_checkpoint_state(self, state: Optional[dict]):
+        pass
+
+    @staticmethod
+    def group_queries(queries: List[TripQuery]) -> dict[tuple, List[int]]:
+        """
+        Group the query indexes by (departure time, origin, max transfers), the queries of a group can share one search.
+        """
+        groups: dict[tuple, List[int]] = {}
+        for i, query in enumerate(queries):
+            key = (query.departure_time, query.origin.lon, query.origin.lat, query.max_transfers)
+            groups.setdefault(key, []).append(i)
+        return groups
+
+    async def _get_itineraries_of_query(self, query: TripQuery) -> List[TravelPlan]:
+        kwargs = {"max_transfers": query.max_transfers} if query.max_transfers is not None else {}
+        try:
+            return await self.get_itineraries(
+                origin=query.origin,
+                destination=query.destination,
+                departure_time=query.departure_time,
+                **kwargs,
+            )
+        except Exception as e:
+            logger.error(f"[{self.__class__.__name__}]: Failed to get itineraries for {query}: {e}")
+            return []
+
+    async def get_itineraries_many(self,
+                                   queries: List[TripQuery],
+                                   max_concurrency: int = None) -> List[List[TravelPlan]]:
+        """
+        Get the itineraries of many queries at once, in the order of the queries.
+
+        Trip helpers without native batching fan out to `get_itineraries` with bounded concurrency;
+        a failed query gets no itinerary instead of failing the batch.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or settings.gtfs.routing_max_concurrent_requests)
+
+        async def _query(query: TripQuery) -> List[TravelPlan]:
+            async with semaphore:
+                return await self._get_itineraries_of_query(query)
+
+        return list(await asyncio.gather(*[_query(query) for query in queries]))
@@ -1,7 +1,9 @@
 from collections import defaultdict
+from typing import Optional
 import os
 import pickle
-from trip_helper import TripHelper
+from trip_helper import TripHelper, TripQuery
+from trip_helper.stats import RoutingStats
 from models import Location, TravelPlan
 from world import WorldModel
 from utils import square_distance, random_uuid
@@ -9,6 +11,9 @@ from settings import settings
 from loguru import logger
 import asyncio
 
+routing_stats = RoutingStats.get_instance()
+
+
 class CachedTripHelper(TripHelper):
     def __init__(self, 
                  world_model: WorldModel,
@@ -42,6 +47,9 @@ class CachedTripHelper(TripHelper):
             logger.warning("[CachedTripHelper]: Cache is disabled, all requests will go to the trip_helper directly.")
 
         # choose the strategy based on settings
+        self.range_query = settings.gtfs.trip_query_mode == "range" and self.trip_helper.SUPPORTS_RANGE_QUERY
+        if settings.gtfs.trip_query_mode == "range" and not self.range_query:
+            logger.warning(f"[CachedTripHelper]: {self.trip_helper.__class__.__name__} has no range query, using shifted queries")
         if settings.gtfs.recursion_search_depth > 0:
             logger.warning(f"[CachedTripHelper]: Using recursive search strategy with depth {settings.gtfs.recursion_search_depth}")
             self.do_get_iteraries = self.do_get_iteraries_v1
@@ -58,6 +66,24 @@ class CachedTripHelper(TripHelper):
         # TODO: don't need to dump cache
         pass
 
+    def get_checkpoint_state(self) -> dict:
+        return {
+            "cache": dict(self.cache),
+            "blacklist": self.blacklist,
+            "cache_last_hour": self._cache_last_hour,
+            "notfound_cache_last_hour": self._notfound_cache_last_hour,
+            "stats_cache_hit": self._stats_cache_hit,
+        }
+
+    def set_checkpoint_state(self, state: Optional[dict]):
+        if not state:
+            return
+        self.cache = defaultdict(list, state["cache"])
+        self.blacklist = set(state["blacklist"])
+        self._cache_last_hour = state["cache_last_hour"]
+        self._notfound_cache_last_hour = state["notfound_cache_last_hour"]
+        self._stats_cache_hit = state["stats_cache_hit"]
+
     def get_unique_itineraries(self, itineraries: list[TravelPlan]) -> list[TravelPlan]:
         """
         Get unique itineraries by comparing the start and end locations, and the legs of the itinerary.
@@ -81,22 +107,35 @@ class CachedTripHelper(TripHelper):
         ]
         return len(set(keys)) < len(keys)  # if there are duplicates, it's circular
     
+    async def _get_shifted_itineraries(self, origin: Location, destination: Location, departure_time: int, max_transfers: int) -> list[list[TravelPlan]]:
+        queries = [
+            TripQuery(
+                origin=origin,
+                destination=destination,
+                departure_time=departure_time + i * 60,
+                max_transfers=max_transfers,
+            )
+            for i in settings.gtfs.trip_query_range
+        ]
+        return await self.trip_helper.get_itineraries_many(queries)
+
     async def do_get_iteraries_v2(self, origin: Location, destination: Location, departure_time: int) -> list[TravelPlan]:
         max_transfers = self.max_transfers
         time_step = settings.world.time_step
         departure_time = departure_time // time_step * time_step  # round down to the nearest time step
-        tasks = []
-        for i in settings.gtfs.trip_query_range:
-            adjusted_time = departure_time + i * 60
-            tasks.append(
-                self.trip_helper.get_itineraries(
-                    origin=origin,
-                    destination=destination,
-                    departure_time=adjusted_time,
-                    max_transfers=max_transfers
-                )
+        if self.range_query:
+            # One search over the span of trip_query_range instead of one query per offset
+            first_offset, last_offset = min(settings.gtfs.trip_query_range), max(settings.gtfs.trip_query_range)
+            itineraries = await self.trip_helper.get_itineraries_range(
+                origin=origin,
+                destination=destination,
+                departure_time=departure_time + first_offset * 60,
+                search_window_m=max(last_offset - first_offset, 1),
+                max_transfers=max_transfers,
             )
-        results = await asyncio.gather(*tasks)
+            results = [itineraries]
+        else:
+            results = await self._get_shifted_itineraries(origin, destination, departure_time, max_transfers)
 
         # Get max candidates from all results
         bl = set()
@@ -111,7 +150,7 @@ class CachedTripHelper(TripHelper):
                 break
 
         itineraries = rs
-        logger.debug(f"[CachedTripHelper]: Number of calls to trip_helper: {5}, ")
+        logger.debug(f"[CachedTripHelper]: Number of calls to trip_helper: {len(results)}, ")
         return itineraries
 
     async def do_get_iteraries_v1(self,
@@ -153,7 +192,7 @@ class CachedTripHelper(TripHelper):
                     self.trip_helper.get_itineraries(
                         origin=first_transit.end_location,
                         destination=destination,
-                        departure_time=first_transit.end_time // 1000,  # convert to seconds
+                        departure_time=first_transit.end_time // self.trip_helper.TIME_SCALE,  # convert to seconds
                         max_transfers=max_transfers
                     )
                 ))
@@ -189,6 +228,16 @@ class CachedTripHelper(TripHelper):
                               origin: Location,
                               destination: Location, 
                               departure_time: int) -> list[TravelPlan]:
+        with routing_stats.timer("cache", upstream=False):
+            itineraries = await self._get_itineraries(origin, destination, departure_time)
+        if not itineraries:
+            routing_stats.count("cache", "empty_results")
+        return itineraries
+
+    async def _get_itineraries(self,
+                               origin: Location,
+                               destination: Location,
+                               departure_time: int) -> list[TravelPlan]:
         grid_origin = self.world_grid.get_location_grid(origin)
         grid_destination = self.world_grid.get_location_grid(destination)
         time_slot = self.time_grid.get_time_slot(departure_time)
@@ -213,7 +262,11 @@ class CachedTripHelper(TripHelper):
         cache_hit = cache_hit and (key not in self.cache or len(self.cache[key]) < self.cache_size_per_grid)
         cache_hit = cache_hit and (bl_key not in self.blacklist)
 
+        # counted on what the branches do, `cache_hit` does not tell whether the cache answered
         if not cache_hit:
+            routing_stats.count("cache", "upstream_queries")
+            if bl_key in self.blacklist:
+                routing_stats.count("cache", "blacklisted_requeries")
             itineraries = await self.do_get_iteraries(origin, destination, departure_time)
             if itineraries:
                 # identify each itinerary with a unique id
@@ -242,19 +295,22 @@ class CachedTripHelper(TripHelper):
 
         # Find the closest itinerary to the origin and destination
         candidates = self.cache.get(key, [])
+        if cache_hit:
+            routing_stats.count("cache", "served_from_cache" if candidates else "empty_without_query")
         if not candidates:
             return []
         candidates = sorted(candidates, key=lambda x: (square_distance(x['origin'], origin), square_distance(x['destination'], destination)))
-        itineraries = candidates[0]['itineraries']
+        # copy, the cached plans are shared by the queries of the grid cell and patched below
+        itineraries = [it.model_copy(deep=True) for it in candidates[0]['itineraries']]
 
         # Modify the start and end location of the itinerary
         for itinerary in itineraries:
             itinerary.start_location = origin
             itinerary.end_location = destination
             # patch the all time values
-            departure_time_ms = departure_time * 1000
-            dt = departure_time_ms - itinerary.start_time
-            itinerary.start_time = departure_time_ms
+            departure_time_scaled = departure_time * self.trip_helper.TIME_SCALE
+            dt = departure_time_scaled - itinerary.start_time
+            itinerary.start_time = departure_time_scaled
             itinerary.end_time = itinerary.end_time + dt
             for leg in itinerary.legs:
                 leg.start_time = leg.start_time + dt
@@ -10,10 +10,13 @@ from models import Location, TransitLocation, TravelPlan, Transit
 import aiohttp
 import asyncio
 from trip_helper.base import TripHelper
+from trip_helper.stats import RoutingStats
 from utils import random_uuid
 from pydantic import BaseModel
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
+routing_stats = RoutingStats.get_instance()
+
 
 QUERY = """
 query trip($accessEgressPenalty: [PenaltyForStreetMode!], $alightSlackDefault: Int, $alightSlackList: [TransportModeSlack], $arriveBy: Boolean, $banned: InputBanned, $bicycleOptimisationMethod: BicycleOptimisationMethod, $bikeSpeed: Float, $boardSlackDefault: Int, $boardSlackList: [TransportModeSlack], $bookingTime: DateTime, $dateTime: DateTime, $filters: [TripFilterInput!], $from: Location!, $ignoreRealtimeUpdates: Boolean, $includePlannedCancellations: Boolean, $includeRealtimeCancellations: Boolean, $itineraryFilters: ItineraryFilters, $locale: Locale, $maxAccessEgressDurationForMode: [StreetModeDurationInput!], $maxDirectDurationForMode: [StreetModeDurationInput!], $maximumAdditionalTransfers: Int, $maximumTransfers: Int, $modes: Modes, $numTripPatterns: Int, $pageCursor: String, $relaxTransitGroupPriority: RelaxCostInput, $searchWindow: Int, $timetableView: Boolean, $to: Location!, $transferPenalty: Int, $transferSlack: Int, $triangleFactors: TriangleFactors, $useBikeRentalAvailabilityInformation: Boolean, $via: [TripViaLocationInput!], $waitReluctance: Float, $walkReluctance: Float, $walkSpeed: Float, $wheelchairAccessible: Boolean, $whiteListed: InputWhiteListed) {
@@ -124,6 +127,52 @@ query trip($accessEgressPenalty: [PenaltyForStreetMode!], $alightSlackDefault: I
 }
 """
 
+# Only the fields read by OTPTripHelper._parse_otp_travel_plan_lean
+LEAN_QUERY = """
+query trip($dateTime: DateTime, $from: Location!, $maximumTransfers: Int, $numTripPatterns: Int, $pageCursor: String, $searchWindow: Int, $to: Location!) {
+  trip(
+    dateTime: $dateTime
+    from: $from
+    maximumTransfers: $maximumTransfers
+    numTripPatterns: $numTripPatterns
+    pageCursor: $pageCursor
+    searchWindow: $searchWindow
+    to: $to
+  ) {
+    nextPageCursor
+    tripPatterns {
+      expectedStartTime
+      expectedEndTime
+      duration
+      distance
+      legs {
+        mode
+        expectedStartTime
+        expectedEndTime
+        distance
+        duration
+        fromPlace {
+          name
+          quay {
+            id
+          }
+        }
+        toPlace {
+          name
+          quay {
+            id
+          }
+        }
+        line {
+          id
+        }
+      }
+    }
+  }
+}
+"""
+
+
 class OTPPlace(BaseModel):
     name: str
     quay: Optional[dict] = None
@@ -182,11 +231,22 @@ class OTPTripPattern(BaseModel):
 
 class OTPTripHelper(TripHelper):
     SUPPORTED_MODES = ["foot", "bus", "metro", "tram", "cableway"]
+    SUPPORTS_RANGE_QUERY = True
 
-    def __init__(self, endpoint: str = None, gtfs_data: GTFSData = None):
+    def __init__(self, endpoint: str = None, gtfs_data: GTFSData = None, query_profile: str = None):
         self.endpoint = endpoint or settings.gtfs.otp_endpoint
         self.fixed_day: datetime = datetime.strptime(settings.gtfs.fixed_day, '%Y%m%d') if settings.gtfs.fixed_day else None
         self.gtfs_data = gtfs_data or GTFSData.DEFAULT()
+        self.query_profile = query_profile or settings.gtfs.otp_query_profile
+        assert self.query_profile in ("lean", "full"), f"Unsupported OTP query profile: {self.query_profile}"
+        if self.query_profile == "lean":
+            self.query = LEAN_QUERY
+            self.parse_travel_plan = self._parse_otp_travel_plan_lean
+        else:
+            self.query = QUERY
+            self.parse_travel_plan = self._parse_otp_travel_plan
+        # stop id -> (name, lat, lon), GTFSData.get_stop scans the whole stops table
+        self._stop_cache: dict[str, tuple[str, float, float]] = {}
 
     def timestamp_from_isoformat(self, iso_format: str) -> int:
         dt = datetime.fromisoformat(iso_format)
@@ -277,6 +337,76 @@ class OTPTripHelper(TripHelper):
             legs=transits,
         )
 
+    def _get_stop_info(self, stop_id: str) -> tuple[str, float, float]:
+        info = self._stop_cache.get(stop_id)
+        if info is None:
+            stop = self.gtfs_data.get_stop(stop_id)
+            info = self._stop_cache[stop_id] = (stop.stop_name, stop.stop_lat, stop.stop_lon)
+        return info
+
+    def _parse_otp_travel_plan_lean(self,
+                                    travel_plan: dict,
+                                    start_location: Optional[Location],
+                                    end_location: Optional[Location],
+                                    real_day: Optional[datetime] = None) -> TravelPlan:
+        """
+        Same result as _parse_otp_travel_plan, working on the raw response of LEAN_QUERY
+        without validating it through the OTP models.
+        """
+        day_shift = (real_day - self.fixed_day).days * 24 * 60 * 60 if (self.fixed_day and real_day) else 0
+
+        def _ptime(iso_time: str) -> int:
+            return int(datetime.fromisoformat(iso_time).timestamp()) + day_shift
+
+        def _location_from_place(place: dict) -> TransitLocation:
+            name = place["name"]
+            if name == "Origin":
+                return TransitLocation.model_construct(stop="", lat=start_location.lat, lon=start_location.lon)
+            elif name == "Destination":
+                return TransitLocation.model_construct(stop="", lat=end_location.lat, lon=end_location.lon)
+
+            quay = place.get("quay")
+            assert quay and quay.get("id"), f"Invalid place: {place}"
+            stop_name, stop_lat, stop_lon = self._get_stop_info(self.parse_gtfs_entity_id(quay["id"]))
+            return TransitLocation.model_construct(stop=stop_name, lat=stop_lat, lon=stop_lon)
+
+        transits = []
+        for leg in travel_plan["legs"]:
+            mode = leg["mode"]
+            assert mode in self.SUPPORTED_MODES, f"Unsupported mode: {mode}"
+            is_transfer = mode == "foot"
+
+            transit = Transit.model_construct(
+                start_time=_ptime(leg["expectedStartTime"]),
+                end_time=_ptime(leg["expectedEndTime"]),
+                duration=leg["duration"],
+                distance=leg["distance"],
+                mode=mode,
+                start_location=_location_from_place(leg["fromPlace"]),
+                end_location=_location_from_place(leg["toPlace"]),
+                is_transfer=is_transfer,
+            )
+            line = leg.get("line")
+            if not is_transfer and line:
+                transit.transit_route = self.parse_gtfs_entity_id(line["id"])
+                transit.shape_id = self.gtfs_data.get_shape_id_from_route_info(
+                    route_id=transit.transit_route,
+                    from_stop_name=transit.start_location.stop,
+                    to_stop_name=transit.end_location.stop,
+                )
+            transits.append(transit)
+
+        return TravelPlan(
+            id=random_uuid(),
+            start_location=start_location,
+            end_location=end_location,
+            start_time=_ptime(travel_plan["expectedStartTime"]),
+            end_time=_ptime(travel_plan["expectedEndTime"]),
+            duration=travel_plan["duration"],
+            distance=travel_plan["distance"],
+            legs=transits,
+        )
+
     def remove_duplicates(self, trips: List[TravelPlan], max_candidates: int) -> List[TravelPlan]:
         # Get max candidates from all results
         bl = set()
@@ -294,12 +424,29 @@ class OTPTripHelper(TripHelper):
     def revert_fixed_date(self, timestamp: int, real_date: int) -> int:
         return 0
 
+    async def get_itineraries_range(self,
+                                    origin: Location,
+                                    destination: Location,
+                                    departure_time: int,
+                                    search_window_m: int,
+                                    max_transfers: Optional[int] = None) -> List[TravelPlan]:
+        return await self.get_itineraries(
+            origin=origin,
+            destination=destination,
+            departure_time=departure_time,
+            search_window_m=search_window_m,
+            max_transfers=max_transfers,
+            max_pages=settings.gtfs.otp_max_pages,
+        )
+
     async def get_itineraries(self, 
                               origin: Location, 
                               destination: Location, 
                               departure_time: int, 
                               max_options: int=5, # unused
-                              search_window_m: int=30) -> List[TravelPlan]:
+                              search_window_m: int=30,
+                              max_transfers: Optional[int] = None,
+                              max_pages: int = 1) -> List[TravelPlan]:
 
         real_day = datetime.fromtimestamp(departure_time) if self.fixed_day else None
         real_departure_time = departure_time
@@ -311,7 +458,7 @@ class OTPTripHelper(TripHelper):
         async with aiohttp.ClientSession() as session:
             start_at = datetime.fromtimestamp(departure_time, tz=timezone.utc).isoformat()
             payload = {
-                "query": QUERY,
+                "query": self.query,
                 "variables": {
                     "from": {
                         "coordinates": {
@@ -331,11 +478,14 @@ class OTPTripHelper(TripHelper):
                 },
                 "operationName": "trip"
             }
+            if max_transfers is not None:
+                payload["variables"]["maximumTransfers"] = max_transfers
 
             @retry(
                 stop=stop_after_attempt(5),
                 wait=wait_exponential(multiplier=1, min=1, max=10),
-                retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError))
+                retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError)),
+                before_sleep=lambda _: routing_stats.count("otp", "retries"),
             )
             async def make_request():
                 async with session.post(self.endpoint, json=payload, timeout=10) as response:
@@ -343,17 +493,27 @@ class OTPTripHelper(TripHelper):
                     return await response.json()
             
             try:
-                data = await make_request()
                 plans = []
-                for item in data["data"]["trip"]["tripPatterns"]:
-                    try:
-                        p = self._parse_otp_travel_plan(item, start_location=origin, end_location=destination, real_day=real_day)
-                        p.start_in = max(0, p.start_time - real_departure_time)
-                        plans.append(p)
-                    except Exception as e:
-                        logger.error(f"Error parsing travel plan: {e}, body: {item}")
+                for page in range(max(max_pages, 1)):
+                    with routing_stats.timer("otp"):
+                        data = await make_request()
+                    for item in data["data"]["trip"]["tripPatterns"]:
+                        try:
+                            p = self.parse_travel_plan(item, start_location=origin, end_location=destination, real_day=real_day)
+                            p.start_in = max(0, p.start_time - real_departure_time)
+                            plans.append(p)
+                        except Exception as e:
+                            routing_stats.count("otp", "parse_failures")
+                            logger.error(f"Error parsing travel plan: {e}, body: {item}")
+                    # Follow the next page of the search window until there are enough distinct candidates
+                    next_page_cursor = data["data"]["trip"].get("nextPageCursor")
+                    if not next_page_cursor or len({p.get_code() for p in plans if p.legs}) >= settings.gtfs.max_trip_candidates:
+                        break
+                    payload["variables"]["pageCursor"] = next_page_cursor
                 plans = list(filter(lambda x: x.legs, plans))
                 plans = self.remove_duplicates(plans, max_candidates=settings.gtfs.max_trip_candidates)
+                if not plans:
+                    routing_stats.count("otp", "empty_results")
                 logger.debug(f"Payload: {json.dumps(payload, ensure_ascii=False)}, found {len(plans)} itineraries")
                 return plans
             except Exception as e:
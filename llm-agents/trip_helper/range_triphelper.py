@@ -0,0 +1,79 @@
+from typing import List, Optional
+
+from models import Location, TravelPlan
+from settings import settings
+from trip_helper.base import TripHelper, TripQuery
+
+
+class RangeTripHelper(TripHelper):
+    """
+    Range query mode (gtfs.trip_query_mode = "range") over a trip helper with SUPPORTS_RANGE_QUERY (OTP, RAPTOR):
+    one search over the span of trip_query_range per query instead of one query per offset.
+
+    No cache, every query reaches the trip helper; the batches of the scenario loop go to its
+    `get_itineraries_range_many`, so RAPTOR keeps its one-to-many searches.
+    """
+    SUPPORTS_RANGE_QUERY = True
+
+    def __init__(self, trip_helper: TripHelper):
+        super().__init__()
+        if not trip_helper.SUPPORTS_RANGE_QUERY:
+            raise ValueError(f"{trip_helper.__class__.__name__} has no range query")
+        self.trip_helper = trip_helper
+        self.TIME_SCALE = trip_helper.TIME_SCALE
+
+    @staticmethod
+    def search_window() -> tuple[int, int]:
+        """(offset of the first departure in seconds, window in minutes) covering trip_query_range"""
+        first_offset, last_offset = min(settings.gtfs.trip_query_range), max(settings.gtfs.trip_query_range)
+        return first_offset * 60, max(last_offset - first_offset, 1)
+
+    def select_candidates(self, plans: List[TravelPlan], departure_time: int) -> List[TravelPlan]:
+        """
+        Distinct plans, at most max_trip_candidates, waiting times from the requested departure time.
+        The plans leaving from the departure time come first, the earlier ones of the window only fill up.
+        """
+        selected = []
+        codes = set()
+        for plan in sorted(plans, key=lambda plan: plan.start_time // self.TIME_SCALE < departure_time):
+            code = plan.get_code()
+            if code in codes:
+                continue
+            codes.add(code)
+            # the window starts before the departure time, the trip helper counted from its start
+            plan.start_in = max(0, plan.start_time // self.TIME_SCALE - departure_time)
+            selected.append(plan)
+            if len(selected) >= settings.gtfs.max_trip_candidates:
+                break
+        return selected
+
+    async def get_itineraries(self,
+                              origin: Location,
+                              destination: Location,
+                              departure_time: int,
+                              max_transfers: Optional[int] = None) -> List[TravelPlan]:
+        offset, search_window_m = self.search_window()
+        plans = await self.trip_helper.get_itineraries_range(
+            origin=origin,
+            destination=destination,
+            departure_time=departure_time + offset,
+            search_window_m=search_window_m,
+            max_transfers=max_transfers,
+        )
+        return self.select_candidates(plans, departure_time)
+
+    async def get_itineraries_range(self,
+                                    origin: Location,
+                                    destination: Location,
+                                    departure_time: int,
+                                    search_window_m: int,
+                                    max_transfers: Optional[int] = None) -> List[TravelPlan]:
+        return await self.trip_helper.get_itineraries_range(origin, destination, departure_time, search_window_m, max_transfers)
+
+    async def get_itineraries_many(self,
+                                   queries: List[TripQuery],
+                                   max_concurrency: int = None) -> List[List[TravelPlan]]:
+        offset, search_window_m = self.search_window()
+        shifted_queries = [query.model_copy(update={"departure_time": query.departure_time + offset}) for query in queries]
+        results = await self.trip_helper.get_itineraries_range_many(shifted_queries, search_window_m, max_concurrency=max_concurrency)
+        return [self.select_candidates(plans, query.departure_time) for query, plans in zip(queries, results)]
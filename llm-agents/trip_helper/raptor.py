@@ -0,0 +1,172 @@
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+
+from loguru import logger
+from inputs.gtfs import GTFSData
+from settings import settings
+from models import Location, TransitLocation, TravelPlan, Transit
+from trip_helper.base import TripHelper, TripQuery
+from trip_helper.router import GTFSRouter, RouterJourney
+from trip_helper.stats import RoutingStats
+from utils import random_uuid
+
+routing_stats = RoutingStats.get_instance()
+
+
+class RaptorTripHelper(TripHelper):
+    """
+    In-process trip helper: routes with GTFSRouter (RAPTOR) instead of calling OTP or Solari over HTTP.
+    Times are in seconds, like OTPTripHelper.
+    """
+    SUPPORTS_RANGE_QUERY = True
+
+    def __init__(self, gtfs_data: GTFSData = None, router: GTFSRouter = None):
+        super().__init__()
+        self.gtfs_data = gtfs_data or GTFSData.DEFAULT()
+        self.router = router or GTFSRouter(gtfs_data=self.gtfs_data)
+        self.fixed_day: datetime = datetime.strptime(settings.gtfs.fixed_day, '%Y%m%d') if settings.gtfs.fixed_day else None
+
+    def _transit_location(self, stop: Optional[int], default: Location) -> TransitLocation:
+        if stop is None:
+            return TransitLocation(stop="", lat=default.lat, lon=default.lon)
+        return TransitLocation(
+            stop=self.router.stop_names[stop],
+            lat=float(self.router.stop_lats[stop]),
+            lon=float(self.router.stop_lons[stop]),
+        )
+
+    def _to_travel_plan(self, journey: RouterJourney, origin: Location, destination: Location, day_shift: int) -> TravelPlan:
+        transits = []
+        for leg in journey.legs:
+            is_transfer = leg.mode == "foot"
+            transit = Transit(
+                start_time=leg.start_time + day_shift,
+                end_time=leg.end_time + day_shift,
+                duration=leg.end_time - leg.start_time,
+                distance=leg.distance,
+                mode=leg.mode,
+                start_location=self._transit_location(leg.from_stop, origin),
+                end_location=self._transit_location(leg.to_stop, destination),
+                is_transfer=is_transfer,
+            )
+            if not is_transfer:
+                transit.transit_route = leg.route_id
+                transit.shape_id = self.gtfs_data.get_shape_id_from_route_info(
+                    route_id=transit.transit_route,
+                    from_stop_name=transit.start_location.stop,
+                    to_stop_name=transit.end_location.stop,
+                )
+            transits.append(transit)
+
+        return TravelPlan(
+            id=random_uuid(),
+            start_location=origin,
+            end_location=destination,
+            start_time=journey.start_time + day_shift,
+            end_time=journey.end_time + day_shift,
+            duration=journey.end_time - journey.start_time,
+            distance=sum(leg.distance for leg in journey.legs),
+            legs=transits,
+        )
+
+    def _routed_departure_time(self, departure_time: int) -> int:
+        # Same as OTPTripHelper: route on the fixed day, then shift the results back to the real day
+        if self.fixed_day is None:
+            return departure_time
+        real_day = datetime.fromtimestamp(departure_time)
+        return int(self.fixed_day.replace(hour=real_day.hour, minute=real_day.minute, second=real_day.second).timestamp())
+
+    def _to_travel_plans(self, journeys: List[RouterJourney], origin: Location, destination: Location, departure_time: int) -> List[TravelPlan]:
+        day_shift = departure_time - self._routed_departure_time(departure_time)
+        plans = []
+        for journey in journeys:
+            try:
+                plan = self._to_travel_plan(journey, origin, destination, day_shift)
+                plan.start_in = max(0, plan.start_time - departure_time)
+                plans.append(plan)
+            except Exception as e:
+                logger.error(f"Error converting journey: {e}, journey: {journey}")
+        return list(filter(lambda x: x.legs, plans))
+
+    async def get_itineraries(self,
+                              origin: Location,
+                              destination: Location,
+                              departure_time: int,
+                              max_transfers: int = 5,
+                              search_window_m: int = 30) -> List[TravelPlan]:
+        with routing_stats.timer("raptor"):
+            journeys = self.router.route_range(
+                origin.lon, origin.lat, destination.lon, destination.lat,
+                departure_time=self._routed_departure_time(departure_time),
+                search_window=search_window_m * 60,
+                max_transfers=max_transfers,
+                max_journeys=settings.gtfs.max_trip_candidates,
+            )
+        plans = self._to_travel_plans(journeys, origin, destination, departure_time)
+        if not plans:
+            routing_stats.count("raptor", "empty_results")
+        logger.debug(f"[RaptorTripHelper]: {origin} -> {destination} at {departure_time}, found {len(plans)} itineraries")
+        return plans
+
+    async def get_itineraries_range(self,
+                                    origin: Location,
+                                    destination: Location,
+                                    departure_time: int,
+                                    search_window_m: int,
+                                    max_transfers: Optional[int] = None) -> List[TravelPlan]:
+        return await self.get_itineraries(
+            origin=origin,
+            destination=destination,
+            departure_time=departure_time,
+            max_transfers=max_transfers if max_transfers is not None else 5,
+            search_window_m=search_window_m,
+        )
+
+    async def get_itineraries_range_many(self,
+                                         queries: List[TripQuery],
+                                         search_window_m: int,
+                                         max_concurrency: int = None) -> List[List[TravelPlan]]:
+        return await self.get_itineraries_many(queries, max_concurrency=max_concurrency, search_window_m=search_window_m)
+
+    async def get_itineraries_many(self,
+                                   queries: List[TripQuery],
+                                   max_concurrency: int = None,
+                                   search_window_m: int = 30) -> List[List[TravelPlan]]:
+        """
+        The queries leaving from the same origin at the same time share one one-to-many search.
+        """
+        results: List[List[TravelPlan]] = [[] for _ in queries]
+        for (departure_time, origin_lon, origin_lat, max_transfers), indexes in self.group_queries(queries).items():
+            try:
+                with routing_stats.timer("raptor"):
+                    journeys = self.router.route_range_many(
+                        origin_lon, origin_lat,
+                        [(queries[i].destination.lon, queries[i].destination.lat) for i in indexes],
+                        departure_time=self._routed_departure_time(departure_time),
+                        search_window=search_window_m * 60,
+                        max_transfers=max_transfers if max_transfers is not None else 5,
+                        max_journeys=settings.gtfs.max_trip_candidates,
+                    )
+            except Exception as e:
+                logger.error(f"[RaptorTripHelper]: Failed to route {len(indexes)} queries from ({origin_lon}, {origin_lat}): {e}")
+                continue
+            for i, found in zip(indexes, journeys):
+                results[i] = self._to_travel_plans(found, queries[i].origin, queries[i].destination, departure_time)
+                if not results[i]:
+                    routing_stats.count("raptor", "empty_results")
+            # routing is CPU bound, let the other tasks run between two groups
+            await asyncio.sleep(0)
+
+        logger.debug(f"[RaptorTripHelper]: {len(queries)} queries routed, {sum(1 for r in results if r)} with itineraries")
+        return results
+
+
+if __name__ == '__main__':
+    rth = RaptorTripHelper()
+    loop = asyncio.get_event_loop()
+    origin = Location(lon=1.53423130511658, lat=43.586655062927974)
+    destination = Location(lon=1.486291134338381, lat=43.54970809807004)
+    departure_time = 1742845000
+    itineraries = loop.run_until_complete(rth.get_itineraries(origin, destination, departure_time))
+    print(itineraries)
@@ -0,0 +1,396 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from scipy.spatial import cKDTree
+
+from inputs.gtfs import GTFSData
+from settings import settings
+
+
+INF = np.iinfo(np.int32).max
+
+# GTFS route_type -> OTP Transmodel mode
+ROUTE_TYPE_MODES = {
+    0: "tram",
+    1: "metro",
+    2: "rail",
+    3: "bus",
+    6: "cableway",
+    7: "funicular",
+}
+
+
+def gtfs_time_to_seconds(values: pd.Series) -> np.ndarray:
+    """"HH:MM:SS" (hours may exceed 24) to seconds after midnight"""
+    parts = values.astype(str).str.split(":", expand=True).astype(np.int32)
+    return (parts[0] * 3600 + parts[1] * 60 + parts[2]).to_numpy(np.int32)
+
+
+@dataclass
+class RouterLeg:
+    mode: str  # "foot" or the transit mode
+    from_stop: Optional[int]  # stop index, None for the origin
+    to_stop: Optional[int]  # stop index, None for the destination
+    start_time: int  # epoch seconds
+    end_time: int
+    distance: float
+    route_id: Optional[str] = None
+    trip_id: Optional[str] = None
+
+
+@dataclass
+class RouterJourney:
+    start_time: int
+    end_time: int
+    legs: list[RouterLeg] = field(default_factory=list)
+
+    @property
+    def transit_legs(self) -> list[RouterLeg]:
+        return [leg for leg in self.legs if leg.mode != "foot"]
+
+    def get_code(self) -> tuple:
+        return tuple((leg.route_id, leg.from_stop, leg.to_stop) for leg in self.transit_legs)
+
+
+class _Pattern:
+    """Trips of a route serving the same stop sequence, sorted by departure (RAPTOR route)"""
+    __slots__ = ("route_id", "mode", "stops", "trip_ids", "service_ids", "arrivals", "departures")
+
+    def __init__(self, route_id: str, mode: str, stops: np.ndarray):
+        self.route_id = route_id
+        self.mode = mode
+        self.stops = stops
+        self.trip_ids: list = []
+        self.service_ids: list = []
+        self.arrivals: list = []
+        self.departures: list = []
+
+    def freeze(self):
+        order = np.argsort([dep[0] for dep in self.departures], kind="stable")
+        self.trip_ids = np.asarray(self.trip_ids, dtype=object)[order]
+        self.service_ids = np.asarray(self.service_ids, dtype=object)[order]
+        self.arrivals = np.vstack(self.arrivals)[order]
+        self.departures = np.vstack(self.departures)[order]
+
+
+class GTFSRouter:
+    """
+    In-process public transport router over GTFSData, implementing RAPTOR (Delling et al., 2012).
+
+    Each round adds one transit leg; the journeys improving the arrival at the destination form the
+    Pareto set of (arrival time, number of transit legs). Access, egress and transfers are straight-line walks
+    to the stops within the configured radii.
+    Like the rest of the code base, services are assumed to run every day unless calendar_dates.txt lists the date.
+    """
+
+    def __init__(self,
+                 gtfs_data: GTFSData = None,
+                 access_radius: float = None,
+                 transfer_radius: float = None,
+                 walk_speed: float = None,
+                 transfer_slack: int = None):
+        self.gtfs_data = gtfs_data or GTFSData.DEFAULT()
+        self.access_radius = access_radius or settings.gtfs.router_access_radius
+        self.transfer_radius = transfer_radius or settings.gtfs.router_transfer_radius
+        self.walk_speed = walk_speed or settings.gtfs.router_walk_speed
+        self.transfer_slack = settings.gtfs.router_transfer_slack if transfer_slack is None else transfer_slack
+
+        self._build_stops()
+        self._build_patterns()
+        self._build_footpaths()
+        self._active_trips_by_date: dict[str, list[np.ndarray]] = {}
+
+    def _build_stops(self):
+        stops = self.gtfs_data.stops
+        self.stop_ids = stops["stop_id"].astype(str).to_numpy()
+        self.stop_names = stops["stop_name"].astype(str).to_numpy()
+        self.stop_lons = stops["stop_lon"].to_numpy(float)
+        self.stop_lats = stops["stop_lat"].to_numpy(float)
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+
+        # Local equirectangular projection in meters, good enough at city scale
+        self._lat0 = np.deg2rad(float(np.mean(self.stop_lats))) if len(self.stop_lats) else 0.0
+        self.stop_xy = self.project(self.stop_lons, self.stop_lats)
+        self.stop_tree = cKDTree(self.stop_xy)
+
+    def project(self, lon, lat) -> np.ndarray:
+        return np.column_stack([
+            np.asarray(lon, dtype=float) * 111320.0 * np.cos(self._lat0),
+            np.asarray(lat, dtype=float) * 110540.0,
+        ])
+
+    def _build_patterns(self):
+        gtfs = self.gtfs_data
+        stop_times = gtfs.stop_times[["trip_id", "stop_sequence", "stop_id", "arrival_time", "departure_time"]]
+        stop_times = stop_times[stop_times["stop_id"].astype(str).isin(self.stop_index)]
+        stop_times = stop_times.sort_values(["trip_id", "stop_sequence"], kind="stable")
+
+        trip_codes = stop_times["trip_id"].astype(str).to_numpy()
+        stops = stop_times["stop_id"].astype(str).map(self.stop_index).to_numpy(np.int32)
+        arrivals = gtfs_time_to_seconds(stop_times["arrival_time"])
+        departures = gtfs_time_to_seconds(stop_times["departure_time"])
+
+        trip_ids = gtfs.trips["trip_id"].astype(str)
+        trip_routes = dict(zip(trip_ids, gtfs.trips["route_id"].astype(str)))
+        trip_services = dict(zip(trip_ids, gtfs.trips["service_id"].astype(str)))
+        route_types = dict(zip(gtfs.routes["route_id"].astype(str), gtfs.routes["route_type"].astype(int)))
+
+        boundaries = np.flatnonzero(trip_codes[1:] != trip_codes[:-1]) + 1
+        starts = np.concatenate([[0], boundaries]) if len(trip_codes) else np.array([], dtype=int)
+        ends = np.concatenate([boundaries, [len(trip_codes)]]) if len(trip_codes) else np.array([], dtype=int)
+
+        patterns: dict[tuple, _Pattern] = {}
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            trip_id = trip_codes[start]
+            route_id = trip_routes.get(trip_id)
+            if route_id is None:
+                continue
+            key = (route_id, stops[start:end].tobytes())
+            pattern = patterns.get(key)
+            if pattern is None:
+                mode = ROUTE_TYPE_MODES.get(route_types.get(route_id), "bus")
+                pattern = patterns[key] = _Pattern(route_id, mode, stops[start:end].copy())
+            pattern.trip_ids.append(trip_id)
+            pattern.service_ids.append(trip_services[trip_id])
+            pattern.arrivals.append(arrivals[start:end])
+            pattern.departures.append(departures[start:end])
+
+        self.patterns: list[_Pattern] = list(patterns.values())
+        for pattern in self.patterns:
+            pattern.freeze()
+
+        self.stop_patterns: list[list[tuple[int, int]]] = [[] for _ in range(len(self.stop_ids))]
+        for p, pattern in enumerate(self.patterns):
+            for i, stop in enumerate(pattern.stops[:-1]):
+                self.stop_patterns[stop].append((p, i))
+
+        logger.info(f"[GTFSRouter]: {len(self.patterns)} patterns from {len(starts)} trips over {len(self.stop_ids)} stops")
+
+    def _build_footpaths(self):
+        self.footpaths: list[list[tuple[int, int, float]]] = [[] for _ in range(len(self.stop_ids))]
+        for a, b in self.stop_tree.query_pairs(r=self.transfer_radius):
+            distance = float(np.linalg.norm(self.stop_xy[a] - self.stop_xy[b]))
+            duration = int(distance / self.walk_speed)
+            self.footpaths[a].append((b, duration, distance))
+            self.footpaths[b].append((a, duration, distance))
+
+    def _active_trips(self, day: datetime) -> list[np.ndarray]:
+        """Indexes of the trips running on `day` for each pattern"""
+        date = day.strftime("%Y%m%d")
+        if date not in self._active_trips_by_date:
+            calendar_dates = self.gtfs_data.calendar_dates
+            services = set(calendar_dates.loc[calendar_dates["date"].astype(str) == date, "service_id"].astype(str))
+            if services:
+                active = [np.flatnonzero(np.isin(p.service_ids, list(services))) for p in self.patterns]
+            else:
+                active = [np.arange(len(p.trip_ids)) for p in self.patterns]
+            self._active_trips_by_date = {date: active}  # one day at a time is enough for the simulation
+        return self._active_trips_by_date[date]
+
+    def _walkable_stops(self, lon: float, lat: float) -> dict[int, tuple[int, float]]:
+        xy = self.project([lon], [lat])[0]
+        result = {}
+        for stop in self.stop_tree.query_ball_point(xy, r=self.access_radius):
+            distance = float(np.linalg.norm(self.stop_xy[stop] - xy))
+            result[stop] = (int(distance / self.walk_speed), distance)
+        return result
+
+    def route(self,
+              origin_lon: float, origin_lat: float,
+              destination_lon: float, destination_lat: float,
+              departure_time: int,
+              max_transfers: int = 5) -> list[RouterJourney]:
+        """Pareto-optimal journeys (arrival time, number of transit legs) leaving at departure_time"""
+        return self.route_many(origin_lon, origin_lat, [(destination_lon, destination_lat)], departure_time, max_transfers)[0]
+
+    def route_many(self,
+                   origin_lon: float, origin_lat: float,
+                   destinations: list[tuple[float, float]],
+                   departure_time: int,
+                   max_transfers: int = 5) -> list[list[RouterJourney]]:
+        """
+        One-to-many: the Pareto-optimal journeys to each (lon, lat) destination, from a single search.
+        The search is pruned by the latest of the best arrivals, so it explores no further than
+        the farthest destination needs.
+        """
+        day = datetime.fromtimestamp(departure_time).replace(hour=0, minute=0, second=0, microsecond=0)
+        day_start = int(day.timestamp())
+        t0 = departure_time - day_start
+
+        access = self._walkable_stops(origin_lon, origin_lat)
+        egresses = [self._walkable_stops(lon, lat) for lon, lat in destinations]
+        alive = [d for d, egress in enumerate(egresses) if egress]
+        if not access or not alive:
+            return [[] for _ in destinations]
+        active_trips = self._active_trips(day)
+
+        n_stops = len(self.stop_ids)
+        tau = [np.full(n_stops, INF, dtype=np.int64)]
+        best = np.full(n_stops, INF, dtype=np.int64)
+        for stop, (duration, _) in access.items():
+            tau[0][stop] = best[stop] = t0 + duration
+        parents: list[dict] = [{}]
+        marked = set(access)
+        best_targets = {d: INF for d in alive}
+        bound = INF
+        targets: dict[int, list[tuple[int, int, int]]] = {d: [] for d in alive}  # (round, egress stop, arrival)
+
+        for k in range(1, max_transfers + 2):
+            tau_k = tau[k - 1].copy()
+            parents_k = {}
+            tau.append(tau_k)
+            parents.append(parents_k)
+
+            queue: dict[int, int] = {}
+            for stop in marked:
+                for p, i in self.stop_patterns[stop]:
+                    if queue.get(p, INF) > i:
+                        queue[p] = i
+
+            reached = set()
+            for p, i0 in queue.items():
+                pattern = self.patterns[p]
+                trips = active_trips[p]
+                if len(trips) == 0:
+                    continue
+                departures = pattern.departures[trips]
+                arrivals = pattern.arrivals[trips]
+                trip, board_i = -1, -1
+                for i in range(i0, len(pattern.stops)):
+                    stop = int(pattern.stops[i])
+                    if trip >= 0:
+                        arrival = arrivals[trip, i]
+                        if arrival < best[stop] and arrival < bound:
+                            tau_k[stop] = best[stop] = arrival
+                            parents_k[stop] = ("trip", p, int(trips[trip]), board_i, i)
+                            reached.add(stop)
+                    previous = tau[k - 1][stop]
+                    if previous < INF:
+                        ready = previous + (self.transfer_slack if k > 1 else 0)
+                        if trip < 0 or ready <= departures[trip, i]:
+                            j = int(np.searchsorted(departures[:, i], ready, side="left"))
+                            if j < len(trips) and (trip < 0 or j < trip):
+                                trip, board_i = j, i
+
+            for stop in list(reached):
+                for other, duration, distance in self.footpaths[stop]:
+                    arrival = tau_k[stop] + duration
+                    if arrival < best[other] and arrival < bound:
+                        tau_k[other] = best[other] = arrival
+                        parents_k[other] = ("walk", stop, duration, distance)
+                        reached.add(other)
+
+            for d in alive:
+                round_best = None
+                for stop, (duration, _) in egresses[d].items():
+                    if stop in parents_k and tau_k[stop] + duration < best_targets[d]:
+                        best_targets[d] = int(tau_k[stop]) + duration
+                        round_best = stop
+                if round_best is not None:
+                    targets[d].append((k, round_best, best_targets[d]))
+            bound = max(best_targets.values())
+
+            marked = reached
+            if not marked:
+                break
+
+        journeys = [[] for _ in destinations]
+        for d in alive:
+            journeys[d] = [
+                self._reconstruct(parents, k, stop, arrival, access, egresses[d], day_start, departure_time)
+                for k, stop, arrival in targets[d]
+            ]
+        return journeys
+
+    def _find_label(self, parents: list[dict], k: int, stop: int) -> tuple[int, Optional[tuple]]:
+        # the arrival at a stop may come from an earlier round, tau_k starts as a copy of tau_k-1
+        for r in range(k, 0, -1):
+            if stop in parents[r]:
+                return r, parents[r][stop]
+        return 0, None
+
+    def _reconstruct(self, parents, k, stop, arrival, access, egress, day_start, departure_time) -> RouterJourney:
+        legs: list[RouterLeg] = []
+        egress_duration, egress_distance = egress[stop]
+        legs.append(RouterLeg("foot", stop, None, day_start + arrival - egress_duration, day_start + arrival, egress_distance))
+
+        r = k
+        while True:
+            r, label = self._find_label(parents, r, stop)
+            if label is None:
+                access_duration, access_distance = access[stop]
+                first_departure = legs[-1].start_time
+                legs.append(RouterLeg("foot", None, stop, first_departure - access_duration, first_departure, access_distance))
+                break
+            if label[0] == "walk":
+                _, from_stop, duration, distance = label
+                end = legs[-1].start_time
+                legs.append(RouterLeg("foot", from_stop, stop, end - duration, end, distance))
+                stop = from_stop
+                continue
+            _, p, trip, board_i, alight_i = label
+            pattern = self.patterns[p]
+            board_stop = int(pattern.stops[board_i])
+            distance = float(np.sum(np.linalg.norm(np.diff(self.stop_xy[pattern.stops[board_i:alight_i + 1]], axis=0), axis=1)))
+            legs.append(RouterLeg(
+                mode=pattern.mode,
+                from_stop=board_stop,
+                to_stop=stop,
+                start_time=day_start + int(pattern.departures[trip, board_i]),
+                end_time=day_start + int(pattern.arrivals[trip, alight_i]),
+                distance=distance,
+                route_id=pattern.route_id,
+                trip_id=str(pattern.trip_ids[trip]),
+            ))
+            stop = board_stop
+            r -= 1
+
+        legs.reverse()
+        # Leave as late as possible: the walk to the first stop ends at the boarding time
+        return RouterJourney(start_time=max(departure_time, legs[0].start_time), end_time=legs[-1].end_time, legs=legs)
+
+    def route_range(self,
+                    origin_lon: float, origin_lat: float,
+                    destination_lon: float, destination_lat: float,
+                    departure_time: int,
+                    search_window: int = 1800,
+                    step: int = 600,
+                    max_transfers: int = 5,
+                    max_journeys: int = 20) -> list[RouterJourney]:
+        """Journeys leaving within [departure_time, departure_time + search_window], without duplicates"""
+        return self.route_range_many(
+            origin_lon, origin_lat, [(destination_lon, destination_lat)], departure_time,
+            search_window=search_window, step=step, max_transfers=max_transfers, max_journeys=max_journeys,
+        )[0]
+
+    def route_range_many(self,
+                         origin_lon: float, origin_lat: float,
+                         destinations: list[tuple[float, float]],
+                         departure_time: int,
+                         search_window: int = 1800,
+                         step: int = 600,
+                         max_transfers: int = 5,
+                         max_journeys: int = 20) -> list[list[RouterJourney]]:
+        """route_range for many destinations, one one-to-many search per departure step"""
+        journeys: list[dict[tuple, RouterJourney]] = [{} for _ in destinations]
+        pending = list(range(len(destinations)))
+        for t in range(departure_time, departure_time + max(search_window, 0) + 1, max(step, 1)):
+            results = self.route_many(origin_lon, origin_lat, [destinations[d] for d in pending], t, max_transfers=max_transfers)
+            for d, result in zip(pending, results):
+                for journey in result:
+                    code = journey.get_code()
+                    if code and code not in journeys[d]:
+                        journeys[d][code] = journey
+            pending = [d for d in pending if len(journeys[d]) < max_journeys]
+            if not pending:
+                break
+        return [
+            sorted(found.values(), key=lambda j: (j.end_time, len(j.transit_legs)))[:max_journeys]
+            for found in journeys
+        ]
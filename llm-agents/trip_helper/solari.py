@@ -6,10 +6,16 @@ from settings import settings
 from models import Location, TravelPlan, Transit
 import aiohttp
 from trip_helper.base import TripHelper
+from trip_helper.stats import RoutingStats
 from utils import random_uuid
 
+routing_stats = RoutingStats.get_instance()
+
 
 class SolariTripHelper(TripHelper):
+    TIME_SCALE = 1000
+    # Solari only answers point queries, CachedTripHelper shifts the departure instead
+
     def __init__(self, endpoint: str = None, gtfs_data: GTFSData = None):
         self.endpoint = endpoint or settings.gtfs.solari_endpoint
         self.gtfs_data = gtfs_data or GTFSData.DEFAULT()
@@ -46,19 +52,23 @@ class SolariTripHelper(TripHelper):
                 "start_at": start_at_ms,
                 "max_transfers": max_transfers,
             }
-            async with session.post(self.endpoint, json=payload, timeout=10) as response:
-                response.raise_for_status()
-                data = await response.json()
-                assert data.get("status") == "ok", f"Error: {data.get('message')}"
-                plans = []
-                for item in data["itineraries"]:
-                    try:
-                        plans.append(self._parse_solari_travel_plan(item))
-                    except Exception as e:
-                        logger.error(f"Error parsing travel plan: {e}, body: {item}")
-                plans = list(filter(lambda x: x.legs, plans))
-                logger.debug(f"Payload: {payload}, found {len(plans)} itineraries")
-                return plans
+            with routing_stats.timer("solari"):
+                async with session.post(self.endpoint, json=payload, timeout=10) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+            assert data.get("status") == "ok", f"Error: {data.get('message')}"
+            plans = []
+            for item in data["itineraries"]:
+                try:
+                    plans.append(self._parse_solari_travel_plan(item))
+                except Exception as e:
+                    routing_stats.count("solari", "parse_failures")
+                    logger.error(f"Error parsing travel plan: {e}, body: {item}")
+            plans = list(filter(lambda x: x.legs, plans))
+            if not plans:
+                routing_stats.count("solari", "empty_results")
+            logger.debug(f"Payload: {payload}, found {len(plans)} itineraries")
+            return plans
 
 
 if __name__ == '__main__':
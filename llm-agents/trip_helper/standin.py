@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+from datetime import datetime
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+from loguru import logger
+
+from trip_helper.router import GTFSRouter, RouterJourney, RouterLeg
+
+
+SOLARI_PATH = "/v1/plan"
+OTP_PATH = "/otp/transmodel/v3"
+
+
+def _request_key(path: str, body: dict) -> str:
+    # GraphQL: only the variables matter, the query text may change without changing the answer
+    if "variables" in body:
+        body = {"operationName": body.get("operationName"), "variables": body["variables"]}
+    payload = json.dumps([path, body], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _iso(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp).astimezone().isoformat()
+
+
+def _entity_id(entity_id: str) -> str:
+    # OTP prefixes GTFS ids with the feed id, OTPTripHelper.parse_gtfs_entity_id strips it when the id has 2+ colons
+    return f"1:{entity_id}" if ":" in entity_id else entity_id
+
+
+class RoutingStandIn:
+    """
+    Local stand-in for the Solari and OTP routing services, for load tests and benchmarks.
+
+    Speaks the Solari `/v1/plan` JSON and the subset of the OTP Transmodel `trip` query read by OTPTripHelper.
+    - router: answers from the in-process GTFSRouter.
+    - replay: answers from the recorded responses, falling back to the router when given one.
+    - record: forwards to the real services and records their responses.
+    Each answer is delayed by a gaussian latency (milliseconds).
+    """
+
+    def __init__(self,
+                 mode: str = "router",
+                 router: Optional[GTFSRouter] = None,
+                 records_file: Optional[str] = None,
+                 solari_upstream: Optional[str] = None,
+                 otp_upstream: Optional[str] = None,
+                 latency_ms: float = 0,
+                 latency_jitter_ms: float = 0,
+                 seed: int = 0):
+        assert mode in ("router", "replay", "record"), f"Unsupported mode: {mode}"
+        assert mode != "router" or router is not None, "The router mode needs a GTFSRouter"
+        assert mode != "record" or records_file, "The record mode needs a records file"
+        assert mode != "record" or solari_upstream or otp_upstream, "The record mode needs a Solari or OTP upstream"
+        self.mode = mode
+        self.router = router
+        self.records_file = records_file
+        self.upstreams = {SOLARI_PATH: solari_upstream, OTP_PATH: otp_upstream}
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self._rnd = random.Random(seed)
+        self.records: dict[str, dict] = {}
+        self.metrics = {"requests": 0, "replayed": 0, "routed": 0, "recorded": 0, "missed": 0}
+
+        if self.mode == "replay" and records_file and os.path.exists(records_file):
+            with open(records_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record["key"]] = record["response"]
+            logger.info(f"[RoutingStandIn]: Loaded {len(self.records)} recorded responses from {records_file}")
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(SOLARI_PATH, self.handle_solari)
+        app.router.add_post(OTP_PATH, self.handle_otp)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    async def _sleep_latency(self):
+        if self.latency_ms > 0 or self.latency_jitter_ms > 0:
+            await asyncio.sleep(max(0.0, self._rnd.gauss(self.latency_ms, self.latency_jitter_ms)) / 1000)
+
+    async def _answer(self, path: str, body: dict, route) -> dict:
+        self.metrics["requests"] += 1
+        await self._sleep_latency()
+        key = _request_key(path, body)
+
+        if self.mode == "record":
+            upstream = self.upstreams[path]
+            if upstream is None:
+                self.metrics["missed"] += 1
+                raise web.HTTPNotFound(text=f"No upstream to record {path} from")
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(upstream, json=body, timeout=30) as response:
+                        response.raise_for_status()
+                        data = await response.json()
+            except aiohttp.ClientError as e:
+                raise web.HTTPBadGateway(text=f"Upstream {upstream} failed: {e}")
+            with open(self.records_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "response": data}, ensure_ascii=False) + "\n")
+            self.metrics["recorded"] += 1
+            return data
+
+        if key in self.records:
+            self.metrics["replayed"] += 1
+            return self.records[key]
+        if self.router is None:
+            self.metrics["missed"] += 1
+            raise web.HTTPNotFound(text=f"No recorded response for request {key}")
+
+        self.metrics["routed"] += 1
+        return route(body)
+
+    async def handle_solari(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        return web.json_response(await self._answer(SOLARI_PATH, body, self.route_solari))
+
+    async def handle_otp(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        return web.json_response(await self._answer(OTP_PATH, body, self.route_otp))
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.metrics)
+
+    def _stop_name(self, stop: Optional[int]) -> str:
+        return self.router.stop_names[stop] if stop is not None else ""
+
+    def _stop_lonlat(self, stop: Optional[int], default: tuple[float, float]) -> tuple[float, float]:
+        if stop is None:
+            return default
+        return float(self.router.stop_lons[stop]), float(self.router.stop_lats[stop])
+
+    """ Solari
+    """
+    def route_solari(self, body: dict) -> dict:
+        origin, destination = body["from"], body["to"]
+        journeys = self.router.route_range(
+            origin["lon"], origin["lat"], destination["lon"], destination["lat"],
+            departure_time=int(body["start_at"]) // 1000,
+            max_transfers=body.get("max_transfers", 5),
+            search_window=0,
+        )
+        return {
+            "status": "ok",
+            "itineraries": [self._solari_itinerary(j, origin, destination) for j in journeys],
+        }
+
+    def _solari_itinerary(self, journey: RouterJourney, origin: dict, destination: dict) -> dict:
+        origin_lonlat = (origin["lon"], origin["lat"])
+        destination_lonlat = (destination["lon"], destination["lat"])
+
+        def _location(stop: Optional[int], default: tuple[float, float]) -> dict:
+            lon, lat = self._stop_lonlat(stop, default)
+            return {"stop": self._stop_name(stop), "lon": lon, "lat": lat}
+
+        legs = []
+        for leg in journey.legs:
+            item = {
+                "start_time": leg.start_time * 1000,
+                "end_time": leg.end_time * 1000,
+                "start_location": _location(leg.from_stop, origin_lonlat),
+                "end_location": _location(leg.to_stop, destination_lonlat),
+                "duration": leg.end_time - leg.start_time,
+                "distance": leg.distance,
+                "mode": leg.mode,
+            }
+            if leg.mode == "foot":
+                legs.append({"transfer": item})
+            else:
+                item["transit_route"] = self.router.gtfs_data.get_route_short_name_by_id(leg.route_id)
+                legs.append({"transit": item})
+
+        return {
+            "start_location": {"lon": origin["lon"], "lat": origin["lat"]},
+            "end_location": {"lon": destination["lon"], "lat": destination["lat"]},
+            "start_time": journey.start_time * 1000,
+            "end_time": journey.end_time * 1000,
+            "legs": legs,
+        }
+
+    """ OTP Transmodel
+    """
+    def route_otp(self, body: dict) -> dict:
+        variables = body.get("variables", {})
+        origin = variables["from"]["coordinates"]
+        destination = variables["to"]["coordinates"]
+        departure_time = int(datetime.fromisoformat(variables["dateTime"]).timestamp())
+        journeys = self.router.route_range(
+            origin["longitude"], origin["latitude"], destination["longitude"], destination["latitude"],
+            departure_time=departure_time,
+            search_window=int(variables.get("searchWindow") or 0) * 60,
+            max_transfers=variables.get("maximumTransfers") or 5,
+            max_journeys=variables.get("numTripPatterns") or 20,
+        )
+        return {
+            "data": {
+                "trip": {
+                    "previousPageCursor": None,
+                    "nextPageCursor": None,
+                    "tripPatterns": [self._otp_trip_pattern(j) for j in journeys],
+                }
+            }
+        }
+
+    def _otp_place(self, stop: Optional[int], default_name: str) -> dict:
+        if stop is None:
+            return {"name": default_name, "quay": None}
+        return {"name": self._stop_name(stop), "quay": {"id": _entity_id(self.router.stop_ids[stop])}}
+
+    def _otp_leg(self, leg: RouterLeg) -> dict:
+        line = None
+        if leg.route_id is not None:
+            gtfs_data = self.router.gtfs_data
+            line = {
+                "publicCode": gtfs_data.get_route_short_name_by_id(leg.route_id),
+                "name": gtfs_data.get_route_long_name_by_id(leg.route_id),
+                "id": _entity_id(leg.route_id),
+                "presentation": None,
+            }
+        return {
+            "id": None,
+            "mode": leg.mode,
+            "aimedStartTime": _iso(leg.start_time),
+            "aimedEndTime": _iso(leg.end_time),
+            "expectedStartTime": _iso(leg.start_time),
+            "expectedEndTime": _iso(leg.end_time),
+            "realtime": False,
+            "distance": leg.distance,
+            "duration": leg.end_time - leg.start_time,
+            "fromPlace": self._otp_place(leg.from_stop, "Origin"),
+            "toPlace": self._otp_place(leg.to_stop, "Destination"),
+            "toEstimatedCall": None,
+            "line": line,
+            "authority": None,
+            "pointsOnLink": None,
+            "interchangeTo": None,
+            "interchangeFrom": None,
+        }
+
+    def _otp_trip_pattern(self, journey: RouterJourney) -> dict:
+        return {
+            "aimedStartTime": _iso(journey.start_time),
+            "aimedEndTime": _iso(journey.end_time),
+            "expectedStartTime": _iso(journey.start_time),
+            "expectedEndTime": _iso(journey.end_time),
+            "duration": journey.end_time - journey.start_time,
+            "distance": sum(leg.distance for leg in journey.legs),
+            "legs": [self._otp_leg(leg) for leg in journey.legs],
+            "systemNotices": [],
+        }
@@ -0,0 +1,134 @@
+import bisect
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from loguru import logger
+from settings import settings
+
+
+# Upper bounds (ms) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, latency_ms: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self.total += 1
+        self.sum_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def get_summary(self) -> dict:
+        return {
+            "count": self.total,
+            "avg_ms": self.sum_ms / self.total if self.total else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": self.max_ms,
+            "buckets": {
+                **{f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)},
+                "inf": self.counts[-1],
+            },
+        }
+
+
+class RoutingStats:
+    """
+    Latency histograms and counters of the routing calls, per trip helper (otp, solari, raptor, cache).
+
+    Counters: calls, errors, retries (tenacity), parse failures, empty results, and for the cache the
+    upstream queries (with the blacklisted pairs queried again), the answers served from the cache and the
+    empty answers given without a query.
+    `upstream_calls_per_decision` relates the calls made to the routing services to the routing
+    decisions of the scenario. A summary is logged every `routing_stats_log_interval` seconds.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(log_interval=settings.gtfs.routing_stats_log_interval)
+        return cls._instance
+
+    def __init__(self, log_interval: int = 60):
+        self.log_interval = log_interval
+        self.latencies: dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.counters: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.decisions = 0
+        self._last_log_at = time.monotonic()
+
+    def count(self, helper: str, name: str, value: int = 1):
+        self.counters[helper][name] += value
+        self._maybe_log()
+
+    def observe_latency(self, helper: str, latency_ms: float):
+        self.latencies[helper].observe(latency_ms)
+        self._maybe_log()
+
+    @contextmanager
+    def timer(self, helper: str, upstream: bool = True):
+        """Time a routing call; `upstream` calls reach a routing service (or router) rather than a cache"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.counters[helper]["errors"] += 1
+            raise
+        finally:
+            self.counters[helper]["calls"] += 1
+            if upstream:
+                self.counters[helper]["upstream_calls"] += 1
+            self.observe_latency(helper, (time.perf_counter() - start) * 1000)
+
+    def record_decisions(self, n: int = 1):
+        self.decisions += n
+
+    def _maybe_log(self):
+        if self.log_interval and time.monotonic() - self._last_log_at >= self.log_interval:
+            self._last_log_at = time.monotonic()
+            logger.info(f"Routing stats: {self.get_brief_summary()}")
+
+    def get_brief_summary(self) -> dict:
+        summary = {
+            helper: {
+                "calls": histogram.total,
+                "avg_ms": round(histogram.sum_ms / histogram.total, 2) if histogram.total else 0.0,
+                "p95_ms": histogram.quantile(0.95),
+            }
+            for helper, histogram in self.latencies.items()
+        }
+        for helper, counters in self.counters.items():
+            summary.setdefault(helper, {}).update({k: v for k, v in counters.items() if k not in ("calls", "upstream_calls")})
+        summary["upstream_calls_per_decision"] = self.upstream_calls_per_decision()
+        return summary
+
+    def upstream_calls_per_decision(self) -> float:
+        upstream_calls = sum(counters.get("upstream_calls", 0) for counters in self.counters.values())
+        return upstream_calls / self.decisions if self.decisions else 0.0
+
+    def get_summary(self) -> dict:
+        return {
+            "decisions": self.decisions,
+            "upstream_calls_per_decision": self.upstream_calls_per_decision(),
+            "latency": {helper: histogram.get_summary() for helper, histogram in self.latencies.items()},
+            "counters": {helper: dict(counters) for helper, counters in self.counters.items()},
+        }
@@ -24,6 +24,12 @@ def world_projection(location: Location) -> tuple[float, float]:
     """
     return transformer.transform(location.lon, location.lat)
 
+def world_projection_many(lons, lats) -> tuple:
+    """
+    Project arrays of points from WGS84 to Web Mercator
+    """
+    return transformer.transform(lons, lats)
+
 def square_distance(p1: Location, p2: Location) -> float:
     """
     Calculate the square distance between two points
@@ -1,2 +1,4 @@
 from world.population import *
+from world.population_store import *
+from world.population_state import *
 from world.world_data import *
@@ -1,54 +1,213 @@
+import bisect
+import hashlib
+import heapq
 import json
+import math
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Mapping, Optional
 from models import Activity, BBox, Location, Person, PersonId
 from settings import settings
 from inputs.population import PopulationLoader
 from errors import PersonNotFoundException
 from helper import to_24h_timestamp_full
 from loguru import logger
+from world.population_store import PopulationStore
+from world.population_state import PopulationStateJournal
 import random
 
 
+class DepartureQueue:
+    """
+    Min-heap of the time each idle person has to be looked at again, so a tick only touches the people who are due.
+    Entries are invalidated lazily: an entry is live only while it matches the person's current wake time.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[int, PersonId]] = []
+        self._wake_at: Dict[PersonId, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._wake_at)
+
+    def schedule(self, person_id: PersonId, wake_at: int):
+        if self._wake_at.get(person_id) == wake_at:
+            return
+        self._wake_at[person_id] = wake_at
+        heapq.heappush(self._heap, (wake_at, person_id))
+
+    def wake_now(self, person_id: PersonId):
+        """Due at the next tick, whatever its time"""
+        self.schedule(person_id, -1)
+
+    def remove(self, person_id: PersonId):
+        self._wake_at.pop(person_id, None)
+
+    def get_checkpoint_state(self) -> Dict[PersonId, int]:
+        return dict(self._wake_at)
+
+    def set_checkpoint_state(self, wake_at: Dict[PersonId, int]):
+        self._wake_at = dict(wake_at)
+        self._heap = [(t, person_id) for person_id, t in self._wake_at.items()]
+        heapq.heapify(self._heap)
+
+    def pop_due(self, timestamp: int) -> List[PersonId]:
+        due = []
+        while self._heap and self._heap[0][0] <= timestamp:
+            wake_at, person_id = heapq.heappop(self._heap)
+            if self._wake_at.get(person_id) == wake_at:
+                del self._wake_at[person_id]
+                due.append(person_id)
+        return due
+
+
+class ActivityTimetable:
+    """
+    Lookup arrays over the activities of a person: id -> index, and the sorted scheduled start times (starts)
+    and window ends (start time of the following activity) of the selectable activities, so that
+    PersonScheduler.next_activity is two bisections instead of a loop.
+
+    When the activities cross midnight or are not sorted, `bisectable` is False and next_activity keeps
+    its linear scan. The timetable is rebuilt when marked stale (reschedule_activity).
+    """
+
+    def __init__(self, activities: List[Activity], pre_schedule_duration: int):
+        self.activities = activities
+        self.pre_schedule_duration = pre_schedule_duration
+        self.rebuild()
+
+    def rebuild(self):
+        day24h_seconds = 24 * 60 * 60
+        activities = self.activities
+        self.index_by_id = {activity.id: i for i, activity in enumerate(activities)}
+        self.indexes: list[int] = []
+        self.starts: list[float] = []
+        self.ends: list[float] = []
+        self.bisectable = True
+
+        for i, activity in enumerate(activities):
+            if activity.start_time < 0:
+                continue
+            # same lazy initialisation as next_activity
+            if activity.scheduled_start_time is None or activity.scheduled_start_time == -1:
+                activity.scheduled_start_time = activity.start_time - self.pre_schedule_duration
+            next_end_time = activities[i + 1].start_time if i + 1 < len(activities) else None
+            if activity.scheduled_start_time > day24h_seconds or (next_end_time or -1) > day24h_seconds:
+                # next_activity shifts the time of day past midnight, keep the linear scan
+                self.bisectable = False
+            if activity.scheduled_start_time <= 0:
+                continue  # never selected
+            self.indexes.append(i)
+            self.starts.append(activity.scheduled_start_time)
+            self.ends.append(math.inf if next_end_time is None or next_end_time == -1 else next_end_time)
+
+        if any(a > b for a, b in zip(self.starts, self.starts[1:])) or any(a > b for a, b in zip(self.ends, self.ends[1:])):
+            self.bisectable = False
+        self.stale = False
+
+    def select(self, time24h: int) -> Optional[int]:
+        """Index of the first activity with start <= time24h <= end"""
+        # starts and ends are sorted: the candidates with start <= t form a prefix,
+        # those with t <= end a suffix, and the first of the suffix is the answer when it is in the prefix
+        first_open = bisect.bisect_left(self.ends, time24h)
+        if first_open < bisect.bisect_right(self.starts, time24h):
+            return self.indexes[first_open]
+        return None
+
+
 class PersonScheduler:
     DEFAULT_PRE_SCHEDULE_DURATION = 0
 
-    def __init__(self, person: Person):
+    def __init__(self,
+                 person: Person,
+                 departure_queue: Optional[DepartureQueue] = None,
+                 timetable: Optional[ActivityTimetable] = None,
+                 store: Optional[PopulationStore] = None):
         self.person = person
+        self.departure_queue = departure_queue
+        self._timetable = timetable
+        self.store = store
+
+    @classmethod
+    def default_pre_schedule_duration(cls) -> int:
+        return max(settings.agent.pre_schedule_duration, cls.DEFAULT_PRE_SCHEDULE_DURATION)
+
+    @property
+    def timetable(self) -> ActivityTimetable:
+        if self._timetable is None:
+            self._timetable = ActivityTimetable(self.person.identity.activities, self.default_pre_schedule_duration())
+        elif self._timetable.stale:
+            self._timetable.rebuild()
+        return self._timetable
+
+    def index_of(self, activity: Activity) -> int:
+        index = self.timetable.index_by_id.get(activity.id)
+        if index is None:
+            return self.person.identity.activities.index(activity)
+        return index
 
     def start_on_activity(self, activity: Activity):
         state = self.person.state
         state.heading_to = activity.purpose
-        state.last_activity_index = self.person.identity.activities.index(activity)
+        state.last_activity_index = self.index_of(activity)
         state.cache_current_activity = activity
+        if self.departure_queue is not None:
+            self.departure_queue.remove(self.person.person_id)
+        if self.store is not None:
+            self.store.write_back(self.person)
 
     def get_activity(self, activity_id: str) -> Optional[Activity]:
-        return next((activity for activity in self.person.identity.activities if activity.id == activity_id), None)
+        index = self.timetable.index_by_id.get(activity_id)
+        return self.person.identity.activities[index] if index is not None else None
 
     def finish_activity(self):
         state = self.person.state
         state.cache_current_activity = None
         state.heading_to = None
+        if self.departure_queue is not None:
+            self.departure_queue.wake_now(self.person.person_id)
+        if self.store is not None:
+            # idle again, the view of a rule-based person is not needed anymore
+            self.store.write_back(self.person, release=True)
 
     def reschedule_activity(self, activity: Activity, delta: int):
         logger.debug(f"Adjusting activity <{activity.purpose}> of person {self.person.person_id} scheduled start time based on arrival duration: {delta}")
         # _new_time = max(0, activity.scheduled_start_time - delta)
         # _new_time = min(_new_time, 24*3600)
         activities = self.person.identity.activities
-        prev_idx = activities.index(activity) - 1
+        prev_idx = self.index_of(activity) - 1
         next_idx = prev_idx + 2
         min_time = activities[prev_idx].scheduled_start_time + 1 if prev_idx > 0 else 4.5*3600 # public transport start from 4h30
         max_time = activities[next_idx].scheduled_start_time - 1 if next_idx < len(activities) else 24*3600 - 30*60
         _new_time = max(min_time, activity.scheduled_start_time - delta)
         _new_time = min(_new_time, max_time)
         activity.scheduled_start_time = _new_time
+        if self._timetable is not None:
+            self._timetable.stale = True
+        if self.departure_queue is not None:
+            self.departure_queue.wake_now(self.person.person_id)
+        if self.store is not None:
+            self.store.write_back(self.person)
 
     def next_activity(self, 
                       timestamp: int, 
                       pre_schedule_duration: Optional[int] = None
             ) -> Optional[Activity]:
+        timetable = self.timetable
+        if not timetable.bisectable or (pre_schedule_duration is not None and pre_schedule_duration != timetable.pre_schedule_duration):
+            return self.next_activity_linear(timestamp, pre_schedule_duration)
+
+        selected_index = timetable.select(timestamp % (24 * 60 * 60))
+        # validate activity is done
+        if selected_index is None or selected_index == self.person.state.last_activity_index:
+            return None
+        return self.person.identity.activities[selected_index]
+
+    def next_activity_linear(self,
+                             timestamp: int,
+                             pre_schedule_duration: Optional[int] = None
+            ) -> Optional[Activity]:
         if pre_schedule_duration is None:
-            pre_schedule_duration = max(settings.agent.pre_schedule_duration, self.DEFAULT_PRE_SCHEDULE_DURATION)
+            pre_schedule_duration = self.default_pre_schedule_duration()
 
         state = self.person.state
         day_of_week, time24h = to_24h_timestamp_full(timestamp)
@@ -82,12 +241,48 @@ class PersonScheduler:
 
         # validate activity is done
         if selected_activity:
-            selected_index = self.person.identity.activities.index(selected_activity)
+            selected_index = self.index_of(selected_activity)
             if selected_index == state.last_activity_index:
                 return None
         
         return selected_activity
     
+    def next_wake_time(self,
+                       timestamp: int,
+                       pre_schedule_duration: Optional[int] = None) -> int:
+        """
+        Earliest time after `timestamp` at which `next_activity` may stop returning None.
+
+        next_activity only compares the time of day with the scheduled start times (start <= t)
+        and with the start times of the following activities (t <= end), so its result can only
+        change at one of these times of day, or at midnight.
+        """
+        if pre_schedule_duration is None:
+            pre_schedule_duration = self.default_pre_schedule_duration()
+
+        day24h_seconds = 24 * 60 * 60
+        boundaries = {0}
+        for activity in self.person.identity.activities:
+            # end of the window of the previous activity
+            boundaries.add((math.floor(activity.start_time) + 1) % day24h_seconds)
+            if activity.start_time < 0:
+                continue
+            scheduled_start_time = activity.scheduled_start_time
+            if scheduled_start_time is None or scheduled_start_time == -1:
+                scheduled_start_time = activity.start_time - pre_schedule_duration
+            boundaries.add(math.ceil(scheduled_start_time) % day24h_seconds)
+
+        time24h = timestamp % day24h_seconds
+        delay = min((boundary - time24h) % day24h_seconds or day24h_seconds for boundary in boundaries)
+        return timestamp + delay
+
+    def defer(self, timestamp: int):
+        """Wait in the departure queue until next_wake_time"""
+        if self.departure_queue is not None:
+            self.departure_queue.schedule(self.person.person_id, self.next_wake_time(timestamp))
+        if self.store is not None:
+            self.store.write_back(self.person, release=True)
+
     def get_home_location(self) -> Optional[Location]:
         if self.person.identity.home:
             return self.person.identity.home
@@ -96,61 +291,113 @@ class PersonScheduler:
 class WorldPopulation:
     def __init__(self, population_loader: PopulationLoader):
         self.population_loader = population_loader
-        self.people: Dict[PersonId, Person] = {}
+        self.store = PopulationStore([])
+        self.departure_queue = DepartureQueue()
+        self.state_journal = PopulationStateJournal(
+            snapshot_file=settings.data.state_snapshot_file,
+            journal_file=settings.data.state_journal_file,
+            compact_every=settings.data.state_compact_every,
+        )
+
+    @property
+    def people(self) -> Mapping[PersonId, Person]:
+        """person_id -> Person, the views are materialised on access"""
+        return self.store.views
+
+    @people.setter
+    def people(self, people: Dict[PersonId, Person]):
+        self.store = PopulationStore(people.values())
 
     def init(self, world_bbox: BBox) -> "WorldPopulation":
         self.load_population(world_bbox)
         self.load_population_state()
         if settings.data.debug_people_ids:
             logger.info(f"Debugging with people: {settings.data.debug_people_ids}")
-            self.people = {
-                person_id: person
-                for person_id, person in self.people.items()
-                if person_id in settings.data.debug_people_ids
-            }
+            self.store = self.store.subset(settings.data.debug_people_ids)
+        logger.info(f"Population store: {len(self.store)} people, {len(self.store.act_ids)} activities, "
+                    f"{self.store.nbytes() / 2**20:.1f} MiB of columns, {self.store.n_views} views")
+        # everybody is looked at on the first tick
+        for row in self.store.rows(idle=True):
+            self.departure_queue.wake_now(self.store.person_ids[row])
         return self
+
+    def get_checkpoint_state(self) -> dict:
+        return {
+            "store": self.store.get_checkpoint_state(),
+            "departure_queue": self.departure_queue.get_checkpoint_state(),
+        }
+
+    def set_checkpoint_state(self, state: dict):
+        self.store.set_checkpoint_state(state["store"])
+        self.departure_queue.set_checkpoint_state({
+            person_id: wake_at
+            for person_id, wake_at in state["departure_queue"].items()
+            if person_id in self.store
+        })
+
+    def start_from_home(self):
+        """Everybody starts the simulation at home"""
+        self.store.start_from_home()
     
     def dump_population_state(self):
-        file_path = settings.data.state_file
-        d = [
-            {"person_id": p.person_id, "activity_id": act.id, "scheduled_start_time": act.scheduled_start_time}
-            for p in self.get_people_list()
-            for act in p.identity.activities
-        ]
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(d, f, ensure_ascii=False, indent=4)
+        """Journal the scheduled start times changed since the last call, compacting the journal when due"""
+        store = self.store
+        self.state_journal.append([
+            (store.act_ids[i], store.scheduled_start_time(i))
+            for i in store.pop_dirty_activities()
+        ])
+        if self.state_journal.should_compact():
+            self.state_journal.compact(store.act_ids, store.act_scheduled)
 
     def load_population_state(self):
+        m = {}
         file_path = settings.data.state_file
-        if not os.path.isfile(file_path):
+        if os.path.isfile(file_path):
+            # legacy full dump, superseded by the snapshot and the journal
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                for item in data:
+                    m[item.get("activity_id")] = item.get("scheduled_start_time")
+        m.update(self.state_journal.load())
+        if not m:
             return
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            m = {}
-            for item in data:
-                activity_id = item.get("activity_id")
-                scheduled_start_time = item.get("scheduled_start_time")
-                m[activity_id] = (scheduled_start_time, )
-
-        for p in self.get_people_list():
-            for act in p.identity.activities:
-                if act.id in m:
-                    (scheduled_start_time, ) = m[act.id]
-                    act.scheduled_start_time = scheduled_start_time
-                    logger.debug(f"Loaded activity {act.id} of person {p.person_id} with scheduled_start_time {scheduled_start_time}")
+
+        updated = self.store.set_scheduled_start_times(m)
+        logger.debug(f"Loaded the scheduled_start_time of {updated} activities")
+
+    def population_source_hash(self, world_bbox: BBox) -> str:
+        return hashlib.sha1(json.dumps({
+            "loader": self.population_loader.source_fingerprint(),
+            "max_size": settings.data.population_max_size,
+            "number_of_llm_based_agents": settings.data.number_of_llm_based_agents,
+            "bbox": world_bbox.model_dump(),
+        }, sort_keys=True).encode("utf-8")).hexdigest()
 
     def load_population(self, world_bbox: BBox):
-        file_name = f"{settings.data.population_cache_prefix}{settings.data.population_max_size}_{settings.data.number_of_llm_based_agents}.json"
-        if os.path.exists(file_name):
-            logger.info(f"Loading population from {file_name}")
-            with open(file_name, "r", encoding="utf-8") as f:
+        file_prefix = f"{settings.data.population_cache_prefix}{settings.data.population_max_size}_{settings.data.number_of_llm_based_agents}"
+        cache_file = f"{file_prefix}.npz"
+        source_hash = self.population_source_hash(world_bbox)
+        legacy_file = f"{file_prefix}.json"
+        if os.path.exists(cache_file):
+            logger.info(f"Loading population from {cache_file}")
+            store = PopulationStore.load(cache_file, source_hash=source_hash)
+            if store is not None:
+                self.store = store
+                return
+            # outdated cache (source data, filters or bbox changed): regenerate
+        elif os.path.exists(legacy_file):
+            # population cached before the npz format, converted once then set aside:
+            # it has no source hash, so it must not be used again once the npz is outdated
+            logger.info(f"Loading population from {legacy_file}")
+            with open(legacy_file, "r", encoding="utf-8") as f:
                 people = json.load(f)
-                self.people = {
-                    person["person_id"]: Person.model_validate(person)
-                    for person in people
-                }
+                self.store = PopulationStore(Person.model_validate(person) for person in people)
+            self.store.save(cache_file, source_hash=source_hash)
+            os.replace(legacy_file, f"{legacy_file}.converted")
+            logger.info(f"Population converted to {cache_file}, {legacy_file} renamed to {legacy_file}.converted")
             return
-        
+
+
         people = self.population_loader.load_population(
             max_size=settings.data.population_max_size,
             bbox=world_bbox,
@@ -158,38 +405,54 @@ class WorldPopulation:
 
         n_llm_based = settings.data.number_of_llm_based_agents
         if n_llm_based > 0:
-            llm_based_persons = random.sample(
+            llm_based_persons = random.Random(settings.data.population_seed).sample(
                 list(people),
                 n_llm_based,
             )
             for person in llm_based_persons:
                 person.is_llm_based = True
 
-        self.people = {person.person_id: person for person in people}
+        self.store = PopulationStore(people)
         # cache to the file
-        with open(file_name, "w", encoding="utf-8") as f:
-            json.dump([
-                person.model_dump() for person in self.people.values()
-            ], f, ensure_ascii=False, indent=4)
+        self.store.save(cache_file, source_hash=source_hash)
+        logger.info(f"Population cached to {cache_file}")
 
     def get_people_list(self) -> List[Person]:
-        return list(self.people.values())
+        """
+        Everybody, the people without a view get transient ones: read them,
+        and change the state of a person through get_person and its scheduler
+        """
+        return self.store.people(range(len(self.store)), cache=False)
     
+    def get_idle_people(self) -> List[Person]:
+        # transient views, the schedulers write their changes through to the store
+        return self.store.people(self.store.rows(idle=True), cache=False)
+
+    def get_due_people(self, timestamp: int) -> List[Person]:
+        """Idle people whose next departure may be due at `timestamp`"""
+        due = [person_id for person_id in self.departure_queue.pop_due(timestamp) if self.store.is_idle(person_id)]
+        return [self.store.get(person_id) for person_id in due]
+
     def get_llm_based_people_list(self) -> List[Person]:
-        return [
-            person for person in self.people.values() 
-            if person.is_llm_based
-        ]
+        return self.store.people(self.store.rows(llm_based=True))
     
     def get_person(self, person_id: PersonId) -> Person:
-        return self.people.get(person_id)
+        return self.store.get(person_id)
     
     def get_person_home_location(self, person_id: PersonId) -> Location:
-        person = self.get_person(person_id)
-        if person is None:
+        if person_id not in self.store:
             raise PersonNotFoundException(f"Person {person_id} not found")
-        return PersonScheduler(person).get_home_location()
+        return self.store.home_location(person_id)
     
-    @classmethod
-    def get_person_default_scheduler(cls, person: Person) -> PersonScheduler:
-        return PersonScheduler(person)
+    def get_person_default_scheduler(self, person: Person) -> PersonScheduler:
+        timetables = self.store.timetables
+        timetable = timetables.get(person.person_id)
+        if timetable is None or timetable.activities is not person.identity.activities:
+            timetable = ActivityTimetable(
+                person.identity.activities,
+                PersonScheduler.default_pre_schedule_duration(),
+            )
+            if self.store.is_view(person):
+                # transient views are not cached, neither are their timetables
+                timetables[person.person_id] = timetable
+        return PersonScheduler(person, departure_queue=self.departure_queue, timetable=timetable, store=self.store)
@@ -0,0 +1,85 @@
+import json
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+class PopulationStateJournal:
+    """
+    Persistence of the scheduled start times of the activities: a binary snapshot (activity ids and times)
+    plus an append-only journal of the changes made since, one JSON line per change.
+
+    Appends only write the changes; once the journal holds `compact_every` entries it is folded into a new
+    snapshot and truncated. The journal entries are absolute values, so replaying them on top of a newer
+    snapshot (crash between the two steps of a compaction) is harmless.
+    """
+
+    def __init__(self, snapshot_file: str, journal_file: str, compact_every: int = 10000):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.journal_size = 0
+
+    def load(self) -> Dict[str, Optional[float]]:
+        """Scheduled start times by activity id: the snapshot, then the journal replayed over it"""
+        state: Dict[str, Optional[float]] = {}
+        if os.path.isfile(self.snapshot_file):
+            with np.load(self.snapshot_file, allow_pickle=False) as data:
+                times = data["scheduled_start_times"]
+                state.update(zip(
+                    data["activity_ids"].tolist(),
+                    [None if math.isnan(t) else t for t in times.tolist()],
+                ))
+            logger.info(f"Loaded {len(state)} scheduled start times from {self.snapshot_file}")
+
+        self.journal_size = 0
+        if os.path.isfile(self.journal_file):
+            with open(self.journal_file, "rb+") as f:
+                valid_size = 0
+                for line in f:
+                    # a torn last line of an interrupted append may parse without its newline,
+                    # the next append would then continue it: cut it so the next appends stay readable
+                    try:
+                        item = json.loads(line) if line.endswith(b"\n") else None
+                    except json.JSONDecodeError:
+                        item = None
+                    if item is None:
+                        logger.warning(f"Truncating the torn end of {self.journal_file}")
+                        f.truncate(valid_size)
+                        break
+                    state[item["activity_id"]] = item["scheduled_start_time"]
+                    valid_size += len(line)
+                    self.journal_size += 1
+            logger.info(f"Replayed {self.journal_size} changes from {self.journal_file}")
+        return state
+
+    def append(self, changes: List[Tuple[str, Optional[float]]]):
+        if not changes:
+            return
+        lines = "".join(
+            json.dumps({"activity_id": activity_id, "scheduled_start_time": scheduled_start_time}) + "\n"
+            for activity_id, scheduled_start_time in changes
+        )
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(lines)
+        self.journal_size += len(changes)
+
+    def should_compact(self) -> bool:
+        return self.journal_size >= self.compact_every
+
+    def compact(self, activity_ids: Iterable[str], scheduled_start_times: np.ndarray):
+        """Write the full state as the new snapshot and truncate the journal"""
+        tmp_file = f"{self.snapshot_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(
+                f,
+                activity_ids=np.array(list(activity_ids), dtype=str),
+                scheduled_start_times=np.asarray(scheduled_start_times, dtype=np.float64),
+            )
+        os.replace(tmp_file, self.snapshot_file)
+        open(self.journal_file, "w").close()
+        logger.info(f"Compacted {self.journal_size} journal entries into {self.snapshot_file}")
+        self.journal_size = 0
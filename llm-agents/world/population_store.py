@@ -0,0 +1,411 @@
+import json
+import math
+import os
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from loguru import logger
+from models import Activity, Location, Person, PersonalIdentity, PersonId, PersonState
+
+
+NO_CODE = -1  # None in the integer columns
+# bump when the columns saved by PopulationStore.save change
+POPULATION_CACHE_VERSION = 1
+
+
+class PurposeCodes:
+    """Activity purposes <-> int16 codes of the purpose columns"""
+
+    def __init__(self):
+        self.purposes: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, purpose: Optional[str]) -> int:
+        if purpose is None:
+            return NO_CODE
+        code = self._codes.get(purpose)
+        if code is None:
+            code = self._codes[purpose] = len(self.purposes)
+            self.purposes.append(purpose)
+        return code
+
+    def decode(self, code: int) -> Optional[str]:
+        return None if code < 0 else self.purposes[code]
+
+    def code_of(self, purpose: str) -> int:
+        return self._codes.get(purpose, NO_CODE)
+
+
+def _coordinates(locations: List[Optional[Location]]) -> tuple[np.ndarray, np.ndarray]:
+    """lon, lat columns, NaN for a missing location"""
+    lon = np.fromiter((math.nan if loc is None else loc.lon for loc in locations), dtype=np.float64, count=len(locations))
+    lat = np.fromiter((math.nan if loc is None else loc.lat for loc in locations), dtype=np.float64, count=len(locations))
+    return lon, lat
+
+
+def _location(lon: float, lat: float) -> Optional[Location]:
+    if math.isnan(lon):
+        return None
+    return Location.model_construct(lon=float(lon), lat=float(lat))
+
+
+class PersonViews(Mapping):
+    """Read-only person_id -> Person mapping over a PopulationStore, materialising the views on access"""
+
+    def __init__(self, store: "PopulationStore"):
+        self.store = store
+
+    def __getitem__(self, person_id: PersonId) -> Person:
+        person = self.store.get(person_id)
+        if person is None:
+            raise KeyError(person_id)
+        return person
+
+    def __contains__(self, person_id) -> bool:
+        return person_id in self.store.row_by_id
+
+    def __iter__(self) -> Iterator[PersonId]:
+        return iter(self.store.person_ids)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+
+class PopulationStore:
+    """
+    Columnar store of the population: one row per person in NumPy arrays (home, state flags, last location)
+    and the activities of all people in flat arrays, row r owning act_offsets[r]:act_offsets[r+1].
+
+    Pydantic `Person` views are built on demand. The views of the LLM-based people are kept; the others
+    live while the person is on the move and are released once written back (`write_back(release=True)`).
+    The columns are the source of truth of the people without a view: PersonScheduler writes every state
+    change through `write_back`, and `sync_views` flushes the views before reading the state columns in bulk.
+    """
+
+    def __init__(self, people: Iterable[Person]):
+        people = list(people)
+        n = len(people)
+        self.purposes = PurposeCodes()
+
+        self.person_ids: List[PersonId] = [person.person_id for person in people]
+        self.row_by_id: Dict[PersonId, int] = {person_id: row for row, person_id in enumerate(self.person_ids)}
+
+        # identity, the traits of a store loaded from a cache file stay JSON strings until materialised
+        self.names: List[str] = [person.identity.name for person in people]
+        self.traits: List[dict | str] = [person.identity.traits_json for person in people]
+        self.home_lon, self.home_lat = _coordinates([person.identity.home for person in people])
+        self.is_llm_based = np.fromiter((person.is_llm_based for person in people), dtype=bool, count=n)
+
+        # activities
+        person_activities = [person.identity.activities or [] for person in people]
+        self.act_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(activities) for activities in person_activities], out=self.act_offsets[1:])
+        activities = [activity for acts in person_activities for activity in acts]
+        m = len(activities)
+        self.act_ids: List[str] = [activity.id for activity in activities]
+        self.act_start = np.fromiter((activity.start_time for activity in activities), dtype=np.float64, count=m)
+        self.act_end = np.fromiter((activity.end_time for activity in activities), dtype=np.float64, count=m)
+        self.act_scheduled = np.fromiter(
+            (math.nan if activity.scheduled_start_time is None else activity.scheduled_start_time for activity in activities),
+            dtype=np.float64, count=m,
+        )
+        self.act_purpose = np.fromiter((self.purposes.encode(activity.purpose) for activity in activities), dtype=np.int16, count=m)
+        self.act_lon, self.act_lat = _coordinates([activity.location for activity in activities])
+        # activities whose scheduled start time changed since the last persisted state
+        self.dirty_activities: set[int] = set()
+
+        # state
+        self.last_lon = np.full(n, math.nan)
+        self.last_lat = np.full(n, math.nan)
+        self.last_activity_index = np.full(n, NO_CODE, dtype=np.int32)
+        self.current_activity = np.full(n, NO_CODE, dtype=np.int32)  # index of cache_current_activity
+        self.heading_to = np.full(n, NO_CODE, dtype=np.int16)
+        for row, person in enumerate(people):
+            self._write_state(row, person)
+
+        # views: kept for the LLM-based people, the scheduling caches (timetables) live as long as the view
+        self._views: Dict[int, Person] = {row: person for row, person in enumerate(people) if person.is_llm_based}
+        self.timetables: Dict[PersonId, object] = {}
+        self.views = PersonViews(self)
+
+    def __len__(self) -> int:
+        return len(self.person_ids)
+
+    def __contains__(self, person_id) -> bool:
+        return person_id in self.row_by_id
+
+    @property
+    def n_views(self) -> int:
+        return len(self._views)
+
+    def nbytes(self) -> int:
+        """Size of the NumPy columns"""
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+
+    # views
+
+    def materialize(self, row: int) -> Person:
+        """New Person view of a row, not cached"""
+        lo, hi = self.act_offsets[row], self.act_offsets[row + 1]
+        activities = [
+            Activity.model_construct(
+                id=self.act_ids[i],
+                scheduled_start_time=None if math.isnan(self.act_scheduled[i]) else float(self.act_scheduled[i]),
+                start_time=float(self.act_start[i]),
+                end_time=float(self.act_end[i]),
+                purpose=self.purposes.decode(self.act_purpose[i]),
+                location=_location(self.act_lon[i], self.act_lat[i]),
+            )
+            for i in range(lo, hi)
+        ]
+        current_activity = int(self.current_activity[row])
+        last_activity_index = int(self.last_activity_index[row])
+        traits = self.traits[row]
+        if isinstance(traits, str):
+            traits = self.traits[row] = json.loads(traits)
+        return Person.model_construct(
+            person_id=self.person_ids[row],
+            identity=PersonalIdentity.model_construct(
+                name=self.names[row],
+                traits_json=traits,
+                home=_location(self.home_lon[row], self.home_lat[row]),
+                activities=activities,
+            ),
+            state=PersonState.model_construct(
+                last_location=_location(self.last_lon[row], self.last_lat[row]),
+                last_activity_index=None if last_activity_index == NO_CODE else last_activity_index,
+                cache_current_activity=None if current_activity == NO_CODE else activities[current_activity],
+                heading_to=self.purposes.decode(self.heading_to[row]),
+            ),
+            is_llm_based=bool(self.is_llm_based[row]),
+        )
+
+    def get(self, person_id: PersonId) -> Optional[Person]:
+        """The view of a person, materialised and cached on first access"""
+        row = self.row_by_id.get(person_id)
+        if row is None:
+            return None
+        person = self._views.get(row)
+        if person is None:
+            person = self._views[row] = self.materialize(row)
+        return person
+
+    def is_view(self, person: Person) -> bool:
+        """Whether `person` is the cached view of its row"""
+        row = self.row_by_id.get(person.person_id)
+        return row is not None and self._views.get(row) is person
+
+    def people(self, rows: Iterable[int], cache: bool = True) -> List[Person]:
+        """Views of the rows; without `cache`, the people not already materialised get transient views"""
+        if cache:
+            return [self.get(self.person_ids[row]) for row in rows]
+        return [self._views.get(row) or self.materialize(row) for row in rows]
+
+    def write_back(self, person: Person, release: bool = False):
+        """Write the state and scheduled start times of a view to the columns, and drop a rule-based view on `release`"""
+        row = self.row_by_id.get(person.person_id)
+        if row is None:
+            return
+        self._write_state(row, person)
+        lo, hi = self.act_offsets[row], self.act_offsets[row + 1]
+        activities = person.identity.activities or []
+        if len(activities) == hi - lo:
+            scheduled = np.array([
+                math.nan if activity.scheduled_start_time is None else activity.scheduled_start_time
+                for activity in activities
+            ], dtype=np.float64)
+            previous = self.act_scheduled[lo:hi]
+            changed = np.flatnonzero((previous != scheduled) & ~(np.isnan(previous) & np.isnan(scheduled)))
+            if len(changed):
+                self.act_scheduled[lo:hi] = scheduled
+                self.dirty_activities.update((changed + lo).tolist())
+        if release and not self.is_llm_based[row]:
+            self._views.pop(row, None)
+            self.timetables.pop(person.person_id, None)
+
+    def _write_state(self, row: int, person: Person):
+        state = person.state
+        location = state.last_location
+        self.last_lon[row] = math.nan if location is None else location.lon
+        self.last_lat[row] = math.nan if location is None else location.lat
+        self.last_activity_index[row] = NO_CODE if state.last_activity_index is None else state.last_activity_index
+        self.heading_to[row] = self.purposes.encode(state.heading_to)
+        current_activity = NO_CODE
+        if state.cache_current_activity is not None:
+            lo, hi = self.act_offsets[row], self.act_offsets[row + 1]
+            for i in range(lo, hi):
+                if self.act_ids[i] == state.cache_current_activity.id:
+                    current_activity = i - lo
+                    break
+        self.current_activity[row] = current_activity
+
+    def sync_views(self):
+        """Write all the cached views back to the columns"""
+        for person in self._views.values():
+            self.write_back(person)
+
+    # bulk operations
+
+    def rows(self, idle: Optional[bool] = None, llm_based: Optional[bool] = None) -> np.ndarray:
+        """Rows matching the state flags, None matches both"""
+        mask = np.ones(len(self), dtype=bool)
+        if idle is not None:
+            mask &= (self.heading_to == NO_CODE) == idle
+        if llm_based is not None:
+            mask &= self.is_llm_based == llm_based
+        return np.flatnonzero(mask)
+
+    def is_idle(self, person_id: PersonId) -> bool:
+        row = self.row_by_id.get(person_id)
+        return row is not None and self.heading_to[row] == NO_CODE
+
+    def home_location(self, person_id: PersonId) -> Optional[Location]:
+        row = self.row_by_id[person_id]
+        return _location(self.home_lon[row], self.home_lat[row])
+
+    def start_from_home(self):
+        """Set the last location of everybody to the home location"""
+        self.last_lon[:] = self.home_lon
+        self.last_lat[:] = self.home_lat
+        for row, person in self._views.items():
+            person.state.last_location = _location(self.home_lon[row], self.home_lat[row])
+
+    def scheduled_start_time(self, activity: int) -> Optional[float]:
+        value = self.act_scheduled[activity]
+        return None if math.isnan(value) else float(value)
+
+    def pop_dirty_activities(self) -> List[int]:
+        dirty = sorted(self.dirty_activities)
+        self.dirty_activities.clear()
+        return dirty
+
+    def activity_rows(self) -> np.ndarray:
+        """Row of the person owning each activity"""
+        return np.repeat(np.arange(len(self)), np.diff(self.act_offsets))
+
+    def set_scheduled_start_times(self, scheduled_start_times: Dict[str, Optional[float]]) -> int:
+        """Scheduled start times by activity id, in the columns and the cached views; returns the number of updates"""
+        updated = 0
+        for i, activity_id in enumerate(self.act_ids):
+            if activity_id in scheduled_start_times:
+                value = scheduled_start_times[activity_id]
+                self.act_scheduled[i] = math.nan if value is None else value
+                updated += 1
+        for person in self._views.values():
+            for activity in person.identity.activities or []:
+                if activity.id in scheduled_start_times:
+                    activity.scheduled_start_time = scheduled_start_times[activity.id]
+        return updated
+
+    def save(self, file_path: str, source_hash: str):
+        """Save the people (identity and activities, not their state) as an npz cache file"""
+        tmp_file = f"{file_path}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(
+                f,
+                version=np.array(POPULATION_CACHE_VERSION),
+                source_hash=np.array(source_hash),
+                person_ids=np.array(self.person_ids, dtype=str),
+                names=np.array(self.names, dtype=str),
+                traits=np.array([t if isinstance(t, str) else json.dumps(t, ensure_ascii=False) for t in self.traits], dtype=str),
+                home_lon=self.home_lon,
+                home_lat=self.home_lat,
+                is_llm_based=self.is_llm_based,
+                purposes=np.array(self.purposes.purposes, dtype=str),
+                act_offsets=self.act_offsets,
+                act_ids=np.array(self.act_ids, dtype=str),
+                act_start=self.act_start,
+                act_end=self.act_end,
+                act_scheduled=self.act_scheduled,
+                act_purpose=self.act_purpose,
+                act_lon=self.act_lon,
+                act_lat=self.act_lat,
+            )
+        os.replace(tmp_file, file_path)
+
+    @classmethod
+    def load(cls, file_path: str, source_hash: Optional[str] = None) -> Optional["PopulationStore"]:
+        """
+        Load an npz cache file written by `save`, straight into the columns: the file is trusted, no Person is validated.
+        Returns None when the file is from another cache version or, given `source_hash`, from other source data.
+        """
+        with np.load(file_path, allow_pickle=False) as data:
+            if int(data["version"]) != POPULATION_CACHE_VERSION:
+                logger.warning(f"Population cache {file_path} has version {int(data['version'])}, expected {POPULATION_CACHE_VERSION}")
+                return None
+            if source_hash is not None and str(data["source_hash"]) != source_hash:
+                logger.warning(f"Population cache {file_path} was built from other source data")
+                return None
+
+            store = cls([])
+            store.person_ids = data["person_ids"].tolist()
+            store.row_by_id = {person_id: row for row, person_id in enumerate(store.person_ids)}
+            store.names = data["names"].tolist()
+            store.traits = data["traits"].tolist()
+            store.home_lon, store.home_lat = data["home_lon"], data["home_lat"]
+            store.is_llm_based = data["is_llm_based"]
+            for purpose in data["purposes"].tolist():
+                store.purposes.encode(purpose)
+            store.act_offsets = data["act_offsets"]
+            store.act_ids = data["act_ids"].tolist()
+            store.act_start, store.act_end = data["act_start"], data["act_end"]
+            store.act_scheduled = data["act_scheduled"]
+            store.act_purpose = data["act_purpose"]
+            store.act_lon, store.act_lat = data["act_lon"], data["act_lat"]
+
+        # default PersonState
+        n = len(store.person_ids)
+        store.last_lon = np.full(n, math.nan)
+        store.last_lat = np.full(n, math.nan)
+        store.last_activity_index = np.zeros(n, dtype=np.int32)
+        store.current_activity = np.full(n, NO_CODE, dtype=np.int32)
+        store.heading_to = np.full(n, NO_CODE, dtype=np.int16)
+        return store
+
+    def get_checkpoint_state(self) -> dict:
+        """State columns of the people, the views written back first"""
+        self.sync_views()
+        return {
+            "person_ids": self.person_ids,
+            "act_ids": self.act_ids,
+            "purposes": self.purposes.purposes,
+            "last_lon": self.last_lon,
+            "last_lat": self.last_lat,
+            "last_activity_index": self.last_activity_index,
+            "current_activity": self.current_activity,
+            "heading_to": self.heading_to,
+            "act_scheduled": self.act_scheduled,
+        }
+
+    def set_checkpoint_state(self, state: dict):
+        """Restore the state columns, matched by person and activity id; the cached views are rebuilt"""
+        rows = np.array([self.row_by_id.get(person_id, NO_CODE) for person_id in state["person_ids"]], dtype=np.int64)
+        found = rows != NO_CODE
+        if not found.all():
+            logger.warning(f"Checkpoint: {int((~found).sum())} people are not in the population, skipped")
+        # checkpoint purpose code -> code of this store, the trailing NO_CODE maps NO_CODE (-1)
+        heading_to = np.array([self.purposes.encode(purpose) for purpose in state["purposes"]] + [NO_CODE], dtype=np.int16)
+        self.last_lon[rows[found]] = state["last_lon"][found]
+        self.last_lat[rows[found]] = state["last_lat"][found]
+        self.last_activity_index[rows[found]] = state["last_activity_index"][found]
+        self.current_activity[rows[found]] = state["current_activity"][found]
+        self.heading_to[rows[found]] = heading_to[state["heading_to"][found]]
+
+        act_index = {activity_id: i for i, activity_id in enumerate(self.act_ids)}
+        acts = np.array([act_index.get(activity_id, NO_CODE) for activity_id in state["act_ids"]], dtype=np.int64)
+        found = acts != NO_CODE
+        self.act_scheduled[acts[found]] = state["act_scheduled"][found]
+        self.dirty_activities.clear()
+
+        for row in list(self._views):
+            self._views[row] = self.materialize(row)
+        self.timetables.clear()
+
+    def subset(self, person_ids: Iterable[PersonId]) -> "PopulationStore":
+        """New store with the given people, in the order of this store"""
+        keep = set(person_ids)
+        return PopulationStore(self.people(
+            (row for row, person_id in enumerate(self.person_ids) if person_id in keep),
+            cache=False,
+        ))